@@ -1,29 +1,43 @@
 # saxoバンクのOpenAPIを利用したFX取引（センバツ対応バージョン）
 # 04：アクセストークンのリフレッシュとWebsocketの再認可を追加
 import asyncio
+import atexit
 import base64
 import csv
 import collections
+import contextvars
+import copy
+import dataclasses
 import hashlib
+import heapq
 import json
 import math
+import mmap
 import os
 import platform
+import queue
 import random
 import re
 import secrets
 import shutil
+import sqlite3
 import subprocess
+import struct
 import sys
+import tempfile
 import threading
 import time
 import urllib.parse
 import webbrowser
+import zlib
+from contextlib import closing
 from dataclasses import dataclass
-from datetime import datetime, timedelta, timezone, time as dt_time
+from datetime import date, datetime, timedelta, timezone, time as dt_time
 from decimal import Decimal, ROUND_HALF_UP
+from email.utils import parsedate_to_datetime
+from enum import Enum
 from http.server import BaseHTTPRequestHandler, HTTPServer
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import requests
 import websockets
@@ -124,13 +138,37 @@ class EnvConfig:
     ws_ping_timeout: int
     ws_close_timeout: int
     ens_stale_seconds: int
-    ens_monitor_interval_seconds: int
+    ens_watchdog_min_seconds: float
+    ens_watchdog_gap_factor: float
     ens_notify_thresholds: List[int]
+    ens_notify_interval_seconds: int
     ens_reconnect_max_delay_seconds: int
     token_refresh_interval_seconds: int
     streaming_authorize_enabled: bool
     streaming_authorize_path: str
     streaming_authorize_param: str
+    sl_cancel_confirm_timeout_seconds: float
+    latency_budgets_ms: Dict[str, float]
+    portfolio_snapshot_max_age_seconds: float
+    audit_fallback_timeout_seconds: int
+    audit_grace_seconds: float
+    ens_backlog_ttl_seconds: float
+    ens_subscriber_queue_size: int
+    ens_subscriber_overflow: str
+    ens_journal_enabled: bool
+    ens_handler_workers: int
+    ens_reconnect_token_margin_seconds: float
+    streaming_prices_enabled: bool
+    streaming_quote_max_age_seconds: float
+    ens_handler_queue_size: int
+    ens_journal_resume_seconds: float
+    arm_lead_seconds: float
+    log_level: str
+    log_json_enabled: bool
+    daemon_mode: bool
+    daemon_rollover_time: str
+    history_db_path: str
+    reconcile_timeout_seconds: float
 
 
 def load_config() -> EnvConfig:
@@ -191,6 +229,19 @@ def load_config() -> EnvConfig:
             continue
     thresholds = sorted(set(thresholds)) or [10, 60, 180]
 
+    latency_budgets_raw = _get_env(
+        "SAXO_LATENCY_BUDGETS_MS", "quote_received=500,precheck_done=1000,order_ack=1500,fill_event=5000"
+    )
+    latency_budgets: Dict[str, float] = {}
+    for raw in latency_budgets_raw.split(","):
+        stage, sep, value = raw.partition("=")
+        if not sep or not stage.strip():
+            continue
+        try:
+            latency_budgets[stage.strip()] = float(value)
+        except ValueError:
+            continue
+
     return EnvConfig(
         use_live=use_live,
         client_id=client_id,
@@ -220,14 +271,41 @@ def load_config() -> EnvConfig:
         ws_ping_timeout=_get_env_int("SAXO_WS_PING_TIMEOUT", 5),
         ws_close_timeout=_get_env_int("SAXO_WS_CLOSE_TIMEOUT", 5),
         ens_stale_seconds=_get_env_int("SAXO_ENS_STALE_SECONDS", 45),
-        ens_monitor_interval_seconds=_get_env_int("SAXO_ENS_MONITOR_INTERVAL_SECONDS", 10),
+        # Saxo の _heartbeat 間隔より十分長く取る(短いと通常の無通信時間で再接続してしまう)
+        ens_watchdog_min_seconds=_get_env_float("SAXO_ENS_WATCHDOG_MIN_SECONDS", 25.0),
+        ens_watchdog_gap_factor=_get_env_float("SAXO_ENS_WATCHDOG_GAP_FACTOR", 2.0),
         ens_notify_thresholds=thresholds,
+        ens_notify_interval_seconds=_get_env_int("SAXO_ENS_NOTIFY_INTERVAL_SECONDS", 5),
         ens_reconnect_max_delay_seconds=_get_env_int("SAXO_ENS_RECONNECT_MAX_DELAY", 30),
         token_refresh_interval_seconds=_get_env_int("SAXO_TOKEN_REFRESH_INTERVAL_SECONDS", 18 * 60),
         streaming_authorize_enabled=_get_env_bool("SAXO_STREAMING_AUTHORIZE_ENABLED", True),
         streaming_authorize_path=_get_env("SAXO_STREAMING_AUTHORIZE_PATH", "/streamingws/authorize")
         or "/streamingws/authorize",
         streaming_authorize_param=_get_env("SAXO_STREAMING_AUTHORIZE_PARAM", "contextId") or "contextId",
+        sl_cancel_confirm_timeout_seconds=_get_env_float("SAXO_SL_CANCEL_CONFIRM_TIMEOUT", 3.0),
+        latency_budgets_ms=latency_budgets,
+        portfolio_snapshot_max_age_seconds=_get_env_float("SAXO_PORTFOLIO_SNAPSHOT_MAX_AGE", 2.0),
+        audit_fallback_timeout_seconds=_get_env_int("SAXO_AUDIT_FALLBACK_TIMEOUT_SECONDS", 20),
+        audit_grace_seconds=_get_env_float("SAXO_AUDIT_GRACE_SECONDS", 5.0),
+        ens_backlog_ttl_seconds=_get_env_float("SAXO_ENS_BACKLOG_TTL_SECONDS", 300.0),
+        ens_subscriber_queue_size=_get_env_int("SAXO_ENS_SUBSCRIBER_QUEUE_SIZE", 1000),
+        ens_subscriber_overflow=_get_env("SAXO_ENS_SUBSCRIBER_OVERFLOW", "drop_oldest"),
+        ens_journal_enabled=_get_env_bool("SAXO_ENS_JOURNAL_ENABLED", True),
+        ens_handler_workers=_get_env_int("SAXO_ENS_HANDLER_WORKERS", 4),
+        ens_reconnect_token_margin_seconds=_get_env_float("SAXO_ENS_RECONNECT_TOKEN_MARGIN_SECONDS", 300.0),
+        streaming_prices_enabled=_get_env_bool("SAXO_STREAMING_PRICES_ENABLED", True),
+        streaming_quote_max_age_seconds=_get_env_float("SAXO_STREAMING_QUOTE_MAX_AGE_SECONDS", 60.0),
+        ens_handler_queue_size=_get_env_int("SAXO_ENS_HANDLER_QUEUE_SIZE", 1024),
+        ens_journal_resume_seconds=_get_env_float("SAXO_ENS_JOURNAL_RESUME_SECONDS", 60.0),
+        # ポートフォリオスナップショットの有効期間(SAXO_PORTFOLIO_SNAPSHOT_MAX_AGE)より短くする
+        arm_lead_seconds=_get_env_float("SAXO_ARM_LEAD_SECONDS", 1.5),
+        log_level=(_get_env("SAXO_LOG_LEVEL", "INFO") or "INFO").upper(),
+        log_json_enabled=_get_env_bool("SAXO_LOG_JSON", True),
+        daemon_mode=_get_env_bool("SAXO_DAEMON_MODE", False),
+        daemon_rollover_time=_get_env("SAXO_DAEMON_ROLLOVER_TIME", "00:01") or "00:01",
+        # 空文字で取引履歴DBを無効化する
+        history_db_path=_get_env("SAXO_HISTORY_DB", "saxo_trade_history.sqlite3") or "",
+        reconcile_timeout_seconds=_get_env_float("SAXO_RECONCILE_TIMEOUT_SECONDS", 15.0),
     )
 
 
@@ -353,7 +431,7 @@ def _cleanup_old_logs(log_dir: str, keep_days: int = 7) -> None:
     try:
         cutoff_date = datetime.now(TIMEZONE_TOKYO).date() - timedelta(days=keep_days - 1)
         for filename in os.listdir(log_dir):
-            if not filename.startswith("saxo_fx_log_") or not filename.endswith(".log"):
+            if not filename.startswith("saxo_fx_log_") or not filename.endswith((".log", ".jsonl")):
                 continue
             parts = filename.split("_")
             if len(parts) < 4:
@@ -384,19 +462,242 @@ def extract_hms_jst(ts: Optional[str]) -> str:
     except Exception:
         return s
 
-def log(message: str) -> None:
-    timestamp = get_jst_time_str()
-    line = f"[{timestamp}] {message}"
-    print(line)
-    try:
-        log_dir = os.getcwd()
-        log_filename = _get_log_filename()
-        log_path = os.path.join(log_dir, log_filename)
-        with open(log_path, "a", encoding="utf-8") as f:
+LOG_LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+_LOG_LEVEL_NAMES = {value: name for name, value in LOG_LEVELS.items()}
+# 取引の相関ID(trade_id / order_id / uic)。タスク・to_thread には作成時点の値が引き継がれる
+_LOG_CONTEXT: contextvars.ContextVar = contextvars.ContextVar("log_context", default={})
+
+
+def set_log_context(**fields: Any) -> None:
+    # 現在のタスクの相関IDを置き換える。None の項目は含めない
+    _LOG_CONTEXT.set({key: value for key, value in fields.items() if value is not None})
+
+
+class BufferedLogWriter:
+    # log() は時刻・レベル・書式と引数をキューへ積むだけにし、文字列化と出力は専用スレッドがまとめて行う。
+    # 画面とテキストログには従来の1行形式、.jsonl には相関IDと追加項目を含むJSON Linesを書く。
+    # ファイルは開いたまま保持し、JSTの日付が変わった行でファイルを切り替えて古いログを1回だけ整理する。
+    def __init__(
+        self,
+        log_dir: Optional[str] = None,
+        flush_interval: float = 0.5,
+        batch_size: int = 512,
+        keep_days: int = 7,
+        stream=None,
+        min_level: str = "INFO",
+        json_enabled: bool = True,
+    ):
+        self.log_dir = log_dir
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.keep_days = keep_days
+        self.stream = stream
+        self.min_level = LOG_LEVELS.get(min_level, LOG_LEVELS["INFO"])
+        self.json_enabled = json_enabled
+        self.written = 0
+        self.rotations = 0
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._file = None
+        self._json_file = None
+        self._rotate_at = 0.0
+        self._stamp_second = -1
+        self._stamp = ""
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def write(
+        self,
+        message: str,
+        args: Tuple[Any, ...] = (),
+        level: int = LOG_LEVELS["INFO"],
+        fields: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        # 引数・追加項目は呼び出し後に変更しない値を渡すこと(文字列化は書き込みスレッドで行う)
+        if self._thread is None:
+            self._start()
+        self._queue.put((time.time(), level, message, args, fields))
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+
+    def close(self) -> None:
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+        self._thread = None
+
+    def _format(self, ts: float, level: int, message: str, args: Tuple[Any, ...], fields) -> Tuple[str, Optional[str]]:
+        second = int(ts)
+        if second != self._stamp_second:
+            self._stamp_second = second
+            self._stamp = datetime.fromtimestamp(second, TIMEZONE_TOKYO).strftime("%Y-%m-%d %H:%M:%S")
+        if args:
+            try:
+                message = message % args
+            except (TypeError, ValueError):
+                message = f"{message} {args!r}"
+        text = f"[{self._stamp}] {message}"
+        extra = {key: value for key, value in (fields or {}).items() if key not in _LOG_CORRELATION_KEYS}
+        if extra:
+            text += " " + " ".join(f"{key}={value}" for key, value in extra.items())
+        if not self.json_enabled:
+            return text, None
+        record = {
+            "ts": datetime.fromtimestamp(ts, TIMEZONE_TOKYO).isoformat(timespec="milliseconds"),
+            "level": _LOG_LEVEL_NAMES.get(level, str(level)),
+            "msg": message,
+        }
+        if fields:
+            record.update(fields)
+        return text, json.dumps(record, ensure_ascii=False, default=str)
+
+    def _open(self, ts: float) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self.rotations += 1
+        if self._json_file is not None:
+            self._json_file.close()
+            self._json_file = None
+        now = datetime.fromtimestamp(ts, TIMEZONE_TOKYO)
+        log_dir = self.log_dir or os.getcwd()
+        self._rotate_at = (now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)).timestamp()
+        filename = _get_log_filename(now)
+        try:
+            self._file = open(os.path.join(log_dir, filename), "a", encoding="utf-8")
+            if self.json_enabled:
+                self._json_file = open(os.path.join(log_dir, filename[: -len(".log")] + ".jsonl"), "a", encoding="utf-8")
+        except OSError as e:
+            print(f"[{get_jst_time_str()}] ログファイル出力に失敗しました: {e}")
+        _cleanup_old_logs(log_dir, self.keep_days)
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = []
+            while True:
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            self._flush(batch)
+        for f in (self._file, self._json_file):
+            if f is not None:
+                f.close()
+        self._file = self._json_file = None
+
+    def _flush(self, batch: List[Tuple[float, int, str, Tuple[Any, ...], Optional[Dict[str, Any]]]]) -> None:
+        lines: List[str] = []
+        records: List[str] = []
+        for ts, level, message, args, fields in batch:
+            if ts >= self._rotate_at:
+                # 日付が変わる行の手前までを旧ファイルへ書き出してから切り替える
+                self._write_lines(lines, records)
+                lines = []
+                records = []
+                self._open(ts)
+            try:
+                text, record = self._format(ts, level, message, args, fields)
+            except Exception as e:
+                text, record = f"[{self._stamp}] ログの整形に失敗しました: {message!r} ({e})", None
+            lines.append(text)
+            if record is not None:
+                records.append(record)
+        self._write_lines(lines, records)
+
+    def _write_lines(self, lines: List[str], records: List[str]) -> None:
+        if not lines:
+            return
+        text = "\n".join(lines) + "\n"
+        try:
+            (self.stream or sys.stdout).write(text)
+        except Exception:
+            pass
+        try:
+            if self._file is not None:
+                self._file.write(text)
+                self._file.flush()
+            if self._json_file is not None and records:
+                self._json_file.write("\n".join(records) + "\n")
+                self._json_file.flush()
+        except OSError as e:
+            print(f"[{get_jst_time_str()}] ログファイル出力に失敗しました: {e}")
+        self.written += len(lines)
+
+
+_LOG_CORRELATION_KEYS = ("trade_id", "order_id", "uic")
+_LOG_WRITER = BufferedLogWriter(min_level=CFG.log_level, json_enabled=CFG.log_json_enabled)
+atexit.register(_LOG_WRITER.close)
+
+
+def log(message: str, *args: Any, level: str = "INFO", **fields: Any) -> None:
+    # 書式は "%s" 形式で args を遅延適用する。fields は JSON Lines の項目になり、相関ID以外はテキストにも付記する
+    levelno = LOG_LEVELS.get(level, LOG_LEVELS["INFO"])
+    if levelno < _LOG_WRITER.min_level:
+        return
+    context = _LOG_CONTEXT.get()
+    _LOG_WRITER.write(message, args, levelno, {**context, **fields} if fields else context)
+
+
+def benchmark_log_writer(lines: int = 20_000, repeat: int = 3) -> List[str]:
+    # 旧 log()(1行ごとに print・open/append/close・古いログ整理)と BufferedLogWriter を比較する。
+    # 呼び出し側の所要時間はイベントループを止めている時間、drain は書き込み完了までを含めた時間。
+    import tempfile
+
+    message = "ENS Orderイベント受信: " + json.dumps({"OrderId": "5012345678", "Status": "FinalFill", "Uic": 21})
+
+    def _legacy_log(log_dir: str, sink) -> None:
+        timestamp = get_jst_time_str()
+        line = f"[{timestamp}] {message}"
+        print(line, file=sink)
+        with open(os.path.join(log_dir, _get_log_filename()), "a", encoding="utf-8") as f:
             f.write(line + "\n")
         _cleanup_old_logs(log_dir)
-    except Exception as e:
-        print(f"[{timestamp}] ログファイル出力に失敗しました: {e}")
+
+    result = ["ログ出力ベンチマーク (呼び出し時間はイベントループを止める時間、最速回の値)"]
+    with open(os.devnull, "w", encoding="utf-8") as sink:
+        for label in ("legacy", "buffered"):
+            best: Optional[Tuple[float, float, List[float]]] = None
+            for _ in range(repeat):
+                with tempfile.TemporaryDirectory() as log_dir:
+                    writer = BufferedLogWriter(log_dir=log_dir, stream=sink) if label == "buffered" else None
+                    calls: List[float] = []
+                    started = time.perf_counter()
+                    for _ in range(lines):
+                        t0 = time.perf_counter()
+                        if writer is not None:
+                            writer.write(message)
+                        else:
+                            _legacy_log(log_dir, sink)
+                        calls.append(time.perf_counter() - t0)
+                    caller = time.perf_counter() - started
+                    if writer is not None:
+                        writer.close()
+                    drain = time.perf_counter() - started
+                if best is None or drain < best[1]:
+                    best = (caller, drain, calls)
+            caller, drain, calls = best
+            calls.sort()
+            result.append(
+                f"{label:<8} {lines / drain:>10,.0f} lines/s  呼び出し合計={caller * 1000:,.1f}ms "
+                f"p50={_percentile(calls, 50) * 1e6:.1f}us p99={_percentile(calls, 99) * 1e6:.1f}us "
+                f"max={calls[-1] * 1e6:,.0f}us  drain={drain * 1000:,.1f}ms"
+            )
+    return result
 
 def _mask(s: str, keep: int = 4) -> str:
     if not s:
@@ -416,22 +717,337 @@ def _mask_url_query(url: str, keys: Tuple[str, ...] = ("code", "state")) -> str:
     return urllib.parse.urlunparse(parsed._replace(query=urllib.parse.urlencode(qs, doseq=True)))
 
 
+DISCORD_MESSAGE_LIMIT = 2000
+
+
+def _coalesce_discord_messages(messages: Iterable[str], limit: int = DISCORD_MESSAGE_LIMIT) -> List[str]:
+    # 上限を超える通知は改行位置を優先して分割し、残りは上限まで空行区切りで1通にまとめる
+    pieces: List[str] = []
+    for message in messages:
+        while len(message) > limit:
+            cut = message.rfind("\n", 0, limit)
+            if cut <= 0:
+                cut = limit
+            pieces.append(message[:cut])
+            message = message[cut:].lstrip("\n")
+        if message:
+            pieces.append(message)
+    batches: List[str] = []
+    for piece in pieces:
+        if batches and len(batches[-1]) + 2 + len(piece) <= limit:
+            batches[-1] += "\n\n" + piece
+        else:
+            batches.append(piece)
+    return batches
+
+
+class DiscordNotifier:
+    # 通知をキューへ積んですぐに戻り、専用スレッドが keep-alive のセッションで送る。
+    # 短時間に積まれた通知は2000文字以内で1通にまとめる。429 は Retry-After だけ待って同じ内容を送り直す。
+    # キューが満杯の時は最も古い通知を捨てる(取引処理を待たせない)。
+    def __init__(
+        self,
+        webhook_url: Optional[str],
+        queue_size: int = 100,
+        max_retries: int = 3,
+        coalesce_seconds: float = 0.2,
+    ):
+        self.webhook_url = webhook_url
+        self.max_retries = max_retries
+        self.coalesce_seconds = coalesce_seconds
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.rate_limited = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._closing = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, message: str) -> bool:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="discord-notifier", daemon=True)
+                    self._thread.start()
+        while True:
+            try:
+                self._queue.put_nowait(message)
+                return True
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def close(self, timeout: float = 10.0) -> None:
+        # 終了時は積まれている通知を送り切るまで(最大 timeout 秒)待つ
+        if self._thread is None:
+            return
+        self._closing.set()
+        self._thread.join(timeout=timeout)
+        self._thread = None
+        if self.dropped or self.failed:
+            log(f"Discord通知の未送信: 破棄={self.dropped}件, 失敗={self.failed}件")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self._queue.qsize(),
+            "sent": self.sent,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "rate_limited": self.rate_limited,
+        }
+
+    def _run(self) -> None:
+        session = requests.Session()
+        while True:
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._closing.is_set():
+                    break
+                continue
+            if not self._closing.is_set():
+                time.sleep(self.coalesce_seconds)
+            pending = [first]
+            while True:
+                try:
+                    pending.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            for content in _coalesce_discord_messages(pending):
+                self._post(session, content)
+        session.close()
+
+    def _post(self, session, content: str) -> bool:
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = session.post(self.webhook_url, json={"content": content}, timeout=10)
+            except requests.exceptions.RequestException as e:
+                log(f"Discord通知エラー: {str(e)}")
+                time.sleep(min(2**attempt, 10))
+                continue
+            if response.status_code == 429:
+                self.rate_limited += 1
+                retry_after = _discord_retry_after(response)
+                log(f"Discordのレート制限 (429)。{retry_after:.1f}秒待機後に再送します。")
+                time.sleep(retry_after)
+                continue
+            if response.status_code >= 500:
+                log(f"Discordサーバーエラー ({response.status_code})。再送します。")
+                time.sleep(min(2**attempt, 10))
+                continue
+            if response.status_code in [200, 204]:
+                self.sent += 1
+                log(f"Discord通知を送信しました。ステータス: {response.status_code}")
+                if response.headers.get("X-RateLimit-Remaining") == "0":
+                    # バケットを使い切った場合は次の送信で429にならないよう回復まで待つ
+                    time.sleep(_discord_retry_after(response, "X-RateLimit-Reset-After"))
+                return True
+            log(f"Discord通知エラー: ステータス {response.status_code} {response.text[:200]}")
+            break
+        self.failed += 1
+        return False
+
+
+def _discord_retry_after(response, header: str = "Retry-After") -> float:
+    try:
+        return max(float(response.headers.get(header)), 0.0)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(float(response.json().get("retry_after", 1.0)), 0.0)
+    except Exception:
+        return 1.0
+
+
+_DISCORD = DiscordNotifier(CFG.discord_webhook_url)
+atexit.register(_DISCORD.close)
+
+
 def send_discord(message: str) -> bool:
+    # 送信は DiscordNotifier のスレッドが行う。戻り値は送信キューに積めたかどうか
     if not CFG.discord_webhook_url:
         log("Discord Webhook URLが設定されていません。通知をスキップします。")
         return False
-    try:
-        payload = {"content": message}
-        response = requests.post(CFG.discord_webhook_url, json=payload, timeout=10)
-        response.raise_for_status()
-        log(f"Discord通知を送信しました。ステータス: {response.status_code}")
-        return response.status_code in [200, 204]
-    except requests.exceptions.RequestException as e:
-        log(f"Discord通知エラー: {str(e)}")
-        return False
-    except Exception as e:
-        log(f"Discord通知中に予期せぬエラーが発生しました: {str(e)}")
-        return False
+    return _DISCORD.submit(message)
+
+
+ENTRY_STAGES = (
+    "timer_fire",
+    "quote_received",
+    "precheck_done",
+    "order_sent",
+    "order_ack",
+    "fill_event",
+    "position_resolved",
+)
+EXIT_STAGES = (
+    "timer_fire",
+    "position_checked",
+    "precheck_done",
+    "order_sent",
+    "order_ack",
+    "fill_event",
+    "flat_confirmed",
+)
+
+
+class StageClock:
+    # 各ステージの所要時間(直前に記録されたステージからの差分)を durations_ms に書き込む
+    __slots__ = ("label", "stages", "durations_ms", "_marks", "_origin")
+
+    def __init__(self, label: str, stages: Tuple[str, ...], durations_ms: Dict[str, float]):
+        self.label = label
+        self.stages = stages
+        self.durations_ms = durations_ms
+        self._marks: Dict[str, int] = {}
+        self._origin = (time.time(), time.perf_counter_ns())
+
+    def mark(self, stage: str) -> None:
+        now_ns = time.perf_counter_ns()
+        self._marks[stage] = now_ns
+        index = self.stages.index(stage)
+        previous_ns = next((self._marks[s] for s in reversed(self.stages[:index]) if s in self._marks), None)
+        if previous_ns is None:
+            return
+        elapsed_ms = (now_ns - previous_ns) / 1_000_000
+        self.durations_ms[stage] = round(elapsed_ms, 3)
+        budget_ms = CFG.latency_budgets_ms.get(stage)
+        if budget_ms is not None and elapsed_ms > budget_ms:
+            # 発注経路の途中で呼ばれるため通知は送らず記録のみ。超過件数は日次サマリーで報告する
+            log(
+                "⏱️ レイテンシ予算超過: %s %s=%.1fms (予算 %.0fms)", self.label, stage, elapsed_ms, budget_ms, level="WARNING"
+            )
+
+    def wall_time(self, stage: str) -> Optional[float]:
+        # ステージ記録時点の壁時計(epoch秒)。記録がなければ None
+        mark_ns = self._marks.get(stage)
+        if mark_ns is None:
+            return None
+        return self._origin[0] + (mark_ns - self._origin[1]) / 1_000_000_000
+
+    def total_ms(self) -> Optional[float]:
+        if len(self._marks) < 2:
+            return None
+        return (max(self._marks.values()) - min(self._marks.values())) / 1_000_000
+
+    def describe(self) -> str:
+        parts = [f"{stage}={self.durations_ms[stage]:.1f}ms" for stage in self.stages if stage in self.durations_ms]
+        total = self.total_ms()
+        if total is not None:
+            parts.append(f"合計={total:.1f}ms")
+        return ", ".join(parts)
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize_stage_latencies(samples: Iterable[Dict[str, float]], stages: Tuple[str, ...]) -> List[str]:
+    by_stage: Dict[str, List[float]] = {stage: [] for stage in stages}
+    for durations in samples:
+        for stage, value in (durations or {}).items():
+            if stage in by_stage and value is not None:
+                by_stage[stage].append(float(value))
+    lines = []
+    for stage in stages:
+        values = sorted(by_stage[stage])
+        if not values:
+            continue
+        budget_ms = CFG.latency_budgets_ms.get(stage)
+        over_budget = sum(1 for value in values if value > budget_ms) if budget_ms is not None else 0
+        lines.append(
+            f"{stage}: p50={_percentile(values, 50):.1f} p90={_percentile(values, 90):.1f} "
+            f"p99={_percentile(values, 99):.1f} max={values[-1]:.1f} ms (n={len(values)})"
+            + (f" 予算超過={over_budget}件" if over_budget else "")
+        )
+    return lines
+
+
+class BrokerClock:
+    # RESTレスポンスの Date ヘッダーと往復時間からブローカー時計とのずれ(offset = ブローカー時刻 - ローカル時刻)を推定する。
+    # Date は秒単位なので、1件ごとに「送信〜受信の間にブローカー時計が [Date, Date+1) にあった」という区間制約になる。
+    # 新しいサンプルから順に区間を重ね、矛盾が出たところで打ち切る(ローカル時計のドリフトや補正に追従するため)。
+    # 片道遅延は RTT の下位25パーセンタイルの半分とし、種別ごとの実到達誤差から発火前倒し量を学習する。
+    WINDOW = 32
+    MAX_SAMPLE_AGE_SECONDS = 1800.0
+    BIAS_GAIN = 0.5
+    MAX_BIAS_SECONDS = 1.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples: collections.deque = collections.deque(maxlen=self.WINDOW)
+        self._bias: Dict[str, float] = {}
+        self.offset = 0.0
+        self.uncertainty: Optional[float] = None
+        self.half_rtt = 0.0
+        self.version = 0
+
+    def observe(self, sent: float, received: float, date_header: Optional[str]) -> None:
+        # sent/received はローカル壁時計(epoch秒)
+        if not date_header:
+            return
+        try:
+            broker_second = parsedate_to_datetime(date_header).timestamp()
+        except (TypeError, ValueError):
+            return
+        with self._lock:
+            self._samples.append((received, broker_second - received, broker_second + 1.0 - sent, received - sent))
+            self._recompute(received)
+
+    def _recompute(self, now: float) -> None:
+        while self._samples and now - self._samples[0][0] > self.MAX_SAMPLE_AGE_SECONDS:
+            self._samples.popleft()
+        if not self._samples:
+            return
+        low, high = float("-inf"), float("inf")
+        for _, sample_low, sample_high, _ in reversed(self._samples):
+            if max(low, sample_low) > min(high, sample_high):
+                break
+            low, high = max(low, sample_low), min(high, sample_high)
+        self.offset = (low + high) / 2
+        self.uncertainty = (high - low) / 2
+        rtts = sorted(sample[3] for sample in self._samples)
+        self.half_rtt = _percentile(rtts, 25) / 2
+        self.version += 1
+
+    def now(self) -> float:
+        return time.time() + self.offset
+
+    def lead_seconds(self, kind: str) -> float:
+        # 到達時刻を予定時刻に合わせるための前倒し量(片道遅延 + 発火から送信までの学習値)
+        return self.half_rtt + self._bias.get(kind, 0.0)
+
+    def next_probe_delay(self) -> float:
+        # 次のリクエストがブローカー側の秒の変わり目に届くまでの待ち時間。境界付近の Date が区間を最も狭める
+        return (-(self.now() + self.half_rtt)) % 1.0
+
+    def record_arrival(self, kind: str, due: float, sent: Optional[float]) -> Optional[float]:
+        # due はブローカー時刻(epoch秒)、sent は送信時のローカル壁時計。推定到達誤差(ms, 正=遅着)を返す
+        if sent is None:
+            return None
+        with self._lock:
+            error = sent + self.half_rtt + self.offset - due
+            # 再発注などで大きく外れた値は学習に使わない
+            if abs(error) < self.MAX_BIAS_SECONDS:
+                bias = self._bias.get(kind, 0.0) + self.BIAS_GAIN * error
+                self._bias[kind] = min(max(bias, 0.0), self.MAX_BIAS_SECONDS)
+                self.version += 1
+        return round(error * 1000, 1)
+
+    def describe(self) -> str:
+        if self.uncertainty is None:
+            return "未同期"
+        return (
+            f"offset={self.offset * 1000:+.1f}ms ±{self.uncertainty * 1000:.1f}ms "
+            f"片道={self.half_rtt * 1000:.1f}ms サンプル={len(self._samples)}"
+        )
 
 
 def cleanup_edge_user_data_dir():
@@ -508,6 +1124,870 @@ def kill_existing_edge_drivers():
             log(f"タスクキル中のエラー: {e}")
 
 
+WORKING_ORDER_STATUSES = frozenset({"Working", "Placed", "Queued"})
+
+
+class PortfolioSnapshot:
+    # 口座全体のポジション/注文を1組のページング照会で取得し、UIC・OrderId・SourceOrderId で引けるようにする
+    def __init__(self, client: "SaxoClient", max_age_seconds: float):
+        self._client = client
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        self._fetched_at: float = 0.0
+        self._generation = 0
+        self._fetched_generation = -1
+        self.positions_by_uic: Dict[int, List[Dict]] = {}
+        self.positions_by_source_order_id: Dict[str, Dict] = {}
+        self.orders_by_uic: Dict[int, List[Dict]] = {}
+        self.orders_by_id: Dict[str, Dict] = {}
+        self.orders_by_external_reference: Dict[str, Dict] = {}
+        self.refresh_count = 0
+
+    def invalidate(self) -> None:
+        self._generation += 1
+
+    def ensure_fresh(self, max_age: Optional[float] = None) -> bool:
+        max_age = self.max_age_seconds if max_age is None else max_age
+        with self._lock:
+            if self._fetched_generation == self._generation and time.monotonic() - self._fetched_at <= max_age:
+                return True
+            return self._refresh_locked()
+
+    def _refresh_locked(self) -> bool:
+        generation = self._generation
+        client = self._client
+        base_params = {"AccountKey": client.account_key, "ClientKey": client.client_key, "$top": 1000}
+        positions = client._get_paged(
+            "/port/v1/positions", {**base_params, "FieldGroups": "PositionBase,PositionView"}
+        )
+        orders = client._get_paged("/port/v1/orders", dict(base_params))
+        if positions is None or orders is None:
+            log("ポートフォリオスナップショットの更新に失敗しました。直前のスナップショットを使用します。")
+            return False
+
+        positions_by_uic: Dict[int, List[Dict]] = {}
+        positions_by_source_order_id: Dict[str, Dict] = {}
+        for position in positions:
+            pos_base = position.get("PositionBase", {})
+            uic = pos_base.get("Uic")
+            if uic is not None:
+                positions_by_uic.setdefault(int(uic), []).append(position)
+            source_order_id = pos_base.get("SourceOrderId")
+            if source_order_id:
+                positions_by_source_order_id[str(source_order_id)] = position
+
+        orders_by_uic: Dict[int, List[Dict]] = {}
+        orders_by_id: Dict[str, Dict] = {}
+        orders_by_external_reference: Dict[str, Dict] = {}
+        for order in orders:
+            uic = order.get("Uic")
+            if uic is not None:
+                orders_by_uic.setdefault(int(uic), []).append(order)
+            if order.get("OrderId"):
+                orders_by_id[str(order["OrderId"])] = order
+            if order.get("ExternalReference"):
+                orders_by_external_reference[order["ExternalReference"]] = order
+
+        self.positions_by_uic = positions_by_uic
+        self.positions_by_source_order_id = positions_by_source_order_id
+        self.orders_by_uic = orders_by_uic
+        self.orders_by_id = orders_by_id
+        self.orders_by_external_reference = orders_by_external_reference
+        self._fetched_at = time.monotonic()
+        self._fetched_generation = generation
+        self.refresh_count += 1
+        log(f"ポートフォリオスナップショット更新: positions={len(positions)}件, orders={len(orders)}件")
+        return True
+
+    def positions_for_uic(self, uic: int, max_age: Optional[float] = None) -> List[Dict]:
+        self.ensure_fresh(max_age)
+        return list(self.positions_by_uic.get(int(uic), []))
+
+    def position_for_source_order(self, order_id: str, max_age: Optional[float] = None) -> Optional[Dict]:
+        self.ensure_fresh(max_age)
+        return self.positions_by_source_order_id.get(str(order_id))
+
+    def working_orders_for_uic(self, uic: int, max_age: Optional[float] = None) -> List[Dict]:
+        self.ensure_fresh(max_age)
+        return [o for o in self.orders_by_uic.get(int(uic), []) if o.get("Status") in WORKING_ORDER_STATUSES]
+
+    def order_by_external_reference(self, external_reference: str, max_age: Optional[float] = None) -> Optional[Dict]:
+        self.ensure_fresh(max_age)
+        return self.orders_by_external_reference.get(external_reference)
+
+
+class ClosedPositionsReader:
+    # ClosedPositionsは当日の決済分だけを返し、UICや日付でのサーバー側フィルタはないため、AccountKey/ClientKeyで絞って辿る。
+    # 取得済みの決済ポジションはキャッシュし、$inlinecount で得た総件数がすべて既知になった時点で取得を打ち切る。
+    # 並び順は指定できないため、既知の項目だけのページが出ても残りのページが既知とは限らない(件数で判定する)。
+    def __init__(self, client: "SaxoClient", page_size: int = 200, max_pages: int = 10):
+        self._client = client
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self._lock = threading.Lock()
+        self._cache_date: Optional[str] = None
+        self._by_id: Dict[str, Dict] = {}
+        self._by_uic: Dict[int, List[Dict]] = {}
+        self._by_opening_position_id: Dict[str, Dict] = {}
+
+    @staticmethod
+    def _closed_position_id(item: Dict) -> Optional[str]:
+        closed = item.get("ClosedPosition") or {}
+        value = item.get("ClosedPositionUniqueId") or closed.get("ClosedPositionId") or item.get("ClosedPositionId")
+        return str(value) if value else None
+
+    def _reset_if_new_day(self) -> None:
+        today = get_jst_time_str().split(" ")[0]
+        if self._cache_date != today:
+            self._cache_date = today
+            self._clear()
+
+    def _clear(self) -> None:
+        self._by_id = {}
+        self._by_uic = {}
+        self._by_opening_position_id = {}
+
+    def _add(self, item: Dict) -> None:
+        closed = item.get("ClosedPosition") or {}
+        uic = closed.get("Uic", item.get("Uic"))
+        if uic is not None:
+            self._by_uic.setdefault(int(uic), []).append(item)
+        opening_position_id = closed.get("OpeningPositionId")
+        if opening_position_id:
+            self._by_opening_position_id[str(opening_position_id)] = item
+
+    def refresh(self) -> bool:
+        client = self._client
+        params: Dict[str, Any] = {
+            "AccountKey": client.account_key,
+            "ClientKey": client.client_key,
+            "FieldGroups": "ClosedPosition",
+            "$top": self.page_size,
+            "$inlinecount": "AllPages",
+        }
+        with self._lock:
+            self._reset_if_new_day()
+            pages = 0
+            new_items = 0
+            total: Optional[int] = None
+            while pages < self.max_pages:
+                data = client._make_request("GET", "/port/v1/closedpositions", params=params)
+                pages += 1
+                if not isinstance(data, dict) or "Data" not in data:
+                    log("ClosedPositionsの取得に失敗しました。")
+                    return False
+                if total is None and isinstance(data.get("__count"), int):
+                    total = data["__count"]
+                    if total < len(self._by_id):
+                        # サーバー側の当日分が切り替わった(キャッシュの方が多い)ため作り直す
+                        self._clear()
+                page_new = 0
+                for item in data["Data"]:
+                    closed_id = self._closed_position_id(item)
+                    if closed_id is None or closed_id in self._by_id:
+                        continue
+                    self._by_id[closed_id] = item
+                    self._add(item)
+                    page_new += 1
+                new_items += page_new
+                # 総件数がすべてキャッシュ済みなら、どの順で返されていても残りのページに未知の項目はない
+                if total is not None and len(self._by_id) >= total:
+                    break
+                next_url = data.get("__next")
+                if not next_url:
+                    break
+                next_query = urllib.parse.parse_qs(urllib.parse.urlparse(next_url).query)
+                params = {**params, **{key: values[0] for key, values in next_query.items()}}
+            log(
+                f"ClosedPositions更新: 取得ページ={pages}, 新規={new_items}件, "
+                f"キャッシュ={len(self._by_id)}件, 総件数={total if total is not None else '不明'}"
+            )
+            return True
+
+    def for_uic(self, uic: int, refresh: bool = True) -> List[Dict]:
+        if refresh:
+            self.refresh()
+        return list(self._by_uic.get(int(uic), []))
+
+    def find_by_opening_position_id(self, position_id: str, refresh: bool = True) -> Optional[Dict]:
+        if not position_id:
+            return None
+        if refresh and str(position_id) not in self._by_opening_position_id:
+            self.refresh()
+        return self._by_opening_position_id.get(str(position_id))
+
+
+AUDIT_FILL_STATUSES = frozenset({"Fill", "FinalFill"})
+AUDIT_DEAD_STATUSES = frozenset({"Cancelled", "Canceled", "Rejected", "Expired"})
+
+
+class AuditActivityPoller:
+    # 監査APIを時間窓で1回照会し、待機中の複数OrderIdをまとめて解決する。
+    # 約定は order_fill_fallback、取消・拒否・失効は order_dead として返し、後者でも待機を打ち切る。
+    # 約定が見つかった周回では間隔を初期値へ戻し、見つからない間は倍々で延ばす。
+    def __init__(self, client: "SaxoClient", initial_delay: float = 1.0, max_delay: float = 8.0):
+        self._client = client
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self._waiters: Dict[str, Tuple[asyncio.Future, datetime]] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def activity_to_fill(order_id: str, activity: Dict) -> Dict[str, Any]:
+        execution_time_str = activity.get("ActivityTime")
+        formatted_time_str = None
+        if execution_time_str:
+            try:
+                dt_utc = datetime.fromisoformat(execution_time_str.replace("Z", "+00:00"))
+                formatted_time_str = dt_utc.astimezone(TIMEZONE_TOKYO).strftime("%Y-%m-%d %H:%M:%S")
+            except Exception as e:
+                log(f"監査APIからの時刻変換エラー: {e}")
+        return {
+            "type": "order_fill_fallback",
+            "order_id": order_id,
+            "execution_price": Decimal(str(activity["AveragePrice"])),
+            "execution_time": formatted_time_str,
+            "position_id": activity.get("PositionId"),
+            "status": "filled",
+        }
+
+    async def wait_for_fill(self, order_id: str, timeout_seconds: Optional[int] = None) -> Optional[Dict]:
+        timeout_seconds = timeout_seconds or self._client.cfg.audit_fallback_timeout_seconds
+        order_id = str(order_id)
+        log(f"フォールバック実行: 監査APIで注文 {order_id} の状態を確認します。")
+        future = asyncio.get_running_loop().create_future()
+        window_start = datetime.now(timezone.utc) - timedelta(seconds=self._client.cfg.fill_timeout_seconds + 60)
+        self._waiters[order_id] = (future, window_start)
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        try:
+            return await asyncio.wait_for(future, timeout=timeout_seconds)
+        except asyncio.TimeoutError:
+            log(f"監査APIによる確認でも、注文 {order_id} の約定情報が見つかりませんでした。")
+            return None
+        finally:
+            if self._waiters.get(order_id, (None,))[0] is future:
+                self._waiters.pop(order_id, None)
+
+    async def _run(self) -> None:
+        delay = self.initial_delay
+        while self._waiters:
+            self._wakeup.clear()
+            resolved = await self._poll_once()
+            if not self._waiters:
+                break
+            delay = self.initial_delay if resolved else min(delay * 2, self.max_delay)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll_once(self) -> int:
+        window_start = min(start for _, start in self._waiters.values())
+        params = {
+            "AccountKey": self._client.account_key,
+            "ClientKey": self._client.client_key,
+            "EntryType": "Last",
+            "FromDateTime": window_start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "$top": 1000,
+        }
+        try:
+            activities = await asyncio.to_thread(self._client._get_paged, "/cs/v1/audit/orderactivities", params)
+        except Exception as e:
+            log(f"監査APIの呼び出し中にエラー: {e}")
+            return 0
+        if not activities:
+            return 0
+
+        resolved = 0
+        for activity in activities:
+            order_id = str(activity.get("OrderId"))
+            waiter = self._waiters.get(order_id)
+            if waiter is None or waiter[0].done():
+                continue
+            status = activity.get("Status")
+            if status in AUDIT_FILL_STATUSES and activity.get("AveragePrice") is not None:
+                log(f"★ 監査APIにより約定を確認: OrderId={order_id}, 価格={activity.get('AveragePrice')}")
+                waiter[0].set_result(self.activity_to_fill(order_id, activity))
+            elif status in AUDIT_DEAD_STATUSES:
+                log(f"監査APIにより注文の終了を確認: OrderId={order_id}, 状態={status}", level="WARNING")
+                waiter[0].set_result({"type": "order_dead", "order_id": order_id, "status": status})
+            else:
+                continue
+            self._waiters.pop(order_id, None)
+            resolved += 1
+        log(f"監査API照会: 取得={len(activities)}件, 解決={resolved}件, 待機中={len(self._waiters)}件")
+        return resolved
+
+
+class EnsWaiterRegistry:
+    # ENSイベント待機とバックログを (イベント種別, UIC, OrderId) で索引し、1件あたり定数時間で突き合わせる。
+    # position_closed は OrderId を持たないため None をキーにする。
+    # バックログは件数ではなく受信からの経過時間で破棄し、破棄件数を記録する。
+    def __init__(self, ttl_seconds: float, max_events: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_events = max_events
+        self._waiters: Dict[Tuple[str, int, Optional[str]], List[Tuple[asyncio.Future, Optional[float]]]] = {}
+        self._keys_by_future: Dict[asyncio.Future, List[Tuple[str, int, Optional[str]]]] = {}
+        self._backlog: Dict[Tuple[str, int, Optional[str]], collections.deque] = {}
+        self._backlog_order: collections.deque = collections.deque()
+        self._backlog_size = 0
+        self.matched_live = 0
+        self.matched_backlog = 0
+        self.evicted_expired = 0
+        self.evicted_overflow = 0
+
+    @staticmethod
+    def event_key(event: Dict[str, Any]) -> Optional[Tuple[str, int, Optional[str]]]:
+        event_type = event.get("type")
+        if event.get("uic") is None:
+            return None
+        uic = int(event["uic"])
+        if event_type == "position_closed":
+            return (event_type, uic, None)
+        if event_type in ["order_fill", "order_status_change"]:
+            if event.get("order_id") is None:
+                return None
+            if event_type == "order_fill" and str(event.get("status", "")).lower() not in ["filled", "fill", "finalfill"]:
+                return None
+            return (event_type, uic, str(event["order_id"]))
+        return None
+
+    @staticmethod
+    def waiter_keys(
+        order_id: Optional[str], uic: int, expected_event_types: Iterable[str]
+    ) -> List[Tuple[str, int, Optional[str]]]:
+        keys = []
+        for event_type in expected_event_types:
+            if event_type == "position_closed":
+                keys.append((event_type, int(uic), None))
+            elif order_id:
+                keys.append((event_type, int(uic), str(order_id)))
+        return keys
+
+    def __len__(self) -> int:
+        return self._backlog_size
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "waiters": len(self._keys_by_future),
+            "backlog": self._backlog_size,
+            "matched_live": self.matched_live,
+            "matched_backlog": self.matched_backlog,
+            "evicted_expired": self.evicted_expired,
+            "evicted_overflow": self.evicted_overflow,
+        }
+
+    def _expire(self, now: float) -> None:
+        expired = overflow = 0
+        cutoff = now - self.ttl_seconds
+        while self._backlog_order:
+            received_at, key, entry = self._backlog_order[0]
+            if not entry[1]:
+                if received_at >= cutoff and self._backlog_size <= self.max_events:
+                    break
+                entry[1] = True
+                self._backlog_size -= 1
+                if received_at < cutoff:
+                    expired += 1
+                else:
+                    overflow += 1
+            self._backlog_order.popleft()
+            bucket = self._backlog.get(key)
+            while bucket and bucket[0][1]:
+                bucket.popleft()
+            if bucket is not None and not bucket:
+                del self._backlog[key]
+        if expired or overflow:
+            self.evicted_expired += expired
+            self.evicted_overflow += overflow
+            log(
+                f"ENSバックログ破棄: 期限切れ={expired}件, 上限超過={overflow}件 "
+                f"(累計 期限切れ={self.evicted_expired}件, 上限超過={self.evicted_overflow}件, 残り={self._backlog_size}件)"
+            )
+
+    def register(
+        self, order_id: Optional[str], uic: int, expected_event_types: Iterable[str], since: Optional[float] = None
+    ) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        keys = self.waiter_keys(order_id, uic, expected_event_types)
+        self._expire(time.monotonic())
+
+        best: Optional[List] = None
+        for key in keys:
+            for entry in self._backlog.get(key, ()):
+                if entry[1] or (since is not None and entry[0].get("received_at", 0.0) < since):
+                    continue
+                if best is None or entry[0]["received_at"] < best[0]["received_at"]:
+                    best = entry
+                break
+        if best is not None:
+            best[1] = True
+            self._backlog_size -= 1
+            self.matched_backlog += 1
+            future.set_result(best[0])
+            return future
+
+        for key in keys:
+            self._waiters.setdefault(key, []).append((future, since))
+        self._keys_by_future[future] = keys
+        return future
+
+    def unregister(self, future: asyncio.Future) -> None:
+        for key in self._keys_by_future.pop(future, ()):
+            bucket = self._waiters.get(key)
+            if not bucket:
+                continue
+            bucket[:] = [waiter for waiter in bucket if waiter[0] is not future]
+            if not bucket:
+                del self._waiters[key]
+
+    def dispatch(self, event: Dict[str, Any]) -> int:
+        received_at = event.setdefault("received_at", time.monotonic())
+        key = self.event_key(event)
+        if key is None:
+            return 0
+
+        matched = 0
+        bucket = self._waiters.get(key)
+        if bucket:
+            remaining = []
+            for future, since in bucket:
+                if future.done():
+                    continue
+                if since is not None and received_at < since:
+                    remaining.append((future, since))
+                    continue
+                future.set_result(event)
+                matched += 1
+            if remaining:
+                self._waiters[key] = remaining
+            else:
+                del self._waiters[key]
+        if matched:
+            self.matched_live += matched
+            return matched
+
+        entry = [event, False]
+        self._backlog.setdefault(key, collections.deque()).append(entry)
+        self._backlog_order.append((received_at, key, entry))
+        self._backlog_size += 1
+        self._expire(time.monotonic())
+        return 0
+
+
+class EnsSubscriber:
+    __slots__ = (
+        "name",
+        "handler",
+        "inline",
+        "overflow",
+        "queue",
+        "task",
+        "delivered",
+        "dropped",
+        "errors",
+        "max_depth",
+        "last_lag_ms",
+        "max_lag_ms",
+    )
+
+    def __init__(self, name: str, handler, inline: bool, overflow: str, queue_size: int):
+        self.name = name
+        self.handler = handler
+        self.inline = inline
+        self.overflow = overflow
+        self.queue: Optional[asyncio.Queue] = None if inline else asyncio.Queue(maxsize=queue_size)
+        self.task: Optional[asyncio.Task] = None
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.last_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+
+    def describe(self) -> str:
+        depth = self.queue.qsize() if self.queue is not None else 0
+        return (
+            f"{self.name}: 配信={self.delivered}, 破棄={self.dropped}, エラー={self.errors}, "
+            f"滞留={depth}(最大{self.max_depth}), 遅延={self.last_lag_ms:.1f}ms(最大{self.max_lag_ms:.1f}ms)"
+        )
+
+
+class EnsEventBus:
+    # ENSイベントを1回だけ組み立て、登録済みの購読者へ配る。
+    # inline 購読者は publish 内で同期的に呼ぶ。待機の解決のように軽く、遅延させたくない処理向け。
+    # それ以外は購読者ごとの上限付きキューとワーカーで順に処理し、受信から処理開始までの遅延を記録する。
+    # キューが溢れた場合は drop_oldest / drop_newest / block のいずれかの方針に従う。
+    OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "block")
+
+    def __init__(self, queue_size: int = 1000, overflow: str = "drop_oldest"):
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"未対応のoverflow方針です: {overflow}")
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self._subscribers: Dict[str, EnsSubscriber] = {}
+
+    def subscribe(
+        self,
+        name: str,
+        handler,
+        inline: bool = False,
+        queue_size: Optional[int] = None,
+        overflow: Optional[str] = None,
+    ) -> EnsSubscriber:
+        overflow = overflow or self.overflow
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"未対応のoverflow方針です: {overflow}")
+        subscriber = EnsSubscriber(name, handler, inline, overflow, queue_size or self.queue_size)
+        self._subscribers[name] = subscriber
+        return subscriber
+
+    def unsubscribe(self, name: str) -> None:
+        subscriber = self._subscribers.pop(name, None)
+        if subscriber is not None and subscriber.task is not None:
+            subscriber.task.cancel()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            name: {
+                "delivered": sub.delivered,
+                "dropped": sub.dropped,
+                "errors": sub.errors,
+                "depth": sub.queue.qsize() if sub.queue is not None else 0,
+                "max_depth": sub.max_depth,
+                "last_lag_ms": sub.last_lag_ms,
+                "max_lag_ms": sub.max_lag_ms,
+            }
+            for name, sub in self._subscribers.items()
+        }
+
+    @staticmethod
+    def _record_lag(subscriber: EnsSubscriber, event: Dict[str, Any]) -> None:
+        lag_ms = (time.monotonic() - event["received_at"]) * 1000
+        subscriber.last_lag_ms = lag_ms
+        if lag_ms > subscriber.max_lag_ms:
+            subscriber.max_lag_ms = lag_ms
+        subscriber.delivered += 1
+
+    async def publish(self, event: Dict[str, Any]) -> None:
+        event.setdefault("received_at", time.monotonic())
+        for subscriber in list(self._subscribers.values()):
+            if subscriber.inline:
+                self._record_lag(subscriber, event)
+                try:
+                    subscriber.handler(event)
+                except Exception as e:
+                    subscriber.errors += 1
+                    log(f"ENSイベント購読者 {subscriber.name} の処理中にエラー: {e}")
+                continue
+
+            if subscriber.task is None or subscriber.task.done():
+                subscriber.task = asyncio.create_task(self._run(subscriber))
+            queue = subscriber.queue
+            if queue.full():
+                if subscriber.overflow == "block":
+                    await queue.put(event)
+                else:
+                    if subscriber.overflow == "drop_oldest":
+                        queue.get_nowait()
+                        queue.task_done()
+                        queue.put_nowait(event)
+                    subscriber.dropped += 1
+                    if subscriber.dropped == 1 or subscriber.dropped % 100 == 0:
+                        log(
+                            f"ENSイベント購読者 {subscriber.name} のキューが上限({queue.maxsize})に達しました。"
+                            f"方針={subscriber.overflow}, 累計破棄={subscriber.dropped}件"
+                        )
+            else:
+                queue.put_nowait(event)
+            if queue.qsize() > subscriber.max_depth:
+                subscriber.max_depth = queue.qsize()
+
+    async def _run(self, subscriber: EnsSubscriber) -> None:
+        queue = subscriber.queue
+        while True:
+            event = await queue.get()
+            self._record_lag(subscriber, event)
+            try:
+                result = subscriber.handler(event)
+                if asyncio.iscoroutine(result):
+                    await result
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                subscriber.errors += 1
+                log(f"ENSイベント購読者 {subscriber.name} の処理中にエラー: {e}")
+            finally:
+                queue.task_done()
+
+    async def close(self) -> None:
+        for subscriber in self._subscribers.values():
+            if subscriber.task is not None and not subscriber.task.done():
+                subscriber.task.cancel()
+                try:
+                    await subscriber.task
+                except asyncio.CancelledError:
+                    pass
+            subscriber.task = None
+            log(f"ENSイベントバス統計 {subscriber.describe()}")
+
+
+class StreamingSubscription:
+    __slots__ = (
+        "name",
+        "endpoint",
+        "arguments",
+        "handler",
+        "reference_id",
+        "subscription_id",
+        "active",
+        "last_update_at",
+        "messages",
+        "extra",
+    )
+
+    def __init__(self, name: str, endpoint: str, arguments: Dict[str, Any], handler=None, extra: Optional[Dict] = None):
+        self.name = name
+        self.endpoint = endpoint
+        self.arguments = arguments
+        self.handler = handler
+        self.reference_id: Optional[str] = None
+        self.subscription_id: Optional[str] = None
+        self.active = False
+        self.last_update_at = 0.0
+        self.messages = 0
+        self.extra = extra or {}
+
+
+class StreamingSubscriptionManager:
+    # 1つのストリーミングContextに複数のサブスクリプションを載せ、ReferenceId で受信メッセージを振り分ける。
+    # ENS(注文/ポジション)は既存の受信処理で扱うため handler を持たず、route() は False を返す。
+    # 価格と残高は Snapshot と差分をキャッシュへマージし、REST照会の代わりに使う。
+    def __init__(self, client: "SaxoClient"):
+        self._client = client
+        self._subscriptions: Dict[str, StreamingSubscription] = {}
+        self._routes: Dict[str, StreamingSubscription] = {}
+        self.context_id: Optional[str] = None
+        self._stream = None
+        self.quotes: Dict[int, Dict[str, Any]] = {}
+        self.balance: Dict[str, Any] = {}
+
+    def link(self, stream) -> None:
+        # 受信中のWebSocketクライアント。切断中はキャッシュを使わない
+        self._stream = stream
+
+    def get(self, name: str) -> Optional[StreamingSubscription]:
+        return self._subscriptions.get(name)
+
+    def owns(self, reference_id: Optional[str]) -> Optional[StreamingSubscription]:
+        return self._routes.get(reference_id) if reference_id else None
+
+    def describe(self) -> str:
+        return ", ".join(
+            f"{sub.name}(ref={sub.reference_id}, active={sub.active}, messages={sub.messages})"
+            for sub in self._subscriptions.values()
+        )
+
+    def register_created(self, name: str, endpoint: str, reference_id: str, subscription_id: Optional[str]) -> None:
+        # 既存処理で作成済みのサブスクリプション(ENS)を台帳に載せる
+        sub = self._subscriptions.get(name) or StreamingSubscription(name, endpoint, {})
+        if sub.reference_id:
+            self._routes.pop(sub.reference_id, None)
+        sub.reference_id = reference_id
+        sub.subscription_id = subscription_id
+        sub.active = True
+        self._subscriptions[name] = sub
+        self._routes[reference_id] = sub
+        if self.context_id != self._client.streaming_context_id:
+            self.context_id = self._client.streaming_context_id
+            for other in self._subscriptions.values():
+                if other is not sub:
+                    other.active = False
+
+    def add(self, name: str, endpoint: str, arguments: Dict[str, Any], handler, **extra) -> StreamingSubscription:
+        sub = StreamingSubscription(name, endpoint, arguments, handler, extra)
+        previous = self._subscriptions.get(name)
+        if previous is not None and previous.reference_id:
+            self._routes.pop(previous.reference_id, None)
+        self._subscriptions[name] = sub
+        return sub
+
+    def create(self, name: str) -> bool:
+        sub = self._subscriptions.get(name)
+        context_id = self._client.streaming_context_id
+        if sub is None or sub.handler is None or not context_id:
+            return False
+        if sub.reference_id:
+            self._routes.pop(sub.reference_id, None)
+        sub.reference_id = f"{name}_{secrets.token_urlsafe(6)}"
+        sub.active = False
+        payload = {"ContextId": context_id, "ReferenceId": sub.reference_id, "Arguments": sub.arguments}
+        self._routes[sub.reference_id] = sub
+        response = self._client._make_request("POST", sub.endpoint, json_data=payload)
+        if not isinstance(response, dict):
+            self._routes.pop(sub.reference_id, None)
+            log(f"ストリーミングサブスクリプション {name} の作成に失敗しました。")
+            return False
+        sub.subscription_id = response.get("SubscriptionId")
+        snapshot = response.get("Snapshot")
+        if snapshot is not None:
+            sub.handler(snapshot, True)
+        sub.active = True
+        sub.last_update_at = time.monotonic()
+        self.context_id = context_id
+        log(f"ストリーミングサブスクリプション {name} を作成しました: ReferenceId={sub.reference_id}")
+        return True
+
+    def delete(self, name: str) -> bool:
+        sub = self._subscriptions.get(name)
+        if sub is None or not sub.reference_id or sub.handler is None:
+            return False
+        reference_id = sub.reference_id
+        sub.active = False
+        self._routes.pop(reference_id, None)
+        sub.reference_id = None
+        if not self.context_id:
+            return True
+        response = self._client._make_request("DELETE", f"{sub.endpoint}/{self.context_id}/{reference_id}")
+        if response is None:
+            log(f"ストリーミングサブスクリプション {name} の削除に失敗しました: ReferenceId={reference_id}")
+            return False
+        return True
+
+    def reset(self, reference_ids: Iterable[str]) -> List[str]:
+        # _resetsubscriptions 等で対象となったサブスクリプションを同じContext上で作り直す
+        recreated = []
+        for reference_id in list(reference_ids):
+            sub = self._routes.get(reference_id)
+            if sub is None or sub.handler is None:
+                continue
+            self.delete(sub.name)
+            if self.create(sub.name):
+                recreated.append(sub.name)
+        return recreated
+
+    def needs_resubscribe(self) -> bool:
+        return any(
+            sub.handler is not None and (not sub.active or self.context_id != self._client.streaming_context_id)
+            for sub in self._subscriptions.values()
+        )
+
+    def resubscribe_all(self) -> None:
+        # 新しいContextに切り替わった後、ENS以外のサブスクリプションを作り直す
+        for sub in list(self._subscriptions.values()):
+            if sub.handler is not None and (not sub.active or self.context_id != self._client.streaming_context_id):
+                self.create(sub.name)
+
+    def delete_all(self) -> None:
+        for sub in list(self._subscriptions.values()):
+            if sub.handler is not None and sub.reference_id:
+                self.delete(sub.name)
+
+    def mark_alive(self, reference_id: Optional[str]) -> None:
+        sub = self._routes.get(reference_id) if reference_id else None
+        if sub is not None:
+            sub.last_update_at = time.monotonic()
+
+    def route(self, reference_id: Optional[str], message: Any) -> bool:
+        sub = self._routes.get(reference_id) if reference_id else None
+        if sub is None or sub.handler is None:
+            return False
+        sub.messages += 1
+        sub.last_update_at = time.monotonic()
+        try:
+            sub.handler(message, False)
+        except Exception as e:
+            log(f"ストリーミングサブスクリプション {sub.name} の処理中にエラー: {e}")
+        return True
+
+    @staticmethod
+    def _merge(target: Dict[str, Any], update: Dict[str, Any]) -> None:
+        for key, value in update.items():
+            if isinstance(value, dict) and isinstance(target.get(key), dict):
+                StreamingSubscriptionManager._merge(target[key], value)
+            else:
+                target[key] = value
+
+    def _apply_prices(self, message: Any, snapshot: bool) -> None:
+        items = message.get("Data", []) if isinstance(message, dict) else message
+        if snapshot:
+            self.quotes = {}
+        for item in items or []:
+            if not isinstance(item, dict) or item.get("Uic") is None:
+                continue
+            self._merge(self.quotes.setdefault(int(item["Uic"]), {}), item)
+
+    def _apply_balance(self, message: Any, snapshot: bool) -> None:
+        if not isinstance(message, dict):
+            return
+        if snapshot:
+            self.balance = {}
+        self._merge(self.balance, message)
+
+    def subscribe_prices(self, uics: Iterable[int], asset_type: str = "FxSpot") -> bool:
+        uic_list = sorted({int(uic) for uic in uics})
+        if not uic_list:
+            return False
+        self.add(
+            "prices",
+            "/trade/v1/infoprices/subscriptions",
+            {
+                "AccountKey": self._client.account_key,
+                "Uics": ",".join(map(str, uic_list)),
+                "AssetType": asset_type,
+                "FieldGroups": ["Quote", "DisplayAndFormat", "PriceInfo"],
+            },
+            self._apply_prices,
+            asset_type=asset_type,
+        )
+        return self.create("prices")
+
+    def subscribe_balance(self) -> bool:
+        self.add(
+            "balance",
+            "/port/v1/balances/subscriptions",
+            {"ClientKey": self._client.client_key, "AccountKey": self._client.account_key},
+            self._apply_balance,
+        )
+        return self.create("balance")
+
+    def _fresh(self, name: str, max_age_seconds: float) -> bool:
+        sub = self._subscriptions.get(name)
+        return (
+            sub is not None
+            and sub.active
+            and self._stream is not None
+            and self._stream.is_connected
+            and self.context_id == self._client.streaming_context_id
+            and time.monotonic() - sub.last_update_at <= max_age_seconds
+        )
+
+    def cached_quotes(
+        self, uic_list: List[int], asset_type: str, max_age_seconds: float
+    ) -> Optional[Dict[int, Dict[str, Any]]]:
+        sub = self._subscriptions.get("prices")
+        if sub is None or sub.extra.get("asset_type") != asset_type or not self._fresh("prices", max_age_seconds):
+            return None
+        result = {}
+        for uic in uic_list:
+            item = self.quotes.get(int(uic))
+            quote = (item or {}).get("Quote") or {}
+            if quote.get("Bid") is None or quote.get("Ask") is None:
+                return None
+            result[int(uic)] = copy.deepcopy(item)
+        return result
+
+    def cached_balance(self, max_age_seconds: float) -> Optional[Dict[str, Any]]:
+        if not self.balance or not self._fresh("balance", max_age_seconds):
+            return None
+        return dict(self.balance)
+
+
 class SaxoClient:
     def __init__(self, cfg: EnvConfig):
         self.cfg = cfg
@@ -531,18 +2011,26 @@ class SaxoClient:
         self.session = requests.Session()
         self.refresh_lock = threading.Lock()
         self.last_refresh_time: float = 0
+        self.token_expires_at: float = 0
         self.pair_uic_cache: Dict[str, Dict] = {}
         self.reauthenticate_callback: Optional[callable] = None
-        self.ens_event_queue: Optional[asyncio.Queue] = None
-        self._ens_waiters: List[Dict[str, Any]] = []
-        self._ens_waiters_lock = asyncio.Lock()
-        self._ens_event_backlog: collections.deque = collections.deque(maxlen=100)
+        self.ens_waiters = EnsWaiterRegistry(cfg.ens_backlog_ttl_seconds)
+        self.ens_bus = EnsEventBus(cfg.ens_subscriber_queue_size, cfg.ens_subscriber_overflow)
         self.streaming_context_id: Optional[str] = None
         self.ens_subscription_id: Optional[str] = None
         self.ens_reference_id: Optional[str] = None
         self.streaming_authorize_enabled: bool = cfg.streaming_authorize_enabled
         self.related_order_labels: Dict[str, str] = {}
         self.sl_order_ids_by_uic: Dict[int, set] = {}
+        self._background_tasks: set = set()
+        self.portfolio = PortfolioSnapshot(self, cfg.portfolio_snapshot_max_age_seconds)
+        self.closed_positions = ClosedPositionsReader(self)
+        self.broker_clock = BrokerClock()
+        self.audit_poller = AuditActivityPoller(self)
+        self.streaming = StreamingSubscriptionManager(self)
+        self.ens_bus.subscribe("waiters", self.ens_waiters.dispatch, inline=True)
+        # SL/TPの追跡は取りこぼすと決済後の関連注文が残るため、破棄方針の対象外とし inline で配る
+        self.ens_bus.subscribe("sl_tracker", self._track_related_orders, inline=True)
 
         log(
             f"[ENV] {self.env_name} selected. API_BASE={self.base_url} AUTH={self.auth_endpoint} "
@@ -552,83 +2040,33 @@ class SaxoClient:
     def set_reauthenticate_func(self, func: callable):
         self.reauthenticate_callback = func
 
-    def _get_ens_event_queue(self) -> asyncio.Queue:
-        if self.ens_event_queue is None:
-            self.ens_event_queue = asyncio.Queue()
-        return self.ens_event_queue
+    async def _register_ens_waiter(
+        self, order_id: Optional[str], uic: int, expected_event_types: List[str], since: Optional[float] = None
+    ) -> asyncio.Future:
+        return self.ens_waiters.register(order_id, uic, expected_event_types, since=since)
 
-    @staticmethod
-    def _ens_event_matches(waiter: Dict[str, Any], event: Dict[str, Any]) -> bool:
-        event_type = event.get("type")
-        if not event_type or event_type not in waiter["expected_event_types"]:
-            return False
+    async def _unregister_ens_waiter(self, future: asyncio.Future) -> None:
+        self.ens_waiters.unregister(future)
+
+    def _track_related_orders(self, event: Dict[str, Any]) -> None:
+        # 約定・取消済みの関連注文を追跡対象から外し、ポジション決済時は残りのSL/TPを取り消す
+        if event["type"] in ["order_fill", "order_status_change"]:
+            order_id = event["order_id"]
+            if self.related_order_labels.pop(order_id, None) is not None:
+                for order_ids in self.sl_order_ids_by_uic.values():
+                    order_ids.discard(order_id)
+        elif event["type"] == "position_closed" and event.get("uic") is not None:
+            task = asyncio.create_task(self.cancel_related_orders_for_uic(int(event["uic"])))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
 
-        event_uic = int(event.get("uic")) if event.get("uic") is not None else None
-        if event_uic != waiter["uic"]:
-            return False
-
-        if event_type in ["order_fill", "order_status_change"]:
-            if not waiter["order_id"]:
-                return False
-            event_order_id = str(event.get("order_id")) if event.get("order_id") is not None else None
-            if event_order_id != waiter["order_id"]:
-                return False
-            if event_type == "order_fill":
-                status = str(event.get("status", "")).lower()
-                return status in ["filled", "fill", "finalfill"]
-            return True
-
-        if event_type == "position_closed":
-            return True
-
-        return False
-
-    async def _register_ens_waiter(
-        self, order_id: Optional[str], uic: int, expected_event_types: List[str]
-    ) -> asyncio.Future:
-        future = asyncio.get_running_loop().create_future()
-        waiter = {
-            "future": future,
-            "order_id": order_id,
-            "uic": int(uic),
-            "expected_event_types": set(expected_event_types),
-        }
-        async with self._ens_waiters_lock:
-            matched_event = None
-            for event in list(self._ens_event_backlog):
-                if self._ens_event_matches(waiter, event):
-                    matched_event = event
-                    self._ens_event_backlog.remove(event)
-                    break
-            if matched_event is not None:
-                future.set_result(matched_event)
-            else:
-                self._ens_waiters.append(waiter)
-        return future
-
-    async def _unregister_ens_waiter(self, future: asyncio.Future) -> None:
-        async with self._ens_waiters_lock:
-            self._ens_waiters = [waiter for waiter in self._ens_waiters if waiter["future"] is not future]
-
-    async def _dispatch_ens_event(self, event: Dict[str, Any]) -> None:
-        async with self._ens_waiters_lock:
-            matched_waiters = [waiter for waiter in self._ens_waiters if self._ens_event_matches(waiter, event)]
-            if not matched_waiters:
-                self._ens_event_backlog.append(event)
-                return
-            for waiter in matched_waiters:
-                future = waiter["future"]
-                if not future.done():
-                    future.set_result(event)
-            self._ens_waiters = [waiter for waiter in self._ens_waiters if waiter not in matched_waiters]
-
-    def generate_streaming_context_id(self) -> str:
-        timestamp = str(int(time.time() * 1000))[-10:]
-        random_part = "".join(secrets.choice("abcdefghijklmnopqrstuvwxyz0123456789") for _ in range(8))
-        context_id = f"ctx-{timestamp}-{random_part}"
-        self.streaming_context_id = context_id
-        log(f"ストリーミング用ContextId生成: {context_id}")
-        return context_id
+    def generate_streaming_context_id(self) -> str:
+        timestamp = str(int(time.time() * 1000))[-10:]
+        random_part = "".join(secrets.choice("abcdefghijklmnopqrstuvwxyz0123456789") for _ in range(8))
+        context_id = f"ctx-{timestamp}-{random_part}"
+        self.streaming_context_id = context_id
+        log(f"ストリーミング用ContextId生成: {context_id}")
+        return context_id
 
     def _build_streaming_ws_url(self, context_id: str, message_id: Optional[int] = None) -> str:
         if not self.access_token:
@@ -663,6 +2101,7 @@ class SaxoClient:
 
         self.ens_subscription_id = response.get("SubscriptionId") if isinstance(response, dict) else None
         self.ens_reference_id = reference_id
+        self.streaming.register_created("ens", endpoint, reference_id, self.ens_subscription_id)
 
         websocket_url = self._build_streaming_ws_url(context_id)
         log(f"ENS WebSocket URL: {self._mask_ws_url_for_log(websocket_url)}")
@@ -760,14 +2199,21 @@ class SaxoClient:
                 if is_price_request:
                     read_timeout = min(read_timeout, 10)
 
+                sent_at = time.time()
                 response = self.session.request(
                     method, url, headers=headers, params=params, json=json_data, timeout=(connect_timeout, read_timeout)
                 )
+                self.broker_clock.observe(sent_at, time.time(), response.headers.get("Date"))
+                if method.upper() != "GET" and endpoint.startswith("/trade/"):
+                    # 発注・取消で口座状態が変わるためスナップショットを無効化する
+                    self.portfolio.invalidate()
 
                 if response.status_code == 401:
                     log(
-                        f"API {endpoint} が401を返しました。トークンリフレッシュを試みます。"
-                        f"レスポンス概要: {response.text[:200]}"
+                        "API %s が401を返しました。トークンリフレッシュを試みます。レスポンス概要: %s",
+                        endpoint,
+                        response.text[:200],
+                        level="WARNING",
                     )
                     if self.refresh_access_token():
                         log("トークンリフレッシュ成功。リクエストを再試行します。")
@@ -780,24 +2226,26 @@ class SaxoClient:
 
                 if response.status_code == 429:
                     retry_after = int(response.headers.get("Retry-After", "10"))
-                    log(f"レート制限 (429)。{retry_after}秒待機後に再試行します。")
+                    log("レート制限 (429)。%s秒待機後に再試行します。", retry_after, level="WARNING", endpoint=endpoint)
                     time.sleep(retry_after)
                     continue
 
                 if response.status_code >= 500:
-                    log(f"サーバーエラー ({response.status_code}): {endpoint} - 試行 {attempt + 1}/{retries}")
+                    log(
+                        "サーバーエラー (%s): %s - 試行 %s/%s", response.status_code, endpoint, attempt + 1, retries, level="WARNING"
+                    )
                     if attempt < retries - 1:
                         time.sleep(2**attempt)
                         continue
-                    log(f"サーバーエラーが継続しています: {response.text[:200]}")
+                    log("サーバーエラーが継続しています: %s", response.text[:200], level="ERROR", endpoint=endpoint)
                     return None
 
                 if response.status_code == 404:
-                    log(f"APIエンドポイントが見つかりません (404): {method} {endpoint}")
+                    log("APIエンドポイントが見つかりません (404): %s %s", method, endpoint, level="ERROR")
                     return None
 
                 if response.status_code == 405:
-                    log(f"メソッドが許可されていません (405): {method} {endpoint}")
+                    log("メソッドが許可されていません (405): %s %s", method, endpoint, level="ERROR")
                     return None
 
                 response.raise_for_status()
@@ -806,12 +2254,12 @@ class SaxoClient:
                     try:
                         return response.json()
                     except json.JSONDecodeError as jde:
-                        log(f"{endpoint} のJSONデコードに失敗: {jde} - レスポンス: {response.text[:200]}")
+                        log("%s のJSONデコードに失敗: %s - レスポンス: %s", endpoint, jde, response.text[:200], level="ERROR")
                         return None
                 return None
 
             except requests.exceptions.ConnectionError as ce:
-                log(f"接続エラー ({endpoint}): {str(ce)} - 試行 {attempt + 1}/{retries}")
+                log("接続エラー (%s): %s - 試行 %s/%s", endpoint, ce, attempt + 1, retries, level="WARNING")
                 if attempt < retries - 1 and retry_safe:
                     wait_time = 1 + attempt * 2
                     if is_price_request:
@@ -822,7 +2270,7 @@ class SaxoClient:
                 return None
 
             except requests.exceptions.Timeout as te:
-                log(f"タイムアウト ({endpoint}): {str(te)} - 試行 {attempt + 1}/{retries}")
+                log("タイムアウト (%s): %s - 試行 %s/%s", endpoint, te, attempt + 1, retries, level="WARNING")
                 if attempt < retries - 1 and retry_safe:
                     time.sleep(1 + attempt)
                     continue
@@ -830,10 +2278,10 @@ class SaxoClient:
                 return None
 
             except requests.exceptions.RequestException as e:
-                log(f"リクエスト例外 ({endpoint}): {e} - 試行 {attempt + 1}/{retries}")
+                log("リクエスト例外 (%s): %s - 試行 %s/%s", endpoint, e, attempt + 1, retries, level="WARNING")
 
                 if hasattr(e, "response") and e.response is not None:
-                    log(f"エラーレスポンス詳細 ({endpoint}): {e.response.text[:300]}")
+                    log("エラーレスポンス詳細 (%s): %s", endpoint, e.response.text[:300], level="ERROR")
 
                 if attempt < retries - 1 and retry_safe:
                     time.sleep(2 + attempt)
@@ -843,6 +2291,22 @@ class SaxoClient:
 
         return None
 
+    def _get_paged(self, endpoint: str, params: Dict[str, Any], max_pages: int = 20) -> Optional[List[Dict]]:
+        items: List[Dict] = []
+        page_params = dict(params)
+        for _ in range(max_pages):
+            data = self._make_request("GET", endpoint, params=page_params)
+            if not isinstance(data, dict) or "Data" not in data:
+                return None
+            items.extend(data["Data"])
+            next_url = data.get("__next")
+            if not next_url:
+                return items
+            next_query = urllib.parse.parse_qs(urllib.parse.urlparse(next_url).query)
+            page_params = {**params, **{key: values[0] for key, values in next_query.items()}}
+        log(f"ページ数の上限({max_pages})に達しました: {endpoint}")
+        return items
+
     def perform_oauth_flow(self) -> bool:
         log("OAuth認証フローを開始します...")
 
@@ -964,6 +2428,7 @@ class SaxoClient:
             self.access_token = token_data["access_token"]
             self.refresh_token = token_data.get("refresh_token")
             self.last_refresh_time = time.time()
+            self.token_expires_at = self.last_refresh_time + float(token_data.get("expires_in") or 1200)
             log("アクセストークンを正常に取得しました。")
             if not self.fetch_account_keys():
                 log("トークン取得後にアカウントキーの取得に失敗しました。")
@@ -1005,6 +2470,7 @@ class SaxoClient:
                     if "refresh_token" in token_data:
                         self.refresh_token = token_data["refresh_token"]
                     self.last_refresh_time = time.time()
+                    self.token_expires_at = self.last_refresh_time + float(token_data.get("expires_in") or 1200)
                     log("アクセストークンを正常に更新しました。")
                     return True
 
@@ -1019,6 +2485,11 @@ class SaxoClient:
             log("トークン更新に3回失敗しました。")
             return False
 
+    def token_remaining_seconds(self) -> float:
+        if not self.access_token or not self.token_expires_at:
+            return 0.0
+        return max(self.token_expires_at - time.time(), 0.0)
+
     def authenticate(self) -> bool:
         if self.access_token and self.validate_token():
             log("既存のトークンは有効です。")
@@ -1038,6 +2509,13 @@ class SaxoClient:
         log(f"トークン検証失敗。レスポンス: {response_data}")
         return False
 
+    def sync_broker_clock(self, probes: int = 3) -> None:
+        # ブローカー側の秒の変わり目を狙って軽量GETを送り、Date ヘッダーから時計ずれの推定幅を狭める
+        for _ in range(probes):
+            time.sleep(self.broker_clock.next_probe_delay())
+            self._make_request("GET", "/port/v1/clients/me", retries=1)
+        log("ブローカー時計: %s", self.broker_clock.describe(), level="DEBUG")
+
     def fetch_account_keys(self) -> bool:
         log("アカウントキーを取得しています...")
         response_data = self._make_request("GET", "/port/v1/accounts/me")
@@ -1063,6 +2541,11 @@ class SaxoClient:
             if not self.fetch_account_keys():
                 return None, None
 
+        cached = self.streaming.cached_balance(self.cfg.streaming_quote_max_age_seconds)
+        if cached and cached.get("CashBalance") is not None and cached.get("Currency"):
+            log(f"口座残高(ストリーミング): {cached['CashBalance']} {cached['Currency']}")
+            return Decimal(str(cached["CashBalance"])), cached["Currency"]
+
         log("口座残高を取得しています...")
         endpoint = "/port/v1/balances"
         params = {"AccountKey": self.account_key, "ClientKey": self.client_key}
@@ -1152,6 +2635,12 @@ class SaxoClient:
             log("価格取得対象のUICリストが空です。")
             return {}
 
+        if self.cfg.streaming_prices_enabled:
+            cached = self.streaming.cached_quotes(uic_list, asset_type, self.cfg.streaming_quote_max_age_seconds)
+            if cached is not None:
+                log(f"ストリーミング価格を使用します。UICs: {','.join(map(str, uic_list))}")
+                return cached
+
         endpoint = "/trade/v1/infoprices/list"
 
         params = {"AccountKey": self.account_key, "Uics": ",".join(map(str, uic_list)), "AssetType": asset_type}
@@ -1256,6 +2745,7 @@ class SaxoClient:
         amount: float,
         stop_loss_pips: float,
         external_reference: str,
+        clock: Optional[StageClock] = None,
     ) -> str:
         if self.access_token is None:
             raise RuntimeError("セッションが初期化されていません。")
@@ -1323,7 +2813,11 @@ class SaxoClient:
         if related_orders:
             body["Orders"] = related_orders
 
+        if clock:
+            clock.mark("order_sent")
         data = self._make_request("POST", "/trade/v2/orders", json_data=body, retry_safe=False)
+        if clock:
+            clock.mark("order_ack")
         if isinstance(data, dict) and data.get("ErrorInfo"):
             log(f"注文エラー(ErrorInfo): {data['ErrorInfo']}")
             raise RuntimeError("注文がErrorInfoで失敗しました。")
@@ -1378,6 +2872,7 @@ class SaxoClient:
         amount: Decimal,
         current_price_for_sl_tp: Optional[Decimal],
         external_reference: str,
+        clock: Optional[StageClock] = None,
     ) -> Optional[Dict]:
         log(f"エントリー処理開始 (UIC: {uic}, Side: {side}, Amount: {amount})...")
 
@@ -1391,6 +2886,8 @@ class SaxoClient:
                 send_discord(f"⚠️ {pair_name} エントリー中止: 既存ポジションのため。")
             return existing_data
 
+        if clock:
+            clock.mark("precheck_done")
         log("既存取引がないため、新規注文を発注します...")
 
         if current_price_for_sl_tp and self.cfg.stop_loss_pips > 0:
@@ -1401,6 +2898,7 @@ class SaxoClient:
                     amount=float(amount),
                     stop_loss_pips=self.cfg.stop_loss_pips,
                     external_reference=external_reference,
+                    clock=clock,
                 )
                 return {"order_id": order_id, "status": "pending_fill", "external_reference": external_reference}
             except Exception as e:
@@ -1420,7 +2918,11 @@ class SaxoClient:
         }
 
         try:
+            if clock:
+                clock.mark("order_sent")
             response = self._make_request("POST", "/trade/v2/orders", json_data=order_data, retry_safe=False)
+            if clock:
+                clock.mark("order_ack")
 
             if response and "OrderId" in response:
                 order_id = response["OrderId"]
@@ -1466,37 +2968,20 @@ class SaxoClient:
 
     def get_position_details_by_order_id(self, order_id: str, uic: int) -> Optional[Dict]:
         log(f"OrderID {order_id} に由来するポジションを検索中 (UIC: {uic})...")
-        params = {
-            "AccountKey": self.account_key,
-            "ClientKey": self.client_key,
-            "Uics": str(uic),
-            "FieldGroups": "PositionBase,PositionView",
-            "$top": 1000,
-        }
-        response = self._make_request("GET", "/port/v1/positions", params=params)
-        if response and "Data" in response:
-            for pos in response["Data"]:
-                details = self._extract_position_details(pos)
-                if details and details.get("source_order_id") == str(order_id):
-                    log(f"★ OrderIDの一致でポジションを発見: PosId={details['position_id']}")
-                    return details
-        return None
+        pos = self.portfolio.position_for_source_order(order_id)
+        if pos is None:
+            return None
+        details = self._extract_position_details(pos)
+        if details:
+            log(f"★ OrderIDの一致でポジションを発見: PosId={details['position_id']}")
+        return details
 
-    def get_position_details_by_uic(self, uic: int) -> Optional[Dict]:
+    def get_position_details_by_uic(self, uic: int, max_age: Optional[float] = None) -> Optional[Dict]:
         log(f"ポジション情報を検索中 (UIC: {uic})...")
-        endpoint = "/port/v1/positions"
-        params = {
-            "AccountKey": self.account_key,
-            "ClientKey": self.client_key,
-            "Uics": str(uic),
-            "FieldGroups": "PositionBase,PositionView",
-            "$top": 1000,
-        }
-        positions_data = self._make_request("GET", endpoint, params=params)
-
-        if positions_data and "Data" in positions_data and len(positions_data["Data"]) > 0:
+        positions = self.portfolio.positions_for_uic(uic, max_age=max_age)
+        if positions:
             latest_position = sorted(
-                positions_data["Data"],
+                positions,
                 key=lambda p: p.get("PositionBase", {}).get("ExecutionTimeOpen", ""),
                 reverse=True,
             )[0]
@@ -1535,6 +3020,7 @@ class SaxoClient:
         amount_to_close: Decimal,
         original_side: str,
         external_reference: str,
+        clock: Optional[StageClock] = None,
     ) -> Optional[str]:
         log(f"ポジション {position_id} ({pair_name}) の決済処理開始...")
 
@@ -1573,7 +3059,11 @@ class SaxoClient:
 
             log(f"決済注文データ: {close_side} {amount_to_close} units of UIC {uic}")
 
+            if clock:
+                clock.mark("order_sent")
             response = self._make_request("POST", "/trade/v2/orders", json_data=order_data, retry_safe=False)
+            if clock:
+                clock.mark("order_ack")
 
             if response and "OrderId" in response:
                 order_id = response["OrderId"]
@@ -1612,74 +3102,17 @@ class SaxoClient:
 
             return None
 
-    def check_order_status_via_audit_api(self, order_id: str) -> Optional[Dict]:
-        log(f"フォールバック実行: 監査APIで注文 {order_id} の状態を確認します。")
-        endpoint = "/cs/v1/audit/orderactivities"
-        params = {"OrderId": order_id, "EntryType": "Last", "AccountKey": self.account_key, "ClientKey": self.client_key}
-
-        for i in range(3):
-            try:
-                response = self._make_request("GET", endpoint, params=params)
-                if response and "Data" in response and len(response["Data"]) > 0:
-                    activity = response["Data"][0]
-                    log(f"監査APIから応答あり: Status={activity.get('Status')}")
-                    if activity.get("Status") in ["FinalFill", "Fill"] and activity.get("AveragePrice") is not None:
-                        log(f"★ 監査APIにより約定を確認: 価格={activity.get('AveragePrice')}")
-
-                        execution_time_str = activity.get("ActivityTime")
-                        formatted_time_str = None
-                        if execution_time_str:
-                            try:
-                                dt_utc = datetime.fromisoformat(execution_time_str.replace("Z", "+00:00"))
-                                formatted_time_str = dt_utc.astimezone(TIMEZONE_TOKYO).strftime("%Y-%m-%d %H:%M:%S")
-                            except Exception as e:
-                                log(f"監査APIからの時刻変換エラー: {e}")
-
-                        return {
-                            "type": "order_fill_fallback",
-                            "order_id": order_id,
-                            "execution_price": Decimal(str(activity["AveragePrice"])),
-                            "execution_time": formatted_time_str,
-                            "position_id": activity.get("PositionId"),
-                            "status": "filled",
-                        }
-                log(f"監査API試行 {i + 1}/3: 約定情報見つからず。5秒後に再試行...")
-                time.sleep(5)
-            except Exception as e:
-                log(f"監査APIの呼び出し中にエラー: {e}")
-                time.sleep(5)
-
-        log(f"監査APIによる確認でも、注文 {order_id} の約定情報が見つかりませんでした。")
-        return None
-
     def check_existing_positions_and_orders(self, uic: int) -> Tuple[bool, Optional[Dict]]:
         log(f"UIC {uic} の既存取引（ポジション/Working注文）を確認中...")
 
         try:
-            endpoint = "/port/v1/positions"
-            params = {
-                "AccountKey": self.account_key,
-                "ClientKey": self.client_key,
-                "Uics": str(uic),
-                "FieldGroups": "PositionBase,PositionView",
-                "$top": 100,
-            }
-
-            positions_data = self._make_request("GET", endpoint, params=params)
-            if positions_data and "Data" in positions_data:
-                for position in positions_data["Data"]:
-                    log(f"既存ポジションを発見: PositionId {position.get('PositionId')}")
-                    return True, self._extract_position_details(position)
+            for position in self.portfolio.positions_for_uic(uic):
+                log(f"既存ポジションを発見: PositionId {position.get('PositionId')}")
+                return True, self._extract_position_details(position)
 
-            endpoint = "/port/v1/orders"
-            params = {"AccountKey": self.account_key, "ClientKey": self.client_key, "Uics": str(uic), "$top": 100}
-
-            orders_data = self._make_request("GET", endpoint, params=params)
-            if orders_data and "Data" in orders_data:
-                for order in orders_data["Data"]:
-                    if order.get("Status") in ["Working", "Placed", "Queued"]:
-                        log(f"未約定注文を発見: OrderId {order.get('OrderId')}, Status: {order.get('Status')}")
-                        return True, {"order_id": str(order.get("OrderId")), "status": order.get("Status"), "type": "pending_order"}
+            for order in self.portfolio.working_orders_for_uic(uic):
+                log(f"未約定注文を発見: OrderId {order.get('OrderId')}, Status: {order.get('Status')}")
+                return True, {"order_id": str(order.get("OrderId")), "status": order.get("Status"), "type": "pending_order"}
 
             log(f"UIC {uic} の既存取引は見つかりませんでした。")
             return False, None
@@ -1688,26 +3121,11 @@ class SaxoClient:
             log(f"既存取引確認中にエラー: {e}")
             return True, None
 
-    def list_working_orders_by_uic(self, uic: int) -> List[Dict]:
-        endpoint = "/port/v1/orders"
-        params = {"AccountKey": self.account_key, "ClientKey": self.client_key, "Uics": str(uic), "$top": 100}
-        orders_data = self._make_request("GET", endpoint, params=params)
-        if not orders_data or "Data" not in orders_data:
-            return []
-        working_statuses = {"Working", "Placed", "Queued"}
-        return [order for order in orders_data["Data"] if order.get("Status") in working_statuses]
+    def list_working_orders_by_uic(self, uic: int, max_age: Optional[float] = None) -> List[Dict]:
+        return self.portfolio.working_orders_for_uic(uic, max_age=max_age)
 
-    def list_closed_positions_by_uic(self, uic: int, top: int = 50) -> List[Dict]:
-        endpoint = "/port/v1/closedpositions"
-        params = {
-            "AccountKey": self.account_key,
-            "ClientKey": self.client_key,
-            "$top": top,
-        }
-        closed_data = self._make_request("GET", endpoint, params=params)
-        if not closed_data or "Data" not in closed_data:
-            return []
-        return [pos for pos in closed_data["Data"] if str(pos.get("Uic")) == str(uic)]
+    def list_closed_positions_by_uic(self, uic: int) -> List[Dict]:
+        return self.closed_positions.for_uic(uic)
 
     def cancel_order(self, order_id: str, uic: Optional[int] = None) -> bool:
         if not order_id:
@@ -1729,63 +3147,111 @@ class SaxoClient:
             return []
         return [order for order in working_orders if str(order.get("OrderId")) in saved_ids]
 
-    def cancel_related_orders_for_uic(self, uic: int) -> None:
-        working_orders = self.list_working_orders_by_uic(uic)
+    async def _cancel_orders_concurrently(self, order_ids: List[str], uic: int) -> set:
+        results = await asyncio.gather(
+            *(asyncio.to_thread(self.cancel_order, order_id, uic) for order_id in order_ids),
+            return_exceptions=True,
+        )
+        failed_ids = set()
+        for order_id, result in zip(order_ids, results):
+            if isinstance(result, Exception):
+                log(f"注文キャンセル中に例外: OrderId={order_id}, {result}")
+            if result is not True:
+                failed_ids.add(order_id)
+        return failed_ids
+
+    async def cancel_related_orders_for_uic(self, uic: int) -> Dict[str, Any]:
+        started = time.perf_counter()
+        stats: Dict[str, Any] = {
+            "uic": uic,
+            "targets": 0,
+            "confirmed_ens": 0,
+            "confirmed_rest": 0,
+            "remaining": 0,
+            "fanout_ms": 0.0,
+            "total_ms": 0.0,
+        }
+
+        working_orders = await asyncio.to_thread(self.list_working_orders_by_uic, uic)
         if not working_orders:
             log(f"UIC {uic} のキャンセル対象注文はありません。")
-            return
+            stats["total_ms"] = (time.perf_counter() - started) * 1000
+            return stats
+
         cancel_candidates = self._get_sl_working_orders(uic, working_orders)
-        if not cancel_candidates:
+        if cancel_candidates:
+            log(f"UIC {uic} のSL候補注文を {len(cancel_candidates)} 件キャンセルします。")
+        else:
             log(f"UIC {uic} のSL候補注文はありません。追跡IDがないため全Working注文をキャンセルします。")
-            for order in working_orders:
-                order_id = str(order.get("OrderId"))
-                if order_id:
-                    self.cancel_order(order_id, uic=uic)
-            return
+            cancel_candidates = working_orders
 
-        log(f"UIC {uic} のSL候補注文を {len(cancel_candidates)} 件キャンセルします。")
-        failed_ids = set()
-        for order in cancel_candidates:
-            order_id = str(order.get("OrderId"))
-            if not order_id:
-                continue
-            if not self.cancel_order(order_id, uic=uic):
-                failed_ids.add(order_id)
+        order_ids = [str(order.get("OrderId")) for order in cancel_candidates if order.get("OrderId")]
+        stats["targets"] = len(order_ids)
+        if not order_ids:
+            stats["total_ms"] = (time.perf_counter() - started) * 1000
+            return stats
 
-        if failed_ids:
-            log(f"SLキャンセル失敗検知: {len(failed_ids)} 件。再確認します。")
-            working_orders = self.list_working_orders_by_uic(uic)
-            remaining = self._get_sl_working_orders(uic, working_orders)
-            retry_ids = {str(order.get("OrderId")) for order in remaining if order.get("OrderId")}
-            if retry_ids:
-                log(f"SLキャンセル再試行を実行します: {len(retry_ids)} 件")
-                for order_id in retry_ids:
-                    self.cancel_order(order_id, uic=uic)
-
-            working_orders = self.list_working_orders_by_uic(uic)
-            remaining = self._get_sl_working_orders(uic, working_orders)
-            if remaining:
-                log(f"SLが残存しているため全注文キャンセルを実行します: {len(working_orders)} 件")
-                for order in working_orders:
-                    order_id = str(order.get("OrderId"))
-                    if order_id:
-                        self.cancel_order(order_id, uic=uic)
+        # DELETE より先に待機を登録し、即時に届くキャンセルイベントを取りこぼさない
+        waiters: Dict[str, asyncio.Future] = {}
+        for order_id in order_ids:
+            waiters[order_id] = await self._register_ens_waiter(order_id, uic, ["order_status_change"])
+
+        try:
+            fanout_started = time.perf_counter()
+            failed_ids = await self._cancel_orders_concurrently(order_ids, uic)
+            stats["fanout_ms"] = (time.perf_counter() - fanout_started) * 1000
+
+            pending = [waiters[order_id] for order_id in order_ids if order_id not in failed_ids]
+            if pending:
+                await asyncio.wait(pending, timeout=self.cfg.sl_cancel_confirm_timeout_seconds)
+            confirmed_ids = {
+                order_id
+                for order_id, future in waiters.items()
+                if future.done() and not future.cancelled() and future.exception() is None
+            }
+        finally:
+            for future in waiters.values():
+                await self._unregister_ens_waiter(future)
+
+        stats["confirmed_ens"] = len(confirmed_ids)
+        unconfirmed_ids = [order_id for order_id in order_ids if order_id not in confirmed_ids]
+        if unconfirmed_ids:
+            log(f"ENSでキャンセル未確認の注文を一覧で再確認します: {len(unconfirmed_ids)} 件")
+            working_orders = await asyncio.to_thread(self.list_working_orders_by_uic, uic, 0)
+            working_ids = {str(order.get("OrderId")) for order in working_orders if order.get("OrderId")}
+            still_working = [order_id for order_id in unconfirmed_ids if order_id in working_ids]
+            stats["confirmed_rest"] = len(unconfirmed_ids) - len(still_working)
+            if still_working:
+                log(f"SLキャンセル再試行を実行します: {len(still_working)} 件")
+                await self._cancel_orders_concurrently(still_working, uic)
+                # 最後の安全策: 再試行後もSLが残っていれば、そのUICのWorking注文をすべてキャンセルする
+                working_orders = await asyncio.to_thread(self.list_working_orders_by_uic, uic, 0)
+                working_ids = [str(order.get("OrderId")) for order in working_orders if order.get("OrderId")]
+                if any(order_id in working_ids for order_id in still_working):
+                    log(f"SLが残存しているため全注文キャンセルを実行します: {len(working_ids)} 件", level="WARNING")
+                    final_failed = await self._cancel_orders_concurrently(working_ids, uic)
+                    stats["remaining"] = len(final_failed)
+                    if final_failed:
+                        log(
+                            f"警告: キャンセルできない注文が残っています: UIC={uic}, OrderIds={sorted(final_failed)}",
+                            level="ERROR",
+                        )
+
+        stats["total_ms"] = (time.perf_counter() - started) * 1000
+        log(
+            f"SLキャンセル完了: UIC={uic}, 対象={stats['targets']}件, ENS確認={stats['confirmed_ens']}件, "
+            f"一覧確認={stats['confirmed_rest']}件, 残存={stats['remaining']}件, "
+            f"DELETE並列={stats['fanout_ms']:.1f}ms, 合計={stats['total_ms']:.1f}ms"
+        )
+        return stats
 
     def find_order_by_external_reference(self, external_reference: str) -> Optional[Dict]:
         if not external_reference:
             return None
         try:
-            endpoint = "/port/v1/orders"
-            params = {
-                "AccountKey": self.account_key,
-                "ClientKey": self.client_key,
-                "$top": 1000,
-            }
-            orders_data = self._make_request("GET", endpoint, params=params)
-            if orders_data and "Data" in orders_data:
-                for order in orders_data["Data"]:
-                    if order.get("ExternalReference") == external_reference:
-                        return {"order_id": str(order.get("OrderId")), "status": order.get("Status")}
+            order = self.portfolio.order_by_external_reference(external_reference, max_age=0)
+            if order:
+                return {"order_id": str(order.get("OrderId")), "status": order.get("Status")}
         except Exception as e:
             log(f"ExternalReferenceによる注文確認に失敗: {e}")
         return None
@@ -1798,10 +3264,581 @@ class SaxoClient:
         log("クライアントからトークンとアカウント/クライアントキーをクリアしました。")
 
 
+_FRAME_HEAD = struct.Struct("<QHB")
+_FRAME_PAYLOAD_HEAD = struct.Struct("<BI")
+
+
+class StreamingFrameBuffer:
+    # ストリーミングのバイナリフレームをコピーせずに切り出す。
+    # バッファが空の時に届いたデータはそのまま解析し、途中で切れたフレームの末尾だけを再利用バッファへ移す。
+    # 再利用バッファは消費済みの先頭が半分を超えた時点で詰める。
+    # 途中のフレームが揃うまでに必要なバイト数を覚えておき、揃うまではヘッダを読み直さない。
+    # frames() が返すペイロードは memoryview で、次の feed()/reset() までの間だけ有効。
+    def __init__(self, log_func=None):
+        self._buf = bytearray()
+        self._start = 0
+        self._pending: Optional[bytes] = None
+        self._view: Optional[memoryview] = None
+        self._payloads: List[memoryview] = []
+        self._need = _FRAME_HEAD.size
+        self._log = log_func or log
+
+    def __len__(self) -> int:
+        return len(self._buf) - self._start + len(self._pending or b"")
+
+    def _release(self) -> None:
+        if self._view is None:
+            return
+        for payload in self._payloads:
+            payload.release()
+        self._payloads = []
+        self._view.release()
+        self._view = None
+
+    def reset(self) -> None:
+        self._release()
+        self._buf = bytearray()
+        self._start = 0
+        self._pending = None
+        self._need = _FRAME_HEAD.size
+
+    def feed(self, data: bytes) -> None:
+        self._release()
+        if self._pending is not None:
+            self._buf += self._pending
+            self._pending = None
+        buffered = len(self._buf)
+        if self._start == buffered:
+            if buffered:
+                self._buf.clear()
+                self._start = 0
+            self._pending = data
+            return
+        if self._start * 2 >= buffered:
+            del self._buf[: self._start]
+            self._start = 0
+        self._buf += data
+
+    def frames(self) -> List[Tuple[int, str, memoryview]]:
+        if len(self) < self._need:
+            return []
+        self._release()
+        borrowed = self._pending is not None
+        src = self._pending if borrowed else self._buf
+        off = 0 if borrowed else self._start
+        n = len(src)
+        view = memoryview(src)
+        head_size = _FRAME_HEAD.size
+        unpack_head = _FRAME_HEAD.unpack_from
+        unpack_payload_head = _FRAME_PAYLOAD_HEAD.unpack_from
+        frames: List[Tuple[int, str, memoryview]] = []
+        need = head_size
+        while off + head_size <= n:
+            message_id, _, ref_id_size = unpack_head(view, off)
+            ref_start = off + head_size
+            ref_end = ref_start + ref_id_size
+            payload_start = ref_end + _FRAME_PAYLOAD_HEAD.size
+            if payload_start > n:
+                need = payload_start - off
+                break
+
+            payload_format, payload_size = unpack_payload_head(view, ref_end)
+            if payload_format != 0:
+                self._log(f"バイナリメッセージですが、未対応のペイロード形式です: {payload_format}")
+                off = n
+                break
+
+            payload_end = payload_start + payload_size
+            if payload_end > n:
+                need = payload_end - off
+                break
+
+            frames.append((message_id, str(view[ref_start:ref_end], "utf-8", "replace"), view[payload_start:payload_end]))
+            off = payload_end
+
+        self._need = need
+        self._payloads = [payload for _, _, payload in frames]
+        self._view = view
+        if borrowed:
+            self._pending = None
+            if off < n:
+                self._buf += view[off:]
+        else:
+            self._start = off
+        return frames
+
+
+def benchmark_frame_parser(
+    messages: int = 200_000,
+    chunk_size: int = 1400,
+    batch: int = 20,
+    repeat: int = 5,
+    journal_path: Optional[str] = None,
+) -> List[str]:
+    # 旧方式(bytes連結+スライス)と StreamingFrameBuffer を3パターンで比較する。
+    # fragmented: 注文イベント程度のフレームが chunk_size ごとに分割されて届く
+    # coalesced: 同じフレームが batch 件ずつ1回の受信にまとまって届く
+    # large: スナップショット程度(約32KB)のフレームが分割されて届く
+    # journal_path を指定した場合は、ENSジャーナルに記録された実メッセージを同じ形式で再送して計測する。
+    # 処理速度は repeat 回中の最速値、メモリは tracemalloc による解析中のピーク値。
+    import tracemalloc
+
+    activity = {
+        "AccountId": "12345678",
+        "ActivityTime": "2024-01-01T00:00:00.000000Z",
+        "ActivityType": "Orders",
+        "Amount": 10000.0,
+        "AssetType": "FxSpot",
+        "BuySell": "Buy",
+        "ExternalReference": "T1-entry",
+        "OrderId": "5012345678",
+        "OrderType": "Market",
+        "SubStatus": "Confirmed",
+        "Status": "Working",
+        "Uic": 21,
+    }
+    ref = b"ens_ref"
+
+    def _stream(payload: bytes, count: int) -> bytes:
+        return b"".join(
+            _FRAME_HEAD.pack(i, 0, len(ref)) + ref + _FRAME_PAYLOAD_HEAD.pack(0, len(payload)) + payload
+            for i in range(count)
+        )
+
+    def _split(stream: bytes, size: int) -> List[bytes]:
+        return [stream[i : i + size] for i in range(0, len(stream), size)]
+
+    small = json.dumps({"Data": [activity], "ReferenceId": "ens_ref"}).encode("utf-8")
+    large = json.dumps({"Data": [activity] * 100, "ReferenceId": "ens_ref"}).encode("utf-8")
+    small_stream = _stream(small, messages)
+    large_count = max(1, messages // 100)
+    scenarios = [
+        ("fragmented", len(small), messages, _split(small_stream, chunk_size)),
+        ("coalesced", len(small), messages, _split(small_stream, len(small_stream) // messages * batch)),
+        ("large", len(large), large_count, _split(_stream(large, large_count), chunk_size)),
+    ]
+    if journal_path:
+        recorded = [
+            _FRAME_HEAD.pack(message_id, 0, len(ref_id.encode("utf-8")))
+            + ref_id.encode("utf-8")
+            + _FRAME_PAYLOAD_HEAD.pack(0, len(payload))
+            + payload
+            for message_id, ref_id, payload, _ in EnsMessageJournal.replay(journal_path)
+        ]
+        if recorded:
+            replay_stream = b"".join(recorded)
+            average = len(replay_stream) // len(recorded)
+            scenarios = [
+                ("journal", average, len(recorded), _split(replay_stream, chunk_size)),
+                ("journal-c", average, len(recorded), [b"".join(recorded[i : i + batch]) for i in range(0, len(recorded), batch)]),
+            ]
+
+    def _extract_legacy(data: bytes) -> Tuple[List[Tuple[int, str, str]], bytes]:
+        # 旧 SaxoENSClient._extract_binary_messages と同じ処理
+        messages: List[Tuple[int, str, str]] = []
+        off = 0
+        n = len(data)
+        while off + 16 <= n:
+            message_id = int.from_bytes(data[off : off + 8], "little")
+            ref_id_size = data[off + 10]
+            ref_start = off + 11
+            ref_end = ref_start + ref_id_size
+            if ref_end + 1 > n:
+                break
+            size_start = ref_end + 1
+            size_end = size_start + 4
+            if size_end > n:
+                break
+            payload_size = int.from_bytes(data[size_start:size_end], "little")
+            payload_end = size_end + payload_size
+            if payload_end > n:
+                break
+            reference_id = data[ref_start:ref_end].decode("utf-8", errors="replace")
+            payload_json = data[size_end:payload_end].decode("utf-8", errors="replace")
+            messages.append((message_id, reference_id, payload_json))
+            off = payload_end
+        return messages, data[off:]
+
+    def _legacy(chunks: List[bytes]) -> int:
+        remainder = b""
+        count = 0
+        for chunk in chunks:
+            parsed, remainder = _extract_legacy(remainder + chunk)
+            for _, _, payload in parsed:
+                count += 1
+        return count
+
+    def _buffered(chunks: List[bytes]) -> int:
+        frames = StreamingFrameBuffer()
+        count = 0
+        for chunk in chunks:
+            frames.feed(chunk)
+            for _, _, payload in frames.frames():
+                str(payload, "utf-8", "replace")
+                count += 1
+        return count
+
+    lines = ["フレーム解析ベンチマーク (msg/s は最速値、peak は解析中のピークメモリ)"]
+    for name, payload_size, count, chunks in scenarios:
+        for label, parser in (("legacy", _legacy), ("buffer", _buffered)):
+            elapsed = float("inf")
+            for _ in range(repeat):
+                started = time.perf_counter()
+                parsed = parser(chunks)
+                elapsed = min(elapsed, time.perf_counter() - started)
+            if parsed != count:
+                lines.append(f"{name:<10} {label:<6} 解析件数不一致: {parsed}/{count}")
+                continue
+
+            tracemalloc.start()
+            parser(chunks)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            lines.append(
+                f"{name:<10} {label:<6} payload={payload_size:>6}B x {count:>7}件 "
+                f"{count / elapsed:>12,.0f} msg/s  peak={peak / 1024:,.1f}KiB"
+            )
+    return lines
+
+_JOURNAL_MAGIC = b"SAXOENSJ"
+_JOURNAL_HEADER = struct.Struct("<8sHQQdH")
+_JOURNAL_HEADER_SIZE = 512
+_JOURNAL_RECORD = struct.Struct("<BQdHI")
+_JOURNAL_MESSAGE = 0
+_JOURNAL_CONTEXT = 1
+_JOURNAL_BATCH = -1
+
+
+class EnsMessageJournal:
+    # ストリーミングで受信した生メッセージを日付ごとのファイルへ追記する(mmap)。
+    # ヘッダ: マジック, バージョン, 書込済み末尾, 最終MessageId, 最終書込時刻, 現在のContextId等(JSON)
+    # レコード: 種別, MessageId, 受信時刻, ReferenceId長, ペイロード長, ReferenceId, ペイロード
+    # 種別 CONTEXT は ContextId の切り替わりを示し、ReferenceId 欄に ContextId、ペイロードにサブスクリプション情報を持つ。
+    # 書き込みは専用スレッドで行い、受信ループでは重複判定とキュー投入のみを行う。
+    # 1回の受信で届いたペイロードは投入時にまとめて1回だけコピーし、書き込みスレッドで個々のレコードに分ける。
+    # ヘッダの末尾位置はレコードを書き終えてから更新するため、異常終了時も末尾位置までは整合している。
+    # レコードごとに更新するのは固定長の欄のみで、ContextId等のJSONは ContextId の切り替わり時だけ書き直す。
+    VERSION = 1
+
+    def __init__(self, path: str, initial_size: int = 4 * 1024 * 1024, flush_interval: float = 1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.context: Dict[str, Any] = {}
+        self.last_message_id = 0
+        self._written_id = 0
+        self.last_write_at = 0.0
+        self._meta_len = 0
+        self.written = 0
+        self.duplicates = 0
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+
+        exists = os.path.exists(path) and os.path.getsize(path) >= _JOURNAL_HEADER_SIZE
+        self._file = open(path, "r+b" if exists else "w+b")
+        if not exists:
+            self._file.truncate(max(initial_size, _JOURNAL_HEADER_SIZE * 2))
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+        self._end = _JOURNAL_HEADER_SIZE
+        if exists and not self._load_header():
+            self._mm.close()
+            self._file.close()
+            corrupt_path = f"{path}.corrupt"
+            os.replace(path, corrupt_path)
+            log(f"ENSジャーナルのヘッダが不正なため退避しました: {corrupt_path}")
+            self._file = open(path, "w+b")
+            self._file.truncate(max(initial_size, _JOURNAL_HEADER_SIZE * 2))
+            self._mm = mmap.mmap(self._file.fileno(), 0)
+            self._end = _JOURNAL_HEADER_SIZE
+        self._context_id: Optional[str] = self.context.get("context_id")
+        self._write_header()
+
+    @classmethod
+    def open_for_today(cls, directory: Optional[str] = None, keep_days: int = 7) -> "EnsMessageJournal":
+        directory = directory or os.getcwd()
+        today = datetime.now(TIMEZONE_TOKYO)
+        cutoff = (today - timedelta(days=keep_days - 1)).strftime("%Y%m%d")
+        for filename in os.listdir(directory):
+            if filename.startswith("saxo_ens_journal_") and filename.endswith(".bin") and filename[17:25] < cutoff:
+                try:
+                    os.remove(os.path.join(directory, filename))
+                except OSError:
+                    pass
+        return cls(os.path.join(directory, f"saxo_ens_journal_{today.strftime('%Y%m%d')}.bin"))
+
+    def _load_header(self) -> bool:
+        try:
+            magic, version, end, last_id, last_write_at, meta_len = _JOURNAL_HEADER.unpack_from(self._mm, 0)
+            if magic != _JOURNAL_MAGIC or version != self.VERSION or not _JOURNAL_HEADER_SIZE <= end <= len(self._mm):
+                return False
+            meta = bytes(self._mm[_JOURNAL_HEADER.size : _JOURNAL_HEADER.size + meta_len])
+            self.context = json.loads(meta) if meta else {}
+        except (struct.error, ValueError):
+            return False
+        self._end = end
+        self._meta_len = meta_len
+        self.last_message_id = self._written_id = last_id
+        self.last_write_at = last_write_at
+        return True
+
+    def _write_header(self) -> None:
+        meta = json.dumps(self.context).encode("utf-8")
+        if _JOURNAL_HEADER.size + len(meta) > _JOURNAL_HEADER_SIZE:
+            meta = b"{}"
+        self._mm[_JOURNAL_HEADER.size : _JOURNAL_HEADER.size + len(meta)] = meta
+        self._meta_len = len(meta)
+        self._write_header_fields()
+
+    def _write_header_fields(self) -> None:
+        _JOURNAL_HEADER.pack_into(
+            self._mm, 0, _JOURNAL_MAGIC, self.VERSION, self._end, self._written_id, self.last_write_at, self._meta_len
+        )
+
+    def resume_state(self, max_age_seconds: float) -> Optional[Dict[str, Any]]:
+        # 直前のプロセスが同じContextIdのまま止まっていれば、そのContextIdと最終MessageIdを返す
+        if not self.context.get("context_id") or not self._written_id or not self.last_write_at:
+            return None
+        if time.time() - self.last_write_at > max_age_seconds:
+            return None
+        return dict(self.context, last_message_id=self._written_id)
+
+    def begin_context(self, context_id: str, subscription_id: Optional[str], reference_id: Optional[str]) -> None:
+        if self._context_id == context_id:
+            return
+        self._context_id = context_id
+        self.last_message_id = 0
+        meta = json.dumps(
+            {"context_id": context_id, "subscription_id": subscription_id, "reference_id": reference_id}
+        ).encode("utf-8")
+        self._submit((_JOURNAL_CONTEXT, 0, time.time(), context_id.encode("utf-8"), meta))
+
+    def accept(self, message_id: int) -> bool:
+        # 同一ContextId内の MessageId は単調増加するため、既に受け取った番号以下は重複として捨てる。
+        # 制御メッセージ(_heartbeat 等)は直前のデータと同じ番号を使うため、データのフレームだけを渡すこと
+        if message_id <= self.last_message_id:
+            self.duplicates += 1
+            return False
+        self.last_message_id = message_id
+        return True
+
+    def append_frames(self, frames: List[Tuple[int, str, memoryview]], received_at: float) -> None:
+        # ペイロードは受信バッファの memoryview で次の受信までしか有効でないため、ここでまとめて1回だけコピーする
+        index = [(message_id, reference_id.encode("utf-8"), len(payload)) for message_id, reference_id, payload in frames]
+        self._submit((_JOURNAL_BATCH, 0, received_at, index, b"".join(payload for _, _, payload in frames)))
+
+    def _submit(self, record: Tuple[int, int, float, Any, bytes]) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="ens-journal", daemon=True)
+            self._thread.start()
+        self._queue.put(record)
+
+    def _run(self) -> None:
+        last_flush = time.monotonic()
+        while True:
+            try:
+                record = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                record = False
+            if record is None:
+                break
+            if record:
+                try:
+                    if record[0] == _JOURNAL_BATCH:
+                        self._write_batch(*record[2:])
+                    else:
+                        self._write_record(*record)
+                except Exception as e:
+                    log(f"ENSジャーナルへの書き込みに失敗しました: {e}")
+            if time.monotonic() - last_flush >= self.flush_interval:
+                self._mm.flush()
+                last_flush = time.monotonic()
+        self._mm.flush()
+
+    def _write_batch(self, received_at: float, index: List[Tuple[int, bytes, int]], blob: bytes) -> None:
+        view = memoryview(blob)
+        off = 0
+        for message_id, reference, size in index:
+            self._write_record(_JOURNAL_MESSAGE, message_id, received_at, reference, view[off : off + size])
+            off += size
+
+    def _write_record(self, kind: int, message_id: int, received_at: float, reference: bytes, payload: bytes) -> None:
+        size = _JOURNAL_RECORD.size + len(reference) + len(payload)
+        if self._end + size > len(self._mm):
+            new_size = max(len(self._mm) * 2, self._end + size)
+            self._mm.flush()
+            self._mm.close()
+            self._file.truncate(new_size)
+            self._mm = mmap.mmap(self._file.fileno(), 0)
+        off = self._end
+        _JOURNAL_RECORD.pack_into(self._mm, off, kind, message_id, received_at, len(reference), len(payload))
+        off += _JOURNAL_RECORD.size
+        self._mm[off : off + len(reference)] = reference
+        off += len(reference)
+        self._mm[off : off + len(payload)] = payload
+        self._end = off + len(payload)
+        self.last_write_at = received_at
+        if kind == _JOURNAL_MESSAGE:
+            self._written_id = message_id
+            self.written += 1
+            self._write_header_fields()
+        else:
+            self._written_id = 0
+            self.context = json.loads(payload)
+            self._write_header()
+
+    def close(self, resumable: bool = False) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+        if not resumable:
+            self.last_write_at = 0.0
+        self._write_header()
+        self._mm.flush()
+        self._mm.close()
+        self._file.close()
+        log(f"ENSジャーナルを閉じました: 書込={self.written}件, 重複破棄={self.duplicates}件, {self.path}")
+
+    @staticmethod
+    def replay(path: str) -> Iterator[Tuple[int, str, bytes, float]]:
+        # ジャーナルのメッセージを受信順に返す(ベンチマークや再現用)
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, _, end, _, _, _ = _JOURNAL_HEADER.unpack_from(mm, 0)
+            if magic != _JOURNAL_MAGIC:
+                raise ValueError(f"ENSジャーナルではありません: {path}")
+            off = _JOURNAL_HEADER_SIZE
+            while off + _JOURNAL_RECORD.size <= end:
+                kind, message_id, received_at, ref_len, payload_len = _JOURNAL_RECORD.unpack_from(mm, off)
+                off += _JOURNAL_RECORD.size
+                reference = mm[off : off + ref_len].decode("utf-8", errors="replace")
+                off += ref_len
+                payload = mm[off : off + payload_len]
+                off += payload_len
+                if kind == _JOURNAL_MESSAGE:
+                    yield message_id, reference, payload, received_at
+
+
+class EnsStalenessWatchdog:
+    # ENSの _heartbeat の間隔を学習し、期限までに次のフレームが来なければ停止とみなす。
+    # 価格配信のように間隔が不規則なフレームから学習すると期限が下限まで縮むため、学習には _heartbeat だけを使う。
+    # 期限は「最終受信 + 学習した間隔 × 係数」で、どのフレームを受信しても先送りされる。
+    # タイマーの張り直しは期限到来時にまとめて行い、受信ごとのタイマー操作はしない。
+    def __init__(
+        self,
+        min_seconds: float,
+        max_seconds: float,
+        gap_factor: float,
+        warmup: int = 8,
+        window: int = 64,
+    ):
+        self.min_seconds = min_seconds
+        self.max_seconds = max_seconds
+        self.gap_factor = gap_factor
+        self.warmup = warmup
+        self._gaps: collections.deque = collections.deque(maxlen=window)
+        self._mean: Optional[float] = None
+        self._dev = 0.0
+        self.last_frame_at: Optional[float] = None
+        self.last_heartbeat_at: Optional[float] = None
+        self.detections_ms: collections.deque = collections.deque(maxlen=100)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._on_expire = None
+
+    @property
+    def learned(self) -> bool:
+        return self._mean is not None and len(self._gaps) >= self.warmup
+
+    def deadline_seconds(self) -> float:
+        # 学習が済むまでは従来の固定しきい値を使う
+        if not self.learned:
+            return self.max_seconds
+        learned = max(self._mean + 4 * self._dev, max(self._gaps)) * self.gap_factor
+        return min(self.max_seconds, max(self.min_seconds, learned))
+
+    def start(self, on_expire) -> None:
+        self.stop()
+        self._loop = asyncio.get_running_loop()
+        self._on_expire = on_expire
+        self.last_frame_at = self._loop.time()
+        self._handle = self._loop.call_at(self.last_frame_at + self.deadline_seconds(), self._fire)
+
+    def stop(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self._on_expire = None
+
+    def on_frame(self) -> None:
+        if self._loop is None:
+            return
+        self.last_frame_at = self._loop.time()
+
+    def on_heartbeat(self) -> None:
+        if self._loop is None:
+            return
+        now = self._loop.time()
+        last = self.last_heartbeat_at
+        self.last_heartbeat_at = now
+        if last is None:
+            return
+        gap = now - last
+        if gap > self.max_seconds:
+            # データ配信中は _heartbeat が止まるため、上限を超える間隔は送信間隔の推定に使わない
+            return
+        # 平均と平均偏差は RTO 推定と同じ重みで更新する
+        self._gaps.append(gap)
+        if self._mean is None:
+            self._mean = gap
+            self._dev = gap / 2
+        else:
+            self._dev = 0.75 * self._dev + 0.25 * abs(gap - self._mean)
+            self._mean = 0.875 * self._mean + 0.125 * gap
+        if len(self._gaps) == self.warmup and self._handle is not None:
+            # 学習完了時だけ固定しきい値で張ったタイマーを学習済みの期限に張り直す
+            self._handle.cancel()
+            self._handle = self._loop.call_at(now + self.deadline_seconds(), self._fire)
+
+    def _fire(self) -> None:
+        self._handle = None
+        if self._on_expire is None:
+            return
+        now = self._loop.time()
+        allowed = self.deadline_seconds()
+        deadline = self.last_frame_at + allowed
+        if now < deadline:
+            self._handle = self._loop.call_at(deadline, self._fire)
+            return
+        silence = now - self.last_frame_at
+        self.detections_ms.append(silence * 1000)
+        on_expire, self._on_expire = self._on_expire, None
+        on_expire(silence, allowed, (now - deadline) * 1000)
+
+    def stats(self) -> Dict[str, Any]:
+        detections = sorted(self.detections_ms)
+        return {
+            "mean_gap_s": round(self._mean, 2) if self._mean is not None else None,
+            "dev_gap_s": round(self._dev, 2),
+            "max_gap_s": round(max(self._gaps), 2) if self._gaps else None,
+            "deadline_s": round(self.deadline_seconds(), 1),
+            "detections": len(detections),
+            "detect_p50_ms": round(detections[len(detections) // 2]) if detections else None,
+            "detect_max_ms": round(detections[-1]) if detections else None,
+        }
+
+
 class SaxoENSClient:
-    def __init__(self, saxo_client, ens_url: str, access_token: str, log_func=None, notify_func=None):
+    def __init__(
+        self,
+        saxo_client,
+        ens_url: str,
+        access_token: str,
+        log_func=None,
+        notify_func=None,
+        journal: Optional[EnsMessageJournal] = None,
+    ):
         self.saxo_client = saxo_client
-        self._log = log_func or getattr(saxo_client, "log", print)
+        self.journal = journal
+        saxo_client.streaming.link(self)
+        self._log = log_func or log
         self._notify = notify_func
         self.ws: Optional[websockets.WebSocketClientProtocol] = None
         self.ens_url = ens_url
@@ -1817,15 +3854,32 @@ class SaxoENSClient:
         self.last_message_timestamp: float = 0.0
         self.last_message_id: Optional[int] = None
         self.last_message_summary: Optional[str] = None
-        self.last_ping_ok_timestamp: Optional[float] = None
-        self.last_ping_rtt_ms: Optional[float] = None
+        self.watchdog = EnsStalenessWatchdog(
+            CFG.ens_watchdog_min_seconds,
+            CFG.ens_stale_seconds,
+            CFG.ens_watchdog_gap_factor,
+        )
         self._monitor_task: Optional[asyncio.Task] = None
+        self._stale_notify_task: Optional[asyncio.Task] = None
+        self.last_received_at: Optional[float] = None
         self.shutdown_requested = False
         self.reconnect_attempts = 0
         self.reconnect_started_at: Optional[float] = None
         self.last_disconnect_at: Optional[float] = None
+        self._down_since: Optional[float] = None
+        self.reconnect_ttfm_ms: collections.deque = collections.deque(maxlen=100)
         self._last_notify_seconds: Optional[int] = None
-        self._binary_remainder: bytes = b""
+        self.control_messages: collections.Counter = collections.Counter()
+        self._control_lock = asyncio.Lock()
+        self._frames = StreamingFrameBuffer(self._log)
+        self._handler_queues: List[asyncio.Queue] = []
+        self._handler_tasks: List[asyncio.Task] = []
+        self.handled_count = 0
+        self.handler_errors = 0
+        self.handler_last_ms = 0.0
+        self.handler_max_ms = 0.0
+        self.handler_wait_max_ms = 0.0
+        self.handler_queue_max_depth = 0
 
     async def connect(self):
         self.access_token = self.saxo_client.access_token
@@ -1853,6 +3907,17 @@ class SaxoENSClient:
                 max_queue=16,
             )
             self.is_connected = True
+            self._frames.reset()
+            if self.saxo_client.streaming.needs_resubscribe():
+                task = asyncio.create_task(asyncio.to_thread(self.saxo_client.streaming.resubscribe_all))
+                self.saxo_client._background_tasks.add(task)
+                task.add_done_callback(self.saxo_client._background_tasks.discard)
+            if self.journal is not None and self.saxo_client.streaming_context_id:
+                self.journal.begin_context(
+                    self.saxo_client.streaming_context_id,
+                    self.saxo_client.ens_subscription_id,
+                    self.saxo_client.ens_reference_id,
+                )
             self._log("ENS WebSocket接続成功")
 
             self.last_message_timestamp = time.time()
@@ -1861,6 +3926,10 @@ class SaxoENSClient:
 
             self._listen_task = asyncio.create_task(self.listen())
             self._monitor_task = asyncio.create_task(self.monitor_connection())
+            if self.last_received_at is None:
+                self.last_received_at = time.time()
+            if self._stale_notify_task is None or self._stale_notify_task.done():
+                self._stale_notify_task = asyncio.create_task(self.notify_stale_loop())
 
         except websockets.InvalidStatusCode as e:
             self._log(f"ENS WebSocket接続エラー: {e} ({type(e).__name__})")
@@ -1885,11 +3954,7 @@ class SaxoENSClient:
             last_message_at = datetime.fromtimestamp(self.last_message_timestamp, tz=TIMEZONE_TOKYO).strftime(
                 "%Y-%m-%d %H:%M:%S"
             )
-        last_ping_at = None
-        if self.last_ping_ok_timestamp:
-            last_ping_at = datetime.fromtimestamp(self.last_ping_ok_timestamp, tz=TIMEZONE_TOKYO).strftime(
-                "%Y-%m-%d %H:%M:%S"
-            )
+        ping_latency = getattr(self.ws, "latency", None) if self.ws is not None else None
         detail = [f"reason={reason}"]
         if exc:
             detail.append(f"exception={type(exc).__name__}")
@@ -1901,15 +3966,15 @@ class SaxoENSClient:
             detail.append(f"last_message_at={last_message_at}")
         if self.last_message_id:
             detail.append(f"last_message_id={self.last_message_id}")
-        if last_ping_at:
-            detail.append(f"last_ping_ok_at={last_ping_at}")
-        if self.last_ping_rtt_ms is not None:
-            detail.append(f"last_ping_rtt_ms={self.last_ping_rtt_ms:.1f}")
+        if ping_latency:
+            detail.append(f"ping_latency_ms={ping_latency * 1000:.1f}")
         if self.last_message_summary:
             detail.append(f"last_message_summary={self.last_message_summary}")
+        detail.append(f"handler={self.handler_stats()}")
+        detail.append(f"watchdog={self.watchdog.stats()}")
         self._log("ENS接続断の詳細: " + ", ".join(detail))
 
-    async def reconnect(self, force_new_context: bool = False):
+    async def reconnect(self, force_new_context: bool = False, delete_subscription: bool = False):
         if self.shutdown_requested:
             return
         if self.reconnect_task and not self.reconnect_task.done():
@@ -1918,16 +3983,28 @@ class SaxoENSClient:
 
         async def _reconnect_logic(force_new_context_flag: bool):
             force_new = force_new_context_flag
-            reconnect_delay = 1
+            reconnect_delay = 0.0
+            if delete_subscription:
+                # 制御メッセージで停止を通知されたサブスクリプションは、受信ループではなくここで削除する
+                try:
+                    await asyncio.to_thread(self.saxo_client.delete_ens_subscription)
+                except Exception as e:
+                    self._log(f"ENS subscription削除中のエラー(無視して続行): {e}")
             max_reconnect_delay = CFG.ens_reconnect_max_delay_seconds
             self.reconnect_started_at = time.time()
+            # 接続中に呼ばれた場合(制御メッセージ処理後など)は切断時刻として扱わない
+            if self._down_since is None and not self.is_connected:
+                self._down_since = self.reconnect_started_at
             while not self.is_connected and not self.shutdown_requested:
                 self.reconnect_attempts += 1
-                self._log(
-                    "ENS WebSocketに再接続を試みています... "
-                    f"{reconnect_delay}秒後 (試行{self.reconnect_attempts})"
-                )
-                await asyncio.sleep(reconnect_delay)
+                if reconnect_delay:
+                    self._log(
+                        "ENS WebSocketに再接続を試みています... "
+                        f"{reconnect_delay:.1f}秒後 (試行{self.reconnect_attempts})"
+                    )
+                    await asyncio.sleep(reconnect_delay)
+                else:
+                    self._log(f"ENS WebSocketに即時再接続を試みます (試行{self.reconnect_attempts})")
                 try:
                     self._log(
                         "ENS再接続開始: "
@@ -1935,15 +4012,21 @@ class SaxoENSClient:
                         f"contextId={self.saxo_client.streaming_context_id}, "
                         f"messageid={self.last_message_id}"
                     )
-                    refreshed = await asyncio.to_thread(self.saxo_client.refresh_access_token)
-                    if not refreshed:
-                        self._log("アクセストークンの更新に失敗しました。再認証が必要です。")
-                        self.shutdown_requested = True
-                        break
+                    token_remaining = self.saxo_client.token_remaining_seconds()
+                    if token_remaining < CFG.ens_reconnect_token_margin_seconds:
+                        refreshed = await asyncio.to_thread(self.saxo_client.refresh_access_token)
+                        if not refreshed:
+                            self._log("アクセストークンの更新に失敗しました。再認証が必要です。")
+                            self.shutdown_requested = True
+                            break
+                    else:
+                        self._log(f"アクセストークンの残り有効期間が{token_remaining:.0f}秒あるため、更新を省略します。")
 
                     if not force_new:
-                        await asyncio.to_thread(self.saxo_client.authorize_streaming_context)
-                        rebuilt = await asyncio.to_thread(self.saxo_client.rebuild_streaming_url, self.last_message_id)
+                        _, rebuilt = await asyncio.gather(
+                            asyncio.to_thread(self.saxo_client.authorize_streaming_context),
+                            asyncio.to_thread(self.saxo_client.rebuild_streaming_url, self.last_message_id),
+                        )
                         if rebuilt:
                             self.ens_url = rebuilt
                             await self.connect()
@@ -1973,46 +4056,35 @@ class SaxoENSClient:
                             self._log("サブスクリプション削除後に再試行します。")
                 force_new = False
 
-                reconnect_delay = min(reconnect_delay * 2, max_reconnect_delay)
+                reconnect_delay = min(max(reconnect_delay * 2, 1), max_reconnect_delay)
                 reconnect_delay += random.uniform(0, 0.5)
 
         self.reconnect_task = asyncio.create_task(_reconnect_logic(force_new_context))
 
-    def _extract_binary_messages(self, data: bytes) -> Tuple[List[Tuple[int, str, str]], bytes]:
-        messages: List[Tuple[int, str, str]] = []
-        off = 0
-        n = len(data)
-        while off + 16 <= n:
-            message_id = int.from_bytes(data[off : off + 8], "little")
-            ref_id_size = data[off + 10]
-            ref_start = off + 11
-            ref_end = ref_start + ref_id_size
-            if ref_end + 1 > n:
-                break
-
-            payload_format = data[ref_end]
-            if payload_format != 0:
-                self._log(f"バイナリメッセージですが、未対応のペイロード形式です: {payload_format}")
-                off = n
-                break
-
-            size_start = ref_end + 1
-            size_end = size_start + 4
-            if size_end > n:
-                break
-
-            payload_size = int.from_bytes(data[size_start:size_end], "little")
-            payload_start = size_end
-            payload_end = payload_start + payload_size
-            if payload_end > n:
-                break
+    def _record_time_to_first_message(self, received_at: float) -> None:
+        ttfm_ms = (received_at - self._down_since) * 1000
+        self._down_since = None
+        self.reconnect_ttfm_ms.append(ttfm_ms)
+        samples = sorted(self.reconnect_ttfm_ms)
+        self._log(
+            f"ENS再接続後の初回受信: 切断検知から{ttfm_ms:.0f}ms "
+            f"(直近{len(samples)}回 p50={_percentile(samples, 50):.0f}ms max={samples[-1]:.0f}ms)"
+        )
 
-            reference_id = data[ref_start:ref_end].decode("utf-8", errors="replace")
-            payload_json = data[payload_start:payload_end].decode("utf-8", errors="replace")
-            messages.append((message_id, reference_id, payload_json))
-            off = payload_end
+    def _reset_streams_in_background(self, reference_ids: List[str]) -> None:
+        # 制御メッセージに伴うサブスクリプションの作り直し(DELETE+POST)は受信ループを待たせないよう別タスクで行う。
+        # 同じサブスクリプションを並行して作り直さないよう、作り直しは1件ずつ順に実行する
+        async def _reset() -> None:
+            async with self._control_lock:
+                try:
+                    recreated = await asyncio.to_thread(self.saxo_client.streaming.reset, reference_ids)
+                    self._log(f"ストリーミングのサブスクリプションを作り直しました: 対象={reference_ids}, 再作成={recreated}")
+                except Exception as e:
+                    self._log(f"ストリーミングのサブスクリプションの作り直しに失敗しました: 対象={reference_ids}: {e}")
 
-        return messages, data[off:]
+        task = asyncio.create_task(_reset())
+        self.saxo_client._background_tasks.add(task)
+        task.add_done_callback(self.saxo_client._background_tasks.discard)
 
     async def _handle_control_message(
         self, reference_id: Optional[str], domain_message: Dict[str, Any], received_at: float
@@ -2023,6 +4095,7 @@ class SaxoENSClient:
             return False, False
 
         self.last_message_timestamp = received_at
+        self.control_messages[ref_lower] += 1
 
         if ref_lower == "_heartbeat":
             heartbeats = domain_message.get("Heartbeats")
@@ -2031,12 +4104,23 @@ class SaxoENSClient:
                     if not isinstance(heartbeat, dict):
                         continue
                     reason = heartbeat.get("Reason")
+                    origin = heartbeat.get("OriginatingReferenceId")
+                    self.saxo_client.streaming.mark_alive(origin)
                     if reason:
                         self._log(f"ENS制御メッセージ検出: Heartbeat Reason={reason}")
+                    secondary = self.saxo_client.streaming.owns(origin)
+                    if secondary is not None and secondary.handler is not None:
+                        if reason in ["SubscriptionPermanentlyDisabled", "SubscriptionDisabled"]:
+                            # 価格・残高など ENS 以外の停止はそのサブスクリプションだけを作り直し、接続は維持する
+                            self._log(f"ストリーミング {secondary.name} の停止を検出しました。作り直します: Reason={reason}")
+                            secondary.active = False
+                            if reason == "SubscriptionDisabled":
+                                self._reset_streams_in_background([origin])
+                        continue
                     if reason in ["SubscriptionPermanentlyDisabled", "SessionLimitExceeded", "SubscriptionDisabled"]:
+                        # サブスクリプションの削除は再接続タスク側で行い、受信ループでは REST を待たない
                         self._log("ENSハートビート: subscription系の停止を検出しました。再接続します。")
                         self.is_connected = False
-                        await asyncio.to_thread(self.saxo_client.delete_ens_subscription)
                         return True, True
             return True, False
 
@@ -2050,6 +4134,14 @@ class SaxoENSClient:
 
         if ref_lower == "_resetsubscriptions":
             target_ids = domain_message.get("TargetReferenceIds")
+            if (
+                isinstance(target_ids, list)
+                and target_ids
+                and self.saxo_client.ens_reference_id not in target_ids
+            ):
+                self._log(f"ENS制御メッセージ検出: _resetsubscriptions 対象={target_ids}")
+                self._reset_streams_in_background(target_ids)
+                return True, False
             should_reset = False
             if not target_ids:
                 should_reset = True
@@ -2058,7 +4150,6 @@ class SaxoENSClient:
             if should_reset:
                 self._log("ENS制御メッセージ検出: _resetsubscriptions 対象。再接続します。")
                 self.is_connected = False
-                await asyncio.to_thread(self.saxo_client.delete_ens_subscription)
                 return True, True
             return True, False
 
@@ -2081,19 +4172,33 @@ class SaxoENSClient:
             try:
                 message_raw = await self.ws.recv()
                 received_at = time.time()
+                self.last_received_at = received_at
+                self.watchdog.on_frame()
+                if self._down_since is not None:
+                    self._record_time_to_first_message(received_at)
                 json_payloads: List[Tuple[Optional[str], str]] = []
                 if isinstance(message_raw, bytes):
-                    buffer = self._binary_remainder + message_raw
+                    self._frames.feed(message_raw)
                     try:
-                        parsed_messages, remainder = self._extract_binary_messages(buffer)
-                        self._binary_remainder = remainder
-                        for message_id, ref_id, payload in parsed_messages:
+                        journaled: List[Tuple[int, str, memoryview]] = []
+                        for message_id, ref_id, payload in self._frames.frames():
+                            if ref_id.startswith("_"):
+                                # 制御メッセージは直前のデータと同じ MessageId で届くため、重複判定・記録・再開位置の対象にしない
+                                if payload:
+                                    json_payloads.append((ref_id, str(payload, "utf-8", "replace")))
+                                continue
+                            if self.journal is not None:
+                                if not self.journal.accept(message_id):
+                                    continue
+                                journaled.append((message_id, ref_id, payload))
                             self.last_message_id = message_id
                             if payload:
-                                json_payloads.append((ref_id, payload))
+                                json_payloads.append((ref_id, str(payload, "utf-8", "replace")))
+                        if journaled:
+                            self.journal.append_frames(journaled, received_at)
                     except Exception as e:
                         self._log(f"バイナリメッセージの解析中に予期せぬエラー: {e}")
-                        self._binary_remainder = b""
+                        self._frames.reset()
                         continue
                 else:
                     if message_raw:
@@ -2107,7 +4212,10 @@ class SaxoENSClient:
                         continue
                     if isinstance(json_payload, str) and json_payload.startswith("_heartbeat"):
                         self.last_message_timestamp = received_at
+                        self.watchdog.on_heartbeat()
                         continue
+                    if reference_id == "_heartbeat":
+                        self.watchdog.on_heartbeat()
 
                     try:
                         domain_message = json.loads(json_payload)
@@ -2131,7 +4239,13 @@ class SaxoENSClient:
                         if control_handled:
                             if self.shutdown_requested:
                                 break
-                            await self.reconnect(force_new_context=force_new_context)
+                            await self.reconnect(
+                                force_new_context=force_new_context, delete_subscription=force_new_context
+                            )
+                            continue
+
+                        if self.saxo_client.streaming.route(reference_id, domain_message):
+                            self.last_message_timestamp = received_at
                             continue
 
                         activities = []
@@ -2144,12 +4258,8 @@ class SaxoENSClient:
                             self.last_message_timestamp = received_at
 
                         for item in activities:
-                            if isinstance(item, dict):
-                                act_type = item.get("ActivityType")
-                                if act_type == "Orders":
-                                    await self._handle_order_event(item)
-                                elif act_type == "Positions":
-                                    await self._handle_position_event(item)
+                            if isinstance(item, dict) and item.get("ActivityType") in ["Orders", "Positions"]:
+                                await self._enqueue_activity(item, received_at)
 
                     except json.JSONDecodeError:
                         self._log(f"JSONデコードエラー。受信データ: {str(json_payload)[:200]}")
@@ -2176,12 +4286,82 @@ class SaxoENSClient:
                         await self.reconnect()
                 break
 
+    @property
+    def handler_queue_depth(self) -> int:
+        return sum(q.qsize() for q in self._handler_queues)
+
+    def handler_stats(self) -> Dict[str, Any]:
+        return {
+            "depth": self.handler_queue_depth,
+            "max_depth": self.handler_queue_max_depth,
+            "handled": self.handled_count,
+            "errors": self.handler_errors,
+            "last_ms": round(self.handler_last_ms, 1),
+            "max_ms": round(self.handler_max_ms, 1),
+            "max_wait_ms": round(self.handler_wait_max_ms, 1),
+        }
+
+    def _ensure_handler_workers(self) -> None:
+        if self._handler_tasks and all(not task.done() for task in self._handler_tasks):
+            return
+        for task in self._handler_tasks:
+            task.cancel()
+        workers = max(1, CFG.ens_handler_workers)
+        if len(self._handler_queues) != workers:
+            size = max(1, CFG.ens_handler_queue_size // workers)
+            self._handler_queues = [asyncio.Queue(maxsize=size) for _ in range(workers)]
+        self._handler_tasks = [asyncio.create_task(self._handler_worker(q)) for q in self._handler_queues]
+
+    async def _enqueue_activity(self, item: Dict, received_at: float) -> None:
+        # 受信ループは解析と振り分けだけを行う。同じUICのイベントは同じワーカーが受信順に処理する
+        self._ensure_handler_workers()
+        uic = item.get("Uic")
+        q = self._handler_queues[int(uic) % len(self._handler_queues) if uic is not None else 0]
+        try:
+            q.put_nowait((item, received_at))
+        except asyncio.QueueFull:
+            self._log(f"ENSハンドラキューが満杯です(UIC={uic}, 滞留={self.handler_queue_depth})。空きを待ちます。")
+            await q.put((item, received_at))
+        depth = self.handler_queue_depth
+        if depth > self.handler_queue_max_depth:
+            self.handler_queue_max_depth = depth
+        if depth == CFG.ens_handler_queue_size // 2:
+            self._log(f"警告: ENSイベントハンドラの滞留が増えています: {self.handler_stats()}")
+
+    async def _handler_worker(self, q: asyncio.Queue) -> None:
+        while True:
+            item, received_at = await q.get()
+            started = time.time()
+            try:
+                if item.get("ActivityType") == "Orders":
+                    await self._handle_order_event(item)
+                else:
+                    await self._handle_position_event(item)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.handler_errors += 1
+                self._log(f"ENSイベントハンドラでエラー: {e} ({type(e).__name__})")
+            finally:
+                q.task_done()
+                finished = time.time()
+                self.handled_count += 1
+                self.handler_last_ms = (finished - started) * 1000
+                self.handler_max_ms = max(self.handler_max_ms, self.handler_last_ms)
+                self.handler_wait_max_ms = max(self.handler_wait_max_ms, (started - received_at) * 1000)
+
     async def _handle_order_event(self, event_data: Dict):
-        self._log(f"ENS Orderイベント受信: {event_data}")
+        order_id = str(event_data.get("OrderId", ""))
+        set_log_context(
+            trade_id=trade_id_from_external_reference(event_data.get("ExternalReference")),
+            order_id=order_id,
+            uic=event_data.get("Uic"),
+        )
+        self._log("ENS Orderイベント受信: %s", event_data)
+        self.saxo_client.portfolio.invalidate()
 
         status = event_data.get("Status", "").lower()
         sub_status = event_data.get("SubStatus", "").lower()
-        order_id = str(event_data.get("OrderId", ""))
         related_label = self.saxo_client.related_order_labels.get(order_id)
 
         if status in ["fill", "finalfill"] and (not sub_status or sub_status == "confirmed"):
@@ -2195,24 +4375,8 @@ class SaxoENSClient:
                     self._log(
                         f"🎯 {related_label}に到達し約定: OrderID={order_id}, Price={execution_price}"
                     )
-                    self.saxo_client.related_order_labels.pop(order_id, None)
-                    for uic, order_ids in self.saxo_client.sl_order_ids_by_uic.items():
-                        order_ids.discard(order_id)
                 self._log(f"✨ ENSから注文完全約定イベント: OrderID={order_id}, Price={execution_price}")
-                await self.saxo_client._get_ens_event_queue().put(
-                    {
-                        "type": "order_fill",
-                        "order_id": order_id,
-                        "execution_price": Decimal(str(execution_price)),
-                        "execution_time": event_data.get("ActivityTime"),
-                        "filled_amount": filled_amount,
-                        "amount": amount,
-                        "status": "filled",
-                        "uic": event_data.get("Uic"),
-                        "position_id": str(event_data.get("PositionId")) if event_data.get("PositionId") else None,
-                    }
-                )
-                await self.saxo_client._dispatch_ens_event(
+                await self.saxo_client.ens_bus.publish(
                     {
                         "type": "order_fill",
                         "order_id": order_id,
@@ -2228,19 +4392,8 @@ class SaxoENSClient:
         elif status in ["canceled", "cancelled", "rejected", "expired"]:
             if related_label:
                 self._log(f"🧹 {related_label}注文がキャンセル: OrderID={order_id}, Status={status}")
-                self.saxo_client.related_order_labels.pop(order_id, None)
-                for uic, order_ids in self.saxo_client.sl_order_ids_by_uic.items():
-                    order_ids.discard(order_id)
             self._log(f"ENSから注文ステータス変更イベント: OrderID={event_data.get('OrderId')}, Status={status}")
-            await self.saxo_client._get_ens_event_queue().put(
-                {
-                    "type": "order_status_change",
-                    "order_id": order_id,
-                    "status": status,
-                    "uic": event_data.get("Uic"),
-                }
-            )
-            await self.saxo_client._dispatch_ens_event(
+            await self.saxo_client.ens_bus.publish(
                 {
                     "type": "order_status_change",
                     "order_id": order_id,
@@ -2250,26 +4403,16 @@ class SaxoENSClient:
             )
 
     async def _handle_position_event(self, event_data: Dict):
+        set_log_context(uic=event_data.get("Uic"))
+        self.saxo_client.portfolio.invalidate()
         position_id = event_data.get("PositionId")
         position_event = event_data.get("PositionEvent", "").lower()
         amount = Decimal(str(event_data.get("Amount", "0")))
 
         if position_event == "deleted" or amount == Decimal("0"):
             self._log(f"ENSからポジションクローズイベントを受信しました: PositionID={position_id}, Event={position_event}")
-            uic = event_data.get("Uic")
-            if uic is not None:
-                await asyncio.to_thread(self.saxo_client.cancel_related_orders_for_uic, int(uic))
-            await self.saxo_client._get_ens_event_queue().put(
-                {
-                    "type": "position_closed",
-                    "position_id": position_id,
-                    "status": "closed",
-                    "uic": event_data.get("Uic"),
-                    "execution_price": event_data.get("ExecutionPrice") or event_data.get("OpenPrice"),
-                    "execution_time": event_data.get("ExecutionTime"),
-                }
-            )
-            await self.saxo_client._dispatch_ens_event(
+            # 残りの関連注文の取消は sl_tracker 購読者がバックグラウンドで起動する
+            await self.saxo_client.ens_bus.publish(
                 {
                     "type": "position_closed",
                     "position_id": position_id,
@@ -2282,62 +4425,75 @@ class SaxoENSClient:
         elif position_event == "created" and amount != Decimal("0"):
             self._log(f"ENSから新規ポジションイベントを受信しました: PositionID={position_id}, Amount={amount}")
 
-    async def _record_ping(self) -> None:
-        if not self.ws:
-            return
-        try:
-            start = time.time()
-            pong_waiter = self.ws.ping()
-            await asyncio.wait_for(pong_waiter, timeout=CFG.ws_ping_timeout)
-            rtt = (time.time() - start) * 1000
-            self.last_ping_ok_timestamp = time.time()
-            self.last_ping_rtt_ms = rtt
-        except Exception as e:
-            self._log(f"ENS ping失敗: {e} ({type(e).__name__})")
-
     def _maybe_notify_stale(self, seconds_since_last: float) -> None:
-        for threshold in CFG.ens_notify_thresholds:
-            if seconds_since_last >= threshold and self._last_notify_seconds != threshold:
-                self._last_notify_seconds = threshold
-                message = (
-                    f"⚠️ ENS無受信 {threshold}秒超過: 最終受信から{seconds_since_last:.1f}秒。"
-                    f"再接続試行中={self.reconnect_task is not None and not self.reconnect_task.done()}"
-                )
-                self._log(message)
-                if self._notify:
-                    self._notify(message)
-                break
-
-    async def monitor_connection(self):
-        self._log("ENS接続監視モニターを開始します。")
-        await asyncio.sleep(5)
+        crossed = [threshold for threshold in CFG.ens_notify_thresholds if seconds_since_last >= threshold]
+        if not crossed:
+            # 受信が再開したら次の停止に備えて通知済みのしきい値を戻す
+            self._last_notify_seconds = None
+            return
+        threshold = crossed[-1]
+        if self._last_notify_seconds is not None and threshold <= self._last_notify_seconds:
+            return
+        self._last_notify_seconds = threshold
+        message = (
+            f"⚠️ ENS無受信 {threshold}秒超過: 最終受信から{seconds_since_last:.1f}秒。"
+            f"再接続試行中={self.reconnect_task is not None and not self.reconnect_task.done()}"
+        )
+        self._log(message)
+        if self._notify:
+            self._notify(message)
 
+    async def notify_stale_loop(self):
+        # 無受信の通知は再接続の判定(ウォッチドッグ)とは独立に、最終受信からの経過時間で行う。
+        # 再接続をまたいで数えるため、再接続しても受信が戻らなければ上位のしきい値まで通知される。
         try:
-            while self.is_connected:
-                await asyncio.sleep(CFG.ens_monitor_interval_seconds)
-
-                time_since_last_message = time.time() - self.last_message_timestamp
+            while not self.shutdown_requested:
+                await asyncio.sleep(CFG.ens_notify_interval_seconds)
+                if self.last_received_at is not None:
+                    self._maybe_notify_stale(time.time() - self.last_received_at)
+        except asyncio.CancelledError:
+            return
 
-                await self._record_ping()
-                self._maybe_notify_stale(time_since_last_message)
+    async def monitor_connection(self):
+        # 受信ループがフレームごとに期限を先送りし、期限を過ぎた時だけここが起きる
+        self._log(f"ENS接続監視ウォッチドッグを開始します: {self.watchdog.stats()}")
+        expired: asyncio.Future = asyncio.get_running_loop().create_future()
 
-                if time_since_last_message > CFG.ens_stale_seconds:
-                    self._log("警告: ENS受信が停止したとみなし、再接続を強制します。")
+        def _on_expire(silence: float, allowed: float, late_ms: float) -> None:
+            if not expired.done():
+                expired.set_result((silence, allowed, late_ms))
 
-                    if self.is_connected:
-                        self.is_connected = False
-                        await self._force_close_ws()
-                        if self._listen_task and not self._listen_task.done():
-                            self._listen_task.cancel()
-                        await self.reconnect()
-
-                    break
+        self.watchdog.start(_on_expire)
+        try:
+            silence, allowed, late_ms = await expired
         except asyncio.CancelledError:
+            self.watchdog.stop()
             self._log("ENS monitor task cancelled")
             return
 
+        if not self.is_connected:
+            return
+        self._log(
+            "警告: ENS受信が停止したとみなし、再接続を強制します。"
+            f"無受信={silence:.1f}秒, 許容={allowed:.1f}秒, タイマー遅延={late_ms:.1f}ms, "
+            f"watchdog={self.watchdog.stats()}"
+        )
+        self.is_connected = False
+        await self._force_close_ws()
+        if self._listen_task and not self._listen_task.done():
+            self._listen_task.cancel()
+        await self.reconnect()
+
     async def disconnect(self):
         self.shutdown_requested = True
+        for task in self._handler_tasks:
+            task.cancel()
+        if self._stale_notify_task is not None:
+            self._stale_notify_task.cancel()
+        self._log(f"ENSイベントハンドラ統計: {self.handler_stats()}")
+        await self.saxo_client.ens_bus.close()
+        if self.journal is not None:
+            await asyncio.to_thread(self.journal.close)
         if self.ws:
             self._log("ENS WebSocketを切断します...")
             await self.ws.close()
@@ -2346,6 +4502,325 @@ class SaxoENSClient:
             self._log("ENS WebSocketを切断しました。")
 
 
+class LocalStreamingServer:
+    # 負荷試験用のストリーミングサーバー代替。Saxo と同じバイナリフレームで ENS の Orders/Positions と
+    # _heartbeat / _resetsubscriptions / _disconnect を送る。ENSサブスクリプションのRESTは rest_request が応答する。
+    # 1フレーム目から messages 件目まで連番の MessageId を振り、messageid 付きの再接続ではその続きから再送する。
+    # 制御メッセージは直前のデータと同じ MessageId で送る(再開位置を動かさないため)。
+    def __init__(
+        self,
+        messages: int,
+        rate: float = 0.0,
+        activities_per_frame: int = 1,
+        coalesce: int = 1,
+        chunk_size: int = 0,
+        heartbeat_interval: float = 1.0,
+        reset_every: int = 0,
+        disconnect_every: int = 0,
+        send_disconnect: bool = True,
+        tail_heartbeats: int = 0,
+        uics: Tuple[int, ...] = (21, 22, 23, 24),
+    ):
+        self.messages = messages
+        self.rate = rate
+        self.activities_per_frame = max(1, activities_per_frame)
+        self.coalesce = max(1, coalesce)
+        self.chunk_size = chunk_size
+        self.heartbeat_interval = heartbeat_interval
+        self.reset_every = reset_every
+        self.disconnect_every = disconnect_every
+        self.send_disconnect = send_disconnect
+        self.tail_heartbeats = tail_heartbeats
+        self.uics = uics
+        self.reference_id = "ens_ref"
+        self.subscription_seq = 0
+        self.sent = 0
+        self.sent_at: Dict[int, float] = {}
+        self.connections = 0
+        self.resumed = 0
+        self.resets_sent = 0
+        self.drops = 0
+        self.bytes_sent = 0
+        self.finished = asyncio.Event()
+        self._server = None
+
+    @property
+    def port(self) -> int:
+        return self._server.sockets[0].getsockname()[1]
+
+    def rest_request(self, method: str, endpoint: str, params=None, json_data=None, **_):
+        if endpoint.startswith("/ens/v1/activities/subscriptions"):
+            if method == "POST":
+                self.subscription_seq += 1
+                self.reference_id = (json_data or {}).get("ReferenceId") or self.reference_id
+                return {"SubscriptionId": f"local-{self.subscription_seq}"}
+            return {}
+        return None
+
+    def _frame(self, message_id: int, reference_id: str, body: Any) -> bytes:
+        ref = reference_id.encode("utf-8")
+        payload = json.dumps(body).encode("utf-8")
+        return _FRAME_HEAD.pack(message_id, 0, len(ref)) + ref + _FRAME_PAYLOAD_HEAD.pack(0, len(payload)) + payload
+
+    def activity_frame(self, seq: int) -> bytes:
+        uic = self.uics[seq % len(self.uics)]
+        if seq % 10 == 0:
+            data = [
+                {
+                    "ActivityType": "Positions",
+                    "PositionEvent": "Updated",
+                    "PositionId": str(seq * 1000 + i),
+                    "Amount": 10000.0,
+                    "Uic": uic,
+                }
+                for i in range(self.activities_per_frame)
+            ]
+        else:
+            data = [
+                {
+                    "ActivityType": "Orders",
+                    "ActivityTime": datetime.now(timezone.utc).isoformat(),
+                    "Amount": 10000.0,
+                    "BuySell": "Buy",
+                    "ExecutionPrice": 1.0845,
+                    "FilledAmount": 10000.0,
+                    "OrderId": str(seq * 1000 + i),
+                    "Status": "FinalFill",
+                    "SubStatus": "Confirmed",
+                    "Uic": uic,
+                }
+                for i in range(self.activities_per_frame)
+            ]
+        return self._frame(seq, self.reference_id, {"Data": data, "ReferenceId": self.reference_id})
+
+    def is_order_frame(self, seq: int) -> bool:
+        return seq % 10 != 0
+
+    def uic_for(self, seq: int) -> int:
+        return self.uics[seq % len(self.uics)]
+
+    async def _send(self, ws, data: bytes) -> None:
+        # chunk_size を指定した場合は1フレームを複数のWebSocketメッセージに分けて送る
+        if self.chunk_size and len(data) > self.chunk_size:
+            for i in range(0, len(data), self.chunk_size):
+                await ws.send(data[i : i + self.chunk_size])
+        else:
+            await ws.send(data)
+        self.bytes_sent += len(data)
+
+    async def _heartbeats(self, ws) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            body = [{"ReferenceId": "_heartbeat", "Heartbeats": [{"OriginatingReferenceId": self.reference_id, "Reason": "NoNewData"}]}]
+            await self._send(ws, self._frame(self.sent, "_heartbeat", body))
+
+    async def _handle(self, ws, path: Optional[str] = None) -> None:
+        path = path or getattr(getattr(ws, "request", None), "path", None) or getattr(ws, "path", "")
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(path).query)
+        self.connections += 1
+        resume_from = query.get("messageid", [None])[0]
+        if resume_from is not None:
+            self.resumed += 1
+            self.sent = int(resume_from)
+        heartbeat_task = asyncio.create_task(self._heartbeats(ws)) if self.heartbeat_interval > 0 else None
+        loop = asyncio.get_running_loop()
+        next_at = loop.time()
+        sent_here = 0
+        try:
+            while self.sent < self.messages:
+                batch = []
+                now = time.perf_counter()
+                for _ in range(min(self.coalesce, self.messages - self.sent)):
+                    self.sent += 1
+                    self.sent_at[self.sent] = now
+                    batch.append(self.activity_frame(self.sent))
+                await self._send(ws, b"".join(batch))
+                sent_here += len(batch)
+                if self.rate > 0:
+                    next_at += len(batch) / self.rate
+                    await asyncio.sleep(max(0.0, next_at - loop.time()))
+                else:
+                    await asyncio.sleep(0)
+                if self.reset_every and sent_here >= self.reset_every and self.sent < self.messages:
+                    self.resets_sent += 1
+                    body = {"ReferenceId": "_resetsubscriptions", "TargetReferenceIds": [self.reference_id]}
+                    await self._send(ws, self._frame(self.sent, "_resetsubscriptions", body))
+                    await ws.wait_closed()
+                    return
+                if self.disconnect_every and sent_here >= self.disconnect_every and self.sent < self.messages:
+                    self.drops += 1
+                    await ws.close(1011, "local server drop")
+                    return
+            if heartbeat_task is not None and self.tail_heartbeats:
+                # データ送信後も無通信時の _heartbeat を tail_heartbeats 回分送ってから切断する
+                await asyncio.sleep(self.heartbeat_interval * self.tail_heartbeats)
+            if self.send_disconnect:
+                await self._send(ws, self._frame(self.sent, "_disconnect", {"ReferenceId": "_disconnect"}))
+            self.finished.set()
+            await ws.wait_closed()
+        except websockets.ConnectionClosed:
+            return
+        finally:
+            if heartbeat_task is not None:
+                heartbeat_task.cancel()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        self._server = await websockets.serve(self._handle, host, port, max_size=None)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+
+async def run_ens_loadtest(
+    messages: int = 20_000,
+    rate: float = 0.0,
+    activities_per_frame: int = 1,
+    coalesce: int = 1,
+    chunk_size: int = 0,
+    heartbeat_interval: float = 0.2,
+    reset_every: int = 0,
+    disconnect_every: int = 0,
+    waiter_samples: int = 1000,
+    timeout_seconds: float = 120.0,
+    journal: int = 1,
+    tail_heartbeats: int = 10,
+) -> List[str]:
+    # LocalStreamingServer に SaxoENSClient を接続し、受信処理の msg/s、送信からENS待機の解決までの遅延、
+    # 切断・_resetsubscriptions からの再接続を計測する。サーバーとクライアントは同じイベントループで動く。
+    # 本番の既定と同じく ENS ジャーナル(一時ファイル)を付けて動かし、journal=0 で外せる。
+    # 最後に _heartbeat と _disconnect が受信側まで届いたかを検証し、結果を「検証:」の行で返す。
+    server = LocalStreamingServer(
+        messages,
+        rate=rate,
+        activities_per_frame=activities_per_frame,
+        coalesce=coalesce,
+        chunk_size=chunk_size,
+        heartbeat_interval=heartbeat_interval,
+        reset_every=reset_every,
+        disconnect_every=disconnect_every,
+        tail_heartbeats=tail_heartbeats,
+    )
+    await server.start()
+    cfg = dataclasses.replace(
+        CFG,
+        client_id=CFG.client_id or "loadtest",
+        client_secret=CFG.client_secret or "loadtest",
+        redirect_uri=CFG.redirect_uri or "http://127.0.0.1/",
+        streaming_ws_base=f"ws://127.0.0.1:{server.port}/streaming",
+        streaming_authorize_enabled=False,
+    )
+    client = SaxoClient(cfg)
+    client.access_token = "loadtest"
+    client.token_expires_at = time.time() + 3600
+    client._make_request = server.rest_request
+    notable: collections.deque = collections.deque(maxlen=20)
+
+    def _loadtest_log(message: str, *args: Any, **fields: Any) -> None:
+        # イベントごとのログは計測を歪めるため、再接続・警告・エラーだけを残す
+        if "再接続" in message or "警告" in message or "エラー" in message:
+            notable.append(message % args if args else message)
+
+    journal_dir = tempfile.TemporaryDirectory(prefix="saxo_ens_loadtest_") if journal else None
+    ens_journal = EnsMessageJournal(os.path.join(journal_dir.name, "journal.bin")) if journal_dir else None
+    ens_client = SaxoENSClient(
+        client, client.setup_ens_subscription(), client.access_token, log_func=_loadtest_log, journal=ens_journal
+    )
+    if heartbeat_interval > 0:
+        # 下限は本番の _heartbeat 間隔に合わせてあるため、ローカルサーバーの間隔に縮めて学習結果が期限に効くようにする
+        ens_client.watchdog.min_seconds = min(ens_client.watchdog.min_seconds, heartbeat_interval * 5)
+
+    latencies_ms: List[float] = []
+    step = max(1, messages // max(1, waiter_samples))
+    waiters = []
+    for seq in range(step, messages + 1, step):
+        if not server.is_order_frame(seq):
+            seq -= 1
+        future = client.ens_waiters.register(str(seq * 1000), server.uic_for(seq), ["order_fill"])
+        future.add_done_callback(
+            lambda f, seq=seq: latencies_ms.append((time.perf_counter() - server.sent_at[seq]) * 1000)
+            if not f.cancelled()
+            else None
+        )
+        waiters.append(future)
+
+    expected = messages * server.activities_per_frame
+    started = time.perf_counter()
+    await ens_client.connect()
+    try:
+        deadline = started + timeout_seconds
+        elapsed = None
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+            if elapsed is None and ens_client.handled_count >= expected:
+                # スループットは全件の処理までで測り、その後の _heartbeat / _disconnect の待ちは含めない
+                elapsed = time.perf_counter() - started
+            if server.finished.is_set() and ens_client.shutdown_requested and ens_client.handler_queue_depth == 0:
+                break
+            if not server.send_disconnect and elapsed is not None:
+                break
+        if elapsed is None:
+            elapsed = time.perf_counter() - started
+        # 最後のイベントの待機解決(done callback)を反映させる
+        await asyncio.sleep(0)
+    finally:
+        for future in waiters:
+            client.ens_waiters.unregister(future)
+            if not future.done():
+                future.cancel()
+        for task in (ens_client._monitor_task, ens_client._listen_task, ens_client.reconnect_task):
+            if task is not None and not task.done():
+                task.cancel()
+        await ens_client.disconnect()
+        await server.stop()
+        if journal_dir is not None:
+            journal_dir.cleanup()
+
+    checks = []
+    if server.heartbeat_interval > 0 and tail_heartbeats:
+        received = ens_client.control_messages["_heartbeat"]
+        checks.append((received > 0, f"_heartbeat 受信={received}件"))
+        watchdog = ens_client.watchdog
+        deadline = watchdog.deadline_seconds()
+        checks.append(
+            (
+                watchdog.learned and deadline < watchdog.max_seconds,
+                f"ウォッチドッグ期限 初期={watchdog.max_seconds:.1f}秒 → 学習後={deadline:.1f}秒 "
+                f"(_heartbeat 間隔={server.heartbeat_interval}秒)",
+            )
+        )
+    if server.send_disconnect and server.finished.is_set():
+        received = ens_client.control_messages["_disconnect"]
+        checks.append((received > 0 and ens_client.shutdown_requested, f"_disconnect 受信={received}件"))
+    samples = sorted(latencies_ms)
+    ttfm = sorted(ens_client.reconnect_ttfm_ms)
+    lines = [
+        "ENSローカル負荷試験 (サーバー/クライアント同一プロセス)",
+        f"条件: frames={messages} activities/frame={server.activities_per_frame} coalesce={server.coalesce} "
+        f"chunk={chunk_size or '-'} rate={rate or '無制限'} reset_every={reset_every or '-'} "
+        f"disconnect_every={disconnect_every or '-'}",
+        f"処理: {ens_client.handled_count}/{expected}件 {elapsed:.2f}秒 "
+        f"{ens_client.handled_count / elapsed:,.0f} activities/s  送信={server.bytes_sent / 1024 / 1024:.1f}MiB",
+        f"待機解決の遅延(送信→Future): {len(samples)}/{len(waiters)}件 "
+        f"p50={_percentile(samples, 50):.2f}ms p99={_percentile(samples, 99):.2f}ms "
+        f"max={samples[-1] if samples else 0.0:.2f}ms",
+        f"接続: {server.connections}回 (messageid再開={server.resumed}, reset送信={server.resets_sent}, "
+        f"切断={server.drops}) 再接続後の初回受信 p50={_percentile(ttfm, 50):.0f}ms "
+        f"max={ttfm[-1] if ttfm else 0.0:.0f}ms",
+        f"ハンドラ: {ens_client.handler_stats()}",
+        f"待機レジストリ: {client.ens_waiters.stats()}",
+        f"ウォッチドッグ: {ens_client.watchdog.stats()}",
+        f"ジャーナル: 書込={ens_journal.written}件, 重複破棄={ens_journal.duplicates}件"
+        if ens_journal is not None
+        else "ジャーナル: なし",
+    ]
+    lines.extend(f"検証: {'OK' if ok else 'NG'} {detail}" for ok, detail in checks)
+    lines.extend(notable)
+    return lines
+
+
 def normalize_currency_pair_for_api(pair_from_csv: str) -> str:
     normalized = pair_from_csv.replace("_", "/").upper()
     if "/" not in normalized and len(normalized) == 6:
@@ -2410,6 +4885,11 @@ def make_external_reference(trade_id: int, kind: str) -> str:
     return f"{today}_trade_{trade_id}_{kind}_v1"
 
 
+def trade_id_from_external_reference(reference: Optional[str]) -> Optional[int]:
+    match = re.search(r"_trade_(\d+)_", reference or "")
+    return int(match.group(1)) if match else None
+
+
 def calculate_spread_pips(pair_name: str, bid: Decimal, ask: Decimal) -> Optional[Decimal]:
     if bid == Decimal("0") or ask == Decimal("0") or bid > ask:
         log(f"スプレッド計算のための無効なbid/ask: Bid={bid}, Ask={ask} ({pair_name}用)")
@@ -2426,57 +4906,989 @@ def calculate_spread_pips(pair_name: str, bid: Decimal, ask: Decimal) -> Optiona
     return spread_pips.quantize(Decimal("0.1"), rounding=ROUND_HALF_UP)
 
 
-async def wait_until_time_with_random_advance(saxo_client: SaxoClient, target_time_str: str, label: str) -> bool:
+def plan_fire_time(target_time_str: str, label: str, now: Optional[datetime] = None) -> Optional[datetime]:
+    # 目標時刻から 0〜SAXO_RANDOM_DELAY_SEC 秒のゆらぎを引いた実行時刻を決める。形式不正・経過済みは None
+    now_jst = now or datetime.now(TIMEZONE_TOKYO)
     try:
-        now_jst = datetime.now(TIMEZONE_TOKYO)
-        target_time_obj = _parse_hhmmss(target_time_str)
-        target_dt_today = datetime.combine(now_jst.date(), target_time_obj, tzinfo=TIMEZONE_TOKYO)
+        target_dt_today = datetime.combine(now_jst.date(), _parse_hhmmss(target_time_str), tzinfo=TIMEZONE_TOKYO)
     except RuntimeError:
         log(f"エラー: {label} の時間形式が無効です: {target_time_str}")
-        return False
+        return None
 
     if target_dt_today < now_jst:
-        log(f"{label} の時刻 {target_time_str} は既に経過しています。待機せずに即時スキップします。")
-        return False
+        log(f"{label} の時刻 {target_time_str} は既に経過しています。")
+        return None
 
     wait_seconds = (target_dt_today - now_jst).total_seconds()
     advance_seconds = random.uniform(0, min(CFG.random_delay_sec, wait_seconds))
-
     final_exec_dt = target_dt_today - timedelta(seconds=advance_seconds)
-
     log(f"{label}: 目標時刻={target_time_str}, ゆらぎ={advance_seconds:.2f}秒, 最終実行時刻={final_exec_dt.strftime('%H:%M:%S')}")
+    return final_exec_dt
+
+
+class ScheduledAction:
+    __slots__ = ("due", "fire", "wake", "seq", "kind", "label", "callback", "cancelled")
+
+    def __init__(self, due: float, seq: int, kind: str, label: str, callback):
+        self.due = due
+        self.fire = due
+        self.wake = due
+        self.seq = seq
+        self.kind = kind
+        self.label = label
+        self.callback = callback
+        self.cancelled = False
+
+    def __lt__(self, other: "ScheduledAction") -> bool:
+        return (self.wake, self.seq) < (other.wake, other.seq)
+
+
+class ActionScheduler:
+    # エントリー・決済・事前確認・直前準備を実行時刻のヒープで管理し、先頭の期限に合わせて loop.call_at で1回だけ起きる。
+    # 期限は壁時計(epoch秒)で持ち、起床はモノトニック時計で張る。壁時計との差が広がらないよう、
+    # 先頭が RESYNC_SECONDS より先の場合はその時点で一度起きて張り直す。
+    # clock を渡すと期限をブローカー時刻とみなしてローカル時刻へ換算し、COMPENSATED_KINDS は到達予定が期限に
+    # 合うよう前倒しする。これらは FINAL_APPROACH_SECONDS 手前で起き、残りは perf_counter を見ながら詰める。
+    # 起床時刻と予定時刻の差(発火誤差)を種別ごとに記録する。
+    RESYNC_SECONDS = 60.0
+    FINAL_APPROACH_SECONDS = 0.02
+    COMPENSATED_KINDS = frozenset({"entry", "exit"})
+    HISTOGRAM_BOUNDS_MS = (1.0, 5.0, 20.0, 100.0)
+
+    def __init__(self, clock: Optional[BrokerClock] = None):
+        self._clock = clock
+        self._clock_version = -1
+        self._heap: List[ScheduledAction] = []
+        self._seq = 0
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._armed_wake: Optional[float] = None
+        self._running: set = set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.errors_ms: Dict[str, List[float]] = {}
+
+    def __len__(self) -> int:
+        return sum(1 for action in self._heap if not action.cancelled)
+
+    def schedule(self, when: datetime, kind: str, label: str, callback) -> ScheduledAction:
+        # callback は引数なしのコルーチン関数。予定時刻が過ぎていれば次の起床で即時実行する
+        self._seq += 1
+        action = ScheduledAction(when.timestamp(), self._seq, kind, label, callback)
+        self._place(action)
+        heapq.heappush(self._heap, action)
+        self._idle.clear()
+        if self._armed_wake is None or action.wake < self._armed_wake:
+            self._arm()
+        return action
+
+    def _place(self, action: ScheduledAction) -> None:
+        action.fire = action.due
+        if self._clock is not None:
+            action.fire -= self._clock.offset
+            if action.kind in self.COMPENSATED_KINDS:
+                action.fire -= self._clock.lead_seconds(action.kind)
+        action.wake = action.fire
+        if action.kind in self.COMPENSATED_KINDS:
+            action.wake -= self.FINAL_APPROACH_SECONDS
+
+    def cancel_all(self) -> None:
+        for action in self._heap:
+            action.cancelled = True
+        self._heap.clear()
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+            self._armed_wake = None
+        self._check_idle()
+
+    async def wait_idle(self) -> None:
+        # 予定が空になり、実行中のアクションも終わるまで待つ
+        while True:
+            await self._idle.wait()
+            if not self._heap and not self._running:
+                return
 
-    events = [{"time": final_exec_dt, "action": "FINAL_ACTION"}]
-    now_for_ping = datetime.now(TIMEZONE_TOKYO)
-    if (final_exec_dt - timedelta(seconds=30)) > now_for_ping:
-        events.append({"time": final_exec_dt - timedelta(seconds=30), "action": "PING_30S"})
-    if (final_exec_dt - timedelta(seconds=60)) > now_for_ping:
-        events.append({"time": final_exec_dt - timedelta(seconds=60), "action": "PING_60S"})
-
-    for event in sorted(events, key=lambda x: x["time"]):
-        sleep_duration = (event["time"] - datetime.now(TIMEZONE_TOKYO)).total_seconds()
-        if sleep_duration > 0:
-            log(f"次のアクション '{event['action']}' まで {sleep_duration:.2f} 秒待機します...")
-            await asyncio.sleep(sleep_duration)
-
-        if event["action"].startswith("PING"):
-            log(f"接続の事前確認 ({event['action']}) を行います...")
-            if not await asyncio.to_thread(saxo_client.validate_token):
-                log(f"エラー: 接続の事前確認に失敗しました。{label} をスキップします。")
-                return False
-            log(f"事前確認 ({event['action']}) 成功。")
-        elif event["action"] == "FINAL_ACTION":
-            log(f"{label} の実行時刻になりました。")
-            break
+    def _arm(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+            self._armed_wake = None
+        if self._clock is not None and self._clock.version != self._clock_version:
+            # 時計の推定が更新されたら全予定のローカル時刻を引き直す
+            self._clock_version = self._clock.version
+            for action in self._heap:
+                self._place(action)
+            heapq.heapify(self._heap)
+        while self._heap and self._heap[0].cancelled:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            self._check_idle()
+            return
+        loop = asyncio.get_running_loop()
+        wake = self._heap[0].wake
+        delay = min(wake - time.time(), self.RESYNC_SECONDS)
+        self._armed_wake = wake
+        self._handle = loop.call_at(loop.time() + max(delay, 0.0), self._wake)
+
+    def _wake(self) -> None:
+        self._handle = None
+        self._armed_wake = None
+        now = time.time()
+        # call_at は時計分解能ぶん早く呼ばれることがあるため、1ms以内は期限到来とみなす
+        while self._heap and self._heap[0].wake - now <= 0.001:
+            action = heapq.heappop(self._heap)
+            if action.cancelled:
+                continue
+            task = asyncio.create_task(self._run(action))
+            self._running.add(task)
+            task.add_done_callback(self._finished)
+        self._arm()
+
+    async def _run(self, action: ScheduledAction) -> None:
+        if action.wake < action.fire:
+            # 最終接近: タイマー分解能(Windowsでは約15ms)に頼らず、イベントループへ譲りながら perf_counter で待つ
+            target = time.perf_counter() + (action.fire - time.time())
+            while time.perf_counter() < target:
+                await asyncio.sleep(0)
+        self.errors_ms.setdefault(action.kind, []).append((time.time() - action.fire) * 1000)
+        try:
+            await action.callback()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log(f"スケジュール実行中にエラーが発生しました ({action.kind} {action.label}): {e}", level="ERROR")
+
+    def _finished(self, task: asyncio.Task) -> None:
+        self._running.discard(task)
+        if self._heap and self._clock is not None and self._clock.version != self._clock_version:
+            self._arm()
+        self._check_idle()
+
+    def _check_idle(self) -> None:
+        if not self._heap and not self._running:
+            self._idle.set()
+
+    def histogram_lines(self) -> List[str]:
+        lines: List[str] = []
+        for kind, samples in self.errors_ms.items():
+            values = sorted(samples)
+            buckets = [0] * (len(self.HISTOGRAM_BOUNDS_MS) + 1)
+            for value in values:
+                index = 0
+                while index < len(self.HISTOGRAM_BOUNDS_MS) and abs(value) > self.HISTOGRAM_BOUNDS_MS[index]:
+                    index += 1
+                buckets[index] += 1
+            labels = [f"≤{bound:g}ms" for bound in self.HISTOGRAM_BOUNDS_MS] + [f">{self.HISTOGRAM_BOUNDS_MS[-1]:g}ms"]
+            lines.append(
+                f"{kind}: n={len(values)} p50={_percentile(values, 50):.2f}ms p99={_percentile(values, 99):.2f}ms "
+                f"max={values[-1]:.2f}ms [" + " ".join(f"{label}:{count}" for label, count in zip(labels, buckets)) + "]"
+            )
+        return lines
+
+
+class TradeStatus(str, Enum):
+    PENDING = "Pending"
+    SKIPPED_TIME_PASSED = "スキップ (時刻経過)"
+    SKIPPED_NO_UIC = "スキップ (UICなし)"
+    SKIPPED_SPREAD = "スキップ (スプレッド上限)"
+    ENTRY_ORDERED = "エントリー発注済み"
+    ENTERED = "エントリー済み"
+    ENTRY_FAILED = "エントリー失敗"
+    ENTRY_FAILED_UNCONFIRMED = "エントリー失敗 (確認不可)"
+    ENTRY_FAILED_UNKNOWN = "エントリー失敗 (不明状態)"
+    ENTRY_FAILED_TIMEOUT = "エントリー失敗 (時間超過)"
+    EXIT_ORDERED = "決済発注済み"
+    CLOSED = "決済済み"
+    CLOSED_PRICE_UNKNOWN = "決済済み (価格不明)"
+    CLOSED_BEFORE_EXIT = "決済済み（事前クローズ）"
+    EXIT_FAILED_UNCONFIRMED = "決済失敗 (確認不可)"
+    EXIT_FAILED_ORDER = "決済失敗 (注文エラー)"
+
+
+OPEN_TRADE_STATUSES = frozenset({TradeStatus.ENTRY_ORDERED, TradeStatus.ENTERED})
+IN_FLIGHT_TRADE_STATUSES = frozenset({TradeStatus.ENTRY_ORDERED, TradeStatus.ENTERED, TradeStatus.EXIT_ORDERED})
+SETTLED_TRADE_STATUSES = frozenset({TradeStatus.CLOSED, TradeStatus.CLOSED_PRICE_UNKNOWN})
+
+
+def _seconds_of_day(value: str) -> int:
+    t = _parse_hhmmss(value)
+    return t.hour * 3600 + t.minute * 60 + t.second
+
+
+class TradeRecord:
+    __slots__ = (
+        "id",
+        "entry_time_str",
+        "exit_time_str",
+        "lot_size",
+        "pair_raw",
+        "pair_api",
+        "direction_raw",
+        "direction_api",
+        "status",
+        "entry_price",
+        "exit_price",
+        "pips_profit",
+        "position_id",
+        "entry_order_id",
+        "exit_order_id",
+        "entry_fill_price",
+        "exit_fill_price",
+        "entry_filled_amount",
+        "entry_timestamp_actual",
+        "exit_timestamp_actual",
+        "uic",
+        "asset_type",
+        "symbol",
+        "decimals",
+        "sl_cancel_ms",
+        "entry_latency_ms",
+        "exit_latency_ms",
+        "entry_arrival_error_ms",
+        "exit_arrival_error_ms",
+        "entry_seconds",
+        "exit_seconds",
+        "entry_clock",
+        "exit_clock",
+    )
+
+    # 状態ファイルへ保存しない内部フィールド
+    _TRANSIENT = frozenset({"entry_seconds", "exit_seconds", "entry_clock", "exit_clock"})
+    _PRICE_FIELDS = ("entry_fill_price", "exit_fill_price")
+
+    def __init__(
+        self,
+        trade_id: int,
+        entry_time_str: str,
+        exit_time_str: str,
+        lot_size: float,
+        pair_raw: str,
+        direction_raw: str,
+        direction_api: str,
+    ):
+        for name in self.__slots__:
+            setattr(self, name, None)
+        self.id = trade_id
+        self.entry_time_str = entry_time_str
+        self.exit_time_str = exit_time_str
+        self.lot_size = lot_size
+        self.pair_raw = pair_raw
+        self.pair_api = normalize_currency_pair_for_api(pair_raw)
+        self.direction_raw = direction_raw
+        self.direction_api = direction_api
+        self.status = TradeStatus.PENDING
+        self.pips_profit = Decimal("0")
+        self.entry_latency_ms = {}
+        self.exit_latency_ms = {}
+        self.entry_seconds = _seconds_of_day(entry_time_str)
+        self.exit_seconds = _seconds_of_day(exit_time_str)
+
+    @property
+    def label(self) -> str:
+        return f"取引ID {self.id} ({self.pair_api} {self.direction_api})"
+
+    def start_entry_clock(self) -> StageClock:
+        self.entry_latency_ms = {}
+        self.entry_clock = StageClock(f"{self.label} エントリー", ENTRY_STAGES, self.entry_latency_ms)
+        self.entry_clock.mark("timer_fire")
+        return self.entry_clock
+
+    def start_exit_clock(self) -> StageClock:
+        self.exit_latency_ms = {}
+        self.exit_clock = StageClock(f"{self.label} 決済", EXIT_STAGES, self.exit_latency_ms)
+        self.exit_clock.mark("timer_fire")
+        return self.exit_clock
+
+    def apply_instrument(self, details: Dict[str, Any]) -> None:
+        for key in ("uic", "asset_type", "symbol", "decimals"):
+            if key in details:
+                setattr(self, key, details[key])
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__ if name not in self._TRANSIENT}
+
+    def apply_saved(self, saved: Dict[str, Any]) -> None:
+        for key, value in saved.items():
+            if key in ("id", "status") or key in self._TRANSIENT or key not in self.__slots__:
+                continue
+            if key in self._PRICE_FIELDS and value is not None:
+                try:
+                    value = Decimal(str(value))
+                except Exception as e:
+                    log(f"状態ロード中に価格のDecimal変換に失敗: key={key}, value={value}, error={e}")
+                    value = None
+            elif key == "pips_profit" and value is not None:
+                value = Decimal(str(value))
+            setattr(self, key, value)
+        try:
+            self.status = TradeStatus(saved.get("status", TradeStatus.PENDING.value))
+        except ValueError:
+            log(f"取引ID {self.id} の保存済みステータスが不明なため無視します: {saved.get('status')}")
+
+
+class TradeBook:
+    def __init__(self, trades: Iterable[TradeRecord]):
+        self._trades: Dict[int, TradeRecord] = {}
+        self._by_status: Dict[TradeStatus, Dict[int, TradeRecord]] = {status: {} for status in TradeStatus}
+        for trade in trades:
+            self._trades[trade.id] = trade
+            self._by_status[trade.status][trade.id] = trade
+
+    def __iter__(self) -> Iterator[TradeRecord]:
+        return iter(self._trades.values())
+
+    def __len__(self) -> int:
+        return len(self._trades)
+
+    def get(self, trade_id: int) -> Optional[TradeRecord]:
+        return self._trades.get(trade_id)
+
+    def set_status(self, trade: TradeRecord, status: TradeStatus) -> None:
+        if trade.status == status:
+            return
+        self._by_status[trade.status].pop(trade.id, None)
+        trade.status = status
+        self._by_status[status][trade.id] = trade
+
+    def with_status(self, *statuses: TradeStatus) -> List[TradeRecord]:
+        found: List[TradeRecord] = []
+        for status in statuses:
+            found.extend(self._by_status[status].values())
+        return found
+
+    def count(self, *statuses: TradeStatus) -> int:
+        return sum(len(self._by_status[status]) for status in statuses)
+
+
+class TradeJournal:
+    # 取引ステータスの永続化。状態が変わるたびに全取引を書き直す代わりに、変化したフィールドだけを
+    # 追記専用のWAL(path + ".wal")へ1行ずつ書き、定期的にスナップショット(path)へ畳み込む。
+    # WAL行: "<crc32 16進8桁> <JSON: seq, date, id, fields>"。CRCが合わない行(書きかけ)以降は復旧時に切り捨てる。
+    # 書き込みと fsync は専用スレッドで行い、キューに溜まった分をまとめて1回の fsync で確定する(グループコミット)。
+    # スナップショットは一時ファイルに書いて fsync してから os.replace で置き換えるため、途中で落ちても旧版が残る。
+    # スナップショットは取り込んだ最終 seq を持ち、置換後・WAL切り詰め前に落ちた場合も復旧時に重複を読み飛ばす。
+    COMPACT_RECORDS = 256
+
+    def __init__(self, path: str, compact_records: int = COMPACT_RECORDS):
+        self.path = path
+        self.wal_path = f"{path}.wal"
+        self.compact_records = compact_records
+        self._date: Optional[str] = None
+        self._persisted: Dict[int, Dict[str, Any]] = {}
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        # 以下は書き込みスレッドが所有する
+        self._wal = None
+        self._wal_date: Optional[str] = None
+        self._seq = 0
+        self._state: Dict[str, Dict[str, Any]] = {}
+        self._since_compact = 0
+        self.changes = 0
+        self.record_seconds = 0.0
+        self.wal_bytes = 0
+        self.snapshot_bytes = 0
+        self.fsyncs = 0
+        self.compactions = 0
+
+    def load(self, date_str: str) -> Dict[str, Dict[str, Any]]:
+        # スナップショット + WAL末尾を再生し、取引ID(文字列) -> 保存フィールドを返す。別日の記録は破棄する
+        self.sync()
+        state: Dict[str, Dict[str, Any]] = {}
+        seq = 0
+        snapshot_date = None
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    snapshot = json.load(f)
+                snapshot_date = snapshot["date"]
+                state = snapshot["trades"]
+                seq = int(snapshot.get("seq", 0))
+            except Exception as e:
+                corrupt_path = f"{self.path}.corrupt"
+                os.replace(self.path, corrupt_path)
+                log(f"取引スナップショットが読めないため退避しました: {corrupt_path} ({e})", level="WARNING")
+                state, seq, snapshot_date = {}, 0, None
+        if snapshot_date is not None and snapshot_date != date_str:
+            state, seq = {}, 0
+
+        replayed = 0
+        if os.path.exists(self.wal_path):
+            good_end = 0
+            with open(self.wal_path, "rb") as f:
+                for raw in f:
+                    record = self._decode_line(raw)
+                    if record is None:
+                        log(f"取引WALの末尾 {good_end} バイト以降が不完全なため切り捨てます。", level="WARNING")
+                        break
+                    good_end += len(raw)
+                    if record["date"] != date_str or record["seq"] <= seq:
+                        continue
+                    state.setdefault(str(record["id"]), {}).update(record["fields"])
+                    seq = record["seq"]
+                    replayed += 1
+            with open(self.wal_path, "r+b") as f:
+                f.truncate(good_end)
+
+        self._date = self._wal_date = date_str
+        self._persisted.clear()
+        self._seq = seq
+        self._state = state
+        if not state:
+            self._remove_files()
+        else:
+            log(f"取引ジャーナルを復元しました: 取引={len(state)}件, WAL再生={replayed}件")
+        return {trade_id: dict(fields) for trade_id, fields in state.items()}
+
+    @staticmethod
+    def _decode_line(raw: bytes) -> Optional[Dict[str, Any]]:
+        if not raw.endswith(b"\n") or len(raw) < 10:
+            return None
+        crc_hex, _, payload = raw[:-1].partition(b" ")
+        try:
+            if int(crc_hex, 16) != zlib.crc32(payload):
+                return None
+            return json.loads(payload)
+        except ValueError:
+            return None
+
+    def record(self, trades: Iterable[TradeRecord]) -> List[TradeRecord]:
+        # 前回記録からの差分だけをキューへ積む(イベントループ上では比較とコピーのみ)。変化した取引を返す
+        started = time.perf_counter()
+        date_str = get_jst_time_str().split(" ")[0]
+        if date_str != self._date:
+            # 日付が変わっても日をまたいで建玉中の取引は復旧対象のため、新しい日のスナップショットへ引き継ぐ
+            carried = self._date is not None
+            self._date = date_str
+            self._persisted = {
+                trade_id: fields
+                for trade_id, fields in self._persisted.items()
+                if carried and fields.get("status") in self._carry_statuses()
+            }
+            self._submit(("reset", date_str, carried))
+        changed: List[TradeRecord] = []
+        for trade in trades:
+            current = trade.to_dict()
+            last = self._persisted.get(trade.id)
+            if last is None:
+                delta = current
+            else:
+                delta = {key: value for key, value in current.items() if key not in last or last[key] != value}
+            if not delta:
+                continue
+            # 取引オブジェクトが持つ dict 等を書き込みスレッドと共有しないようコピーする
+            delta = copy.deepcopy(delta)
+            self._persisted[trade.id] = dict(last or {}, **delta)
+            self._submit(("delta", trade.id, delta))
+            changed.append(trade)
+        self.changes += len(changed)
+        self.record_seconds += time.perf_counter() - started
+        return changed
+
+    def clear(self) -> None:
+        # 1日分の取引が完了したら記録を消す
+        self._date = None
+        self._persisted.clear()
+        self._submit(("reset", None, False))
 
-    return True
+    @staticmethod
+    def _carry_statuses() -> frozenset:
+        # 未完了(照合対象)の取引ステータス。RECONCILE_TRADE_STATUSES はこのクラスより後で定義される
+        return frozenset(status.value for status in RECONCILE_TRADE_STATUSES)
+
+    def sync(self, timeout: float = 5.0) -> bool:
+        # キュー済みの記録が fsync されるまで待つ
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        done = threading.Event()
+        self._queue.put(("sync", done))
+        return done.wait(timeout)
+
+    def _submit(self, item: Tuple) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="trade-journal", daemon=True)
+            self._thread.start()
+        self._queue.put(item)
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            waiters: List[threading.Event] = []
+            stop = False
+            dirty = False
+            try:
+                for item in batch:
+                    if item is None:
+                        stop = True
+                    elif item[0] == "sync":
+                        waiters.append(item[1])
+                    elif item[0] == "reset":
+                        self._reset(item[1], item[2])
+                    else:
+                        self._append(item[1], item[2])
+                        dirty = True
+                if dirty:
+                    self._wal.flush()
+                    os.fsync(self._wal.fileno())
+                    self.fsyncs += 1
+                    if self._since_compact >= self.compact_records:
+                        self._compact()
+            except Exception as e:
+                log(f"取引ジャーナルの書き込みに失敗しました: {e}", level="ERROR")
+            for waiter in waiters:
+                waiter.set()
+            if stop:
+                break
+        if self._wal is not None:
+            self._wal.close()
+            self._wal = None
+
+    def _append(self, trade_id: int, fields: Dict[str, Any]) -> None:
+        if self._wal is None:
+            self._wal = open(self.wal_path, "ab")
+        self._seq += 1
+        payload = json.dumps(
+            {"seq": self._seq, "date": self._wal_date, "id": trade_id, "fields": fields}, default=str, ensure_ascii=False
+        ).encode("utf-8")
+        line = b"%08x %s\n" % (zlib.crc32(payload), payload)
+        self._wal.write(line)
+        self.wal_bytes += len(line)
+        self._state.setdefault(str(trade_id), {}).update(fields)
+        self._since_compact += 1
+
+    def _compact(self) -> None:
+        self._write_snapshot()
+        self._wal.seek(0)
+        self._wal.truncate(0)
+        os.fsync(self._wal.fileno())
+        self.fsyncs += 1
+        self.compactions += 1
+        self._since_compact = 0
+
+    def _write_snapshot(self) -> None:
+        snapshot = json.dumps(
+            {"date": self._wal_date, "seq": self._seq, "trades": self._state}, indent=2, default=str, ensure_ascii=False
+        ).encode("utf-8")
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._fsync_directory()
+        self.fsyncs += 2
+        self.snapshot_bytes += len(snapshot)
+
+    def _reset(self, date_str: Optional[str], carry: bool) -> None:
+        # carry=True(日付変更)では未完了の取引だけを新しい日付のスナップショットへ書いてから旧WALを消す。
+        # スナップショットの置換が先なので、途中で落ちても未完了の取引はどちらかの日付で残る
+        if self._wal is not None:
+            self._wal.close()
+            self._wal = None
+        carry_statuses = self._carry_statuses() if carry else frozenset()
+        self._state = {
+            trade_id: fields for trade_id, fields in self._state.items() if fields.get("status") in carry_statuses
+        }
+        self._wal_date = date_str
+        self._seq = 0
+        self._since_compact = 0
+        if self._state:
+            self._write_snapshot()
+            self._remove_files(self.wal_path)
+        else:
+            self._remove_files(self.path, self.wal_path)
+
+    def _remove_files(self, *paths: str) -> None:
+        for path in paths or (self.path, self.wal_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _fsync_directory(self) -> None:
+        # os.replace を確定させる。Windows ではディレクトリを開けないため省略する
+        if os.name == "nt":
+            return
+        fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def close(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+        log(
+            f"取引ジャーナルを閉じました: 変更={self.changes}件, WAL={self.wal_bytes:,}B, "
+            f"スナップショット={self.snapshot_bytes:,}B ({self.compactions}回), fsync={self.fsyncs}回, "
+            f"記録呼び出し合計={self.record_seconds * 1000:.1f}ms"
+        )
+
+
+def benchmark_trade_journal(trades: int = 20, changes: int = 2000) -> List[str]:
+    # 旧 save_statuses(変更のたびに全取引を json.dump(indent=2) で上書き)と TradeJournal を比較する。
+    # 書込増幅は「ディスクへ書いたバイト数 / 変更1件あたりの差分バイト数」。
+    import tempfile
+
+    statuses = list(TradeStatus)
+
+    def _make_book() -> List[TradeRecord]:
+        book = []
+        for trade_id in range(1, trades + 1):
+            trade = TradeRecord(trade_id, "10:00", "10:05", 0.1, "USDJPY", "買", "Buy")
+            trade.entry_latency_ms = {stage: 1.0 for stage in ENTRY_STAGES}
+            book.append(trade)
+        return book
+
+    def _mutate(book: List[TradeRecord], index: int) -> None:
+        trade = book[index % len(book)]
+        trade.status = statuses[index % len(statuses)]
+        trade.entry_fill_price = Decimal("150.123") + index
+
+    result = [f"取引ステータス保存ベンチマーク (取引={trades}件, 変更={changes}回)"]
+    with tempfile.TemporaryDirectory() as directory:
+        book = _make_book()
+        path = os.path.join(directory, "legacy.json")
+        calls: List[float] = []
+        written = 0
+        for index in range(changes):
+            _mutate(book, index)
+            t0 = time.perf_counter()
+            with open(path, "w", encoding="utf-8") as f:
+                state = {"date": "2000-01-01", "trades": {str(t.id): t.to_dict() for t in book}}
+                json.dump(state, f, indent=2, default=str)
+            calls.append(time.perf_counter() - t0)
+            written += os.path.getsize(path)
+        legacy_calls = sorted(calls)
+        legacy_written = written
+
+        book = _make_book()
+        journal = TradeJournal(os.path.join(directory, "journal.json"))
+        journal.record(book)
+        journal.sync()
+        initial = journal.wal_bytes
+        calls = []
+        started = time.perf_counter()
+        for index in range(changes):
+            _mutate(book, index)
+            t0 = time.perf_counter()
+            journal.record(book)
+            calls.append(time.perf_counter() - t0)
+        journal.sync(timeout=60)
+        drain = time.perf_counter() - started
+        journal_written = journal.wal_bytes + journal.snapshot_bytes - initial
+        journal_calls = sorted(calls)
+        delta_bytes = (journal.wal_bytes - initial) / changes
+        journal.close()
+
+    for label, values, written_bytes, extra in (
+        ("legacy", legacy_calls, legacy_written, "fsyncなし"),
+        ("journal", journal_calls, journal_written, f"fsync={journal.fsyncs}回 drain={drain * 1000:,.1f}ms"),
+    ):
+        result.append(
+            f"{label:<8} 書込={written_bytes / changes:,.0f}B/変更 増幅={written_bytes / changes / delta_bytes:,.1f}x "
+            f"p50={_percentile(values, 50) * 1e6:.1f}us p99={_percentile(values, 99) * 1e6:.1f}us "
+            f"max={values[-1] * 1e6:,.0f}us  {extra}"
+        )
+    return result
+
+
+class TradeHistoryStore:
+    # 取引履歴を SQLite(WALモード)に蓄積する。日次の状態ファイルやログが消えた後も、過去の取引・注文・約定・
+    # ステージ別レイテンシを日付・通貨ペア・取引IDで引ける。
+    # 書き込みは専用スレッドがキューをまとめて1トランザクションで行い、イベントループでは行の抽出のみを行う。
+    # 読み出しは呼び出しごとに別接続を開く(WALのため書き込み中でも待たない)。
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS trades (
+            trade_date TEXT NOT NULL,
+            trade_id INTEGER NOT NULL,
+            pair TEXT NOT NULL,
+            direction TEXT NOT NULL,
+            lot_size REAL,
+            entry_time TEXT NOT NULL,
+            exit_time TEXT NOT NULL,
+            status TEXT NOT NULL,
+            pips_profit REAL,
+            position_id TEXT,
+            sl_cancel_ms REAL,
+            entry_arrival_error_ms REAL,
+            exit_arrival_error_ms REAL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (trade_date, trade_id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_trades_pair_time ON trades (pair, entry_time, trade_date)",
+        "CREATE INDEX IF NOT EXISTS idx_trades_id ON trades (trade_id)",
+        """
+        CREATE TABLE IF NOT EXISTS orders (
+            trade_date TEXT NOT NULL,
+            trade_id INTEGER NOT NULL,
+            leg TEXT NOT NULL,
+            order_id TEXT NOT NULL,
+            PRIMARY KEY (trade_date, trade_id, leg)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_orders_order_id ON orders (order_id)",
+        """
+        CREATE TABLE IF NOT EXISTS fills (
+            trade_date TEXT NOT NULL,
+            trade_id INTEGER NOT NULL,
+            leg TEXT NOT NULL,
+            price REAL NOT NULL,
+            amount REAL,
+            executed_at TEXT,
+            PRIMARY KEY (trade_date, trade_id, leg)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS stage_timings (
+            trade_date TEXT NOT NULL,
+            trade_id INTEGER NOT NULL,
+            leg TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            ms REAL NOT NULL,
+            PRIMARY KEY (trade_date, trade_id, leg, stage)
+        )
+        """,
+    )
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self.written = 0
+        self.transactions = 0
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                for statement in self.SCHEMA:
+                    conn.execute(statement)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
 
+    @staticmethod
+    def _rows(trade_date: str, trade: TradeRecord) -> Dict[str, List[Tuple]]:
+        def _num(value) -> Optional[float]:
+            return None if value is None else float(value)
 
-def load_trades_from_csv(filename: str) -> List[Dict]:
+        rows: Dict[str, List[Tuple]] = {
+            "trades": [
+                (
+                    trade_date,
+                    trade.id,
+                    trade.pair_api,
+                    trade.direction_api,
+                    _num(trade.lot_size),
+                    _parse_hhmmss(trade.entry_time_str).strftime("%H:%M:%S"),
+                    _parse_hhmmss(trade.exit_time_str).strftime("%H:%M:%S"),
+                    trade.status.value,
+                    _num(trade.pips_profit),
+                    None if trade.position_id is None else str(trade.position_id),
+                    _num(trade.sl_cancel_ms),
+                    _num(trade.entry_arrival_error_ms),
+                    _num(trade.exit_arrival_error_ms),
+                    time.time(),
+                )
+            ],
+            "orders": [],
+            "fills": [],
+            "stage_timings": [],
+        }
+        for leg, order_id, price, amount, executed_at, timings in (
+            (
+                "entry",
+                trade.entry_order_id,
+                trade.entry_fill_price,
+                trade.entry_filled_amount,
+                trade.entry_timestamp_actual,
+                trade.entry_latency_ms,
+            ),
+            (
+                "exit",
+                trade.exit_order_id,
+                trade.exit_fill_price,
+                None,
+                trade.exit_timestamp_actual,
+                trade.exit_latency_ms,
+            ),
+        ):
+            if order_id is not None:
+                rows["orders"].append((trade_date, trade.id, leg, str(order_id)))
+            if price is not None:
+                rows["fills"].append((trade_date, trade.id, leg, float(price), _num(amount), executed_at))
+            for stage, ms in (timings or {}).items():
+                if ms is not None:
+                    rows["stage_timings"].append((trade_date, trade.id, leg, stage, float(ms)))
+        return rows
+
+    def submit(self, trades: Iterable[TradeRecord], trade_date: Optional[str] = None) -> None:
+        trade_date = trade_date or get_jst_time_str().split(" ")[0]
+        batch = [self._rows(trade_date, trade) for trade in trades]
+        if not batch:
+            return
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="trade-history", daemon=True)
+            self._thread.start()
+        self._queue.put(batch)
+
+    def _run(self) -> None:
+        conn = self._connect()
+        try:
+            while True:
+                items = [self._queue.get()]
+                while True:
+                    try:
+                        items.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stop = None in items
+                waiters = [item for item in items if isinstance(item, threading.Event)]
+                # 同じ取引が複数回積まれていれば最新の内容だけを書く
+                latest: Dict[Tuple[str, int], Dict[str, List[Tuple]]] = {}
+                for item in items:
+                    if isinstance(item, list):
+                        for trade_rows in item:
+                            latest[trade_rows["trades"][0][:2]] = trade_rows
+                rows: Dict[str, List[Tuple]] = {"trades": [], "orders": [], "fills": [], "stage_timings": []}
+                for trade_rows in latest.values():
+                    for table, table_rows in trade_rows.items():
+                        rows[table].extend(table_rows)
+                if rows["trades"]:
+                    try:
+                        self._write(conn, rows)
+                    except sqlite3.Error as e:
+                        log(f"取引履歴DBへの書き込みに失敗しました: {e}", level="ERROR")
+                for waiter in waiters:
+                    waiter.set()
+                if stop:
+                    break
+        finally:
+            conn.close()
+
+    def _write(self, conn: sqlite3.Connection, rows: Dict[str, List[Tuple]]) -> None:
+        keys = {(row[0], row[1]) for row in rows["trades"]}
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO trades VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows["trades"]
+            )
+            # ステージ計測は再計測(再試行)で消えることがあるため、取引ごとに入れ替える
+            conn.executemany("DELETE FROM stage_timings WHERE trade_date = ? AND trade_id = ?", keys)
+            conn.executemany("INSERT OR REPLACE INTO orders VALUES (?, ?, ?, ?)", rows["orders"])
+            conn.executemany("INSERT OR REPLACE INTO fills VALUES (?, ?, ?, ?, ?, ?)", rows["fills"])
+            conn.executemany("INSERT OR REPLACE INTO stage_timings VALUES (?, ?, ?, ?, ?)", rows["stage_timings"])
+        self.written += len(rows["trades"])
+        self.transactions += 1
+
+    def sync(self, timeout: float = 5.0) -> bool:
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=10)
+        log(f"取引履歴DBを閉じました: 書込={self.written}件, トランザクション={self.transactions}回, {self.path}")
+
+    def stage_latency(
+        self, pair: str, entry_time: Optional[str] = None, leg: str = "entry", since: Optional[str] = None
+    ) -> List[Tuple[str, float, int]]:
+        # 通貨ペア(と時刻 HH:MM / HH:MM:SS、開始日 YYYY-MM-DD)で絞った取引のステージ別平均(ms)と件数を返す。
+        # 先頭行は "合計"(取引ごとのステージ合計の平均)
+        where = ["t.pair = ?"]
+        params: List[Any] = [normalize_currency_pair_for_api(pair)]
+        if entry_time:
+            start = _parse_hhmmss(entry_time)
+            params.append(start.strftime("%H:%M:%S"))
+            if entry_time.count(":") == 1:
+                where.append("t.entry_time BETWEEN ? AND ?")
+                params.append(start.strftime("%H:%M:59"))
+            else:
+                where.append("t.entry_time = ?")
+        if since:
+            where.append("t.trade_date >= ?")
+            params.append(since)
+        joined = (
+            "FROM trades t JOIN stage_timings s ON s.trade_date = t.trade_date AND s.trade_id = t.trade_id "
+            f"AND s.leg = ? WHERE {' AND '.join(where)}"
+        )
+        params = [leg] + params
+        with closing(self._connect()) as conn:
+            total = conn.execute(
+                "SELECT AVG(total), COUNT(*) FROM "
+                f"(SELECT SUM(s.ms) AS total {joined} GROUP BY t.trade_date, t.trade_id)",
+                params,
+            ).fetchone()
+            by_stage = conn.execute(f"SELECT s.stage, AVG(s.ms), COUNT(*) {joined} GROUP BY s.stage", params).fetchall()
+        stages = ENTRY_STAGES if leg == "entry" else EXIT_STAGES
+        by_stage.sort(key=lambda row: stages.index(row[0]) if row[0] in stages else len(stages))
+        if not total[1]:
+            return []
+        return [("合計", total[0], total[1])] + [(stage, avg, count) for stage, avg, count in by_stage]
+
+
+def benchmark_history_store(days: int = 180, trades_per_day: int = 20) -> List[str]:
+    # 数か月分の取引を投入し、「USD/JPY 09:00 のエントリー平均レイテンシ」のような問い合わせ時間を測る
+    import tempfile
+
+    pairs = ["USDJPY", "EURUSD", "GBPJPY", "AUDUSD"]
+    result = [f"取引履歴DBベンチマーク (日数={days}, 取引/日={trades_per_day})"]
+    with tempfile.TemporaryDirectory() as directory:
+        store = TradeHistoryStore(os.path.join(directory, "history.sqlite3"))
+        rng = random.Random(1)
+        first_day = datetime(2000, 1, 3, tzinfo=TIMEZONE_TOKYO)
+        started = time.perf_counter()
+        for day_index in range(days):
+            trade_date = (first_day + timedelta(days=day_index)).strftime("%Y-%m-%d")
+            book = []
+            for trade_id in range(1, trades_per_day + 1):
+                hour = 8 + (trade_id // 4) % 10
+                trade = TradeRecord(trade_id, f"{hour:02d}:00", f"{hour:02d}:30", 0.1, pairs[trade_id % 4], "買", "Buy")
+                trade.status = TradeStatus.CLOSED
+                trade.entry_order_id = f"{day_index}{trade_id:04d}"
+                trade.entry_fill_price = Decimal("150.123")
+                trade.entry_latency_ms = {stage: rng.uniform(1, 50) for stage in ENTRY_STAGES[1:]}
+                trade.exit_latency_ms = {stage: rng.uniform(1, 50) for stage in EXIT_STAGES[1:]}
+                book.append(trade)
+            store.submit(book, trade_date)
+        store.sync(timeout=120)
+        insert = time.perf_counter() - started
+
+        timings: List[float] = []
+        for _ in range(20):
+            t0 = time.perf_counter()
+            rows = store.stage_latency("USD/JPY", "09:00")
+            timings.append(time.perf_counter() - t0)
+        store.close()
+    timings.sort()
+    result.append(f"投入 {days * trades_per_day:,}件: {insert * 1000:,.1f}ms ({store.transactions}トランザクション)")
+    result.append(
+        f"問い合わせ USD/JPY 09:00 エントリー: p50={_percentile(timings, 50) * 1000:.2f}ms max={timings[-1] * 1000:.2f}ms"
+    )
+    result.extend(f"  {stage}: 平均={avg:.1f}ms (n={count})" for stage, avg, count in rows)
+    return result
+
+
+def load_trades_from_csv(filename: str, day: Optional[date] = None, exit_on_error: bool = True) -> List[TradeRecord]:
+    # day の曜日指定に合う行だけを読み込む(省略時は本日)。exit_on_error=False ではエラー時に空リストを返す
     trades = []
 
     if not os.path.exists(filename):
         log(f"エラー: 取引ファイル '{filename}' が見つかりません。")
+        if not exit_on_error:
+            send_discord(f"❌ 取引ファイル '{filename}' が見つかりません。本日の取引は行いません。")
+            return []
         send_discord(f"❌ 重要エラー: 取引ファイル '{filename}' が見つかりません。プログラムを続行できません。")
         sys.exit(1)
 
@@ -2497,7 +5909,7 @@ def load_trades_from_csv(filename: str) -> List[Dict]:
             "sat": 5,
             "sun": 6,
         }
-        today_weekday = datetime.now(TIMEZONE_TOKYO).weekday()
+        today_weekday = (day or datetime.now(TIMEZONE_TOKYO).date()).weekday()
 
         with open(filename, "r", encoding="utf-8-sig") as file:
             reader = csv.DictReader(file)
@@ -2529,40 +5941,30 @@ def load_trades_from_csv(filename: str) -> List[Dict]:
                     else:
                         log(f"CSVの {idx + 1} 行目をスキップします。売買方向が不明です: {dir_raw}")
                         continue
-                    trade = {
-                        "id": int(row["エントリー番号"]),
-                        "entry_time_str": row["エントリー時間"],
-                        "exit_time_str": row["決済時間"],
-                        "lot_size": float(row["ロット数"]),
-                        "pair_raw": row["通貨ペア"],
-                        "pair_api": normalize_currency_pair_for_api(row["通貨ペア"]),
-                        "direction_raw": row["売買方向"],
-                        "direction_api": direction_api,
-                        "status": "Pending",
-                        "entry_price": None,
-                        "exit_price": None,
-                        "pips_profit": Decimal("0"),
-                        "position_id": None,
-                        "entry_order_id": None,
-                        "exit_order_id": None,
-                        "entry_fill_price": None,
-                        "exit_fill_price": None,
-                        "entry_filled_amount": None,
-                        "entry_timestamp_actual": None,
-                        "exit_timestamp_actual": None,
-                    }
+                    trade = TradeRecord(
+                        trade_id=int(row["エントリー番号"]),
+                        entry_time_str=row["エントリー時間"],
+                        exit_time_str=row["決済時間"],
+                        lot_size=float(row["ロット数"]),
+                        pair_raw=row["通貨ペア"],
+                        direction_raw=row["売買方向"],
+                        direction_api=direction_api,
+                    )
                     trades.append(trade)
                 except ValueError as ve:
                     log(f"CSVの {idx + 1} 行目をスキップします。データ変換エラー: {ve} - 行: {row}")
                 except Exception as e:
                     log(f"CSVの {idx + 1} 行目処理中に予期せぬエラー: {e} - 行: {row}")
 
-        trades.sort(key=lambda t: _parse_hhmmss(t["entry_time_str"]))
+        trades.sort(key=lambda t: t.entry_seconds)
 
         log(f"'{filename}' から本日実行対象の {len(trades)} 件の取引を読み込み、時間順にソートしました。")
 
     except Exception as e:
         log(f"CSVファイル '{filename}' の読み込み中に重要エラー: {e}")
+        if not exit_on_error:
+            send_discord(f"❌ 取引ファイル '{filename}' の読み込みに失敗しました。本日の取引は行いません。")
+            return []
         send_discord(f"❌ 重要エラー: 取引ファイル '{filename}' の読み込みに失敗しました。プログラムを続行できません。")
         sys.exit(1)
 
@@ -2579,11 +5981,12 @@ async def _wait_for_ens_event(
 
     try:
         event = await asyncio.wait_for(future, timeout=timeout_seconds)
-        log(f"★ ENSで期待するイベント({event.get('type')})を受信しました: {event}")
+        log("★ ENSで期待するイベント(%s)を受信しました: %s", event.get("type"), event)
         return event
     except asyncio.TimeoutError:
         log(
             f"タイムアウト({timeout_seconds}秒)により、OrderID {order_id} / UIC {uic} の {expected_event_types} イベントを確認できませんでした。"
+            f" 待機状況: {saxo_client.ens_waiters.stats()}"
         )
         return None
     except Exception as e:
@@ -2592,21 +5995,262 @@ async def _wait_for_ens_event(
     finally:
         await saxo_client._unregister_ens_waiter(future)
 
-async def confirm_flat(client: SaxoClient, uic: int, timeout_seconds: int = 60) -> bool:
-    start = time.time()
-    while time.time() - start < timeout_seconds:
-        pos = await asyncio.to_thread(client.get_position_details_by_uic, uic)
-        if not pos or pos.get("amount") == 0:
-            closed_positions = await asyncio.to_thread(client.list_closed_positions_by_uic, uic)
-            if closed_positions:
-                log(f"ClosedPositionsで決済済みを確認: UIC={uic} 件数={len(closed_positions)}")
-            else:
-                log(f"ClosedPositionsに該当がなくても保有ポジションなしと判定: UIC={uic}")
-            return True
-        await asyncio.sleep(1)
-    return False
 
-async def main():
+async def wait_for_fill_confirmation(saxo_client: SaxoClient, order_id: str, uic: int) -> Optional[Dict]:
+    # ENSの約定通知を待ち、audit_grace_seconds 以内に届かなければ監査APIの照会を並行して始め、先に得た結果を返す。
+    # 監査APIで取消・拒否・失効が分かった場合は type=order_dead の結果を返す。どちらでも確認できなければ None
+    cfg = saxo_client.cfg
+    ens_task = asyncio.create_task(
+        _wait_for_ens_event(saxo_client, order_id, uic, ["order_fill"], cfg.fill_timeout_seconds)
+    )
+    done, _ = await asyncio.wait({ens_task}, timeout=min(cfg.audit_grace_seconds, cfg.fill_timeout_seconds))
+    if done:
+        result = ens_task.result()
+        if result:
+            return result
+        log("ENSでの約定確認がタイムアウトしました。フォールバック機能（監査API）で確認します。")
+        return await saxo_client.audit_poller.wait_for_fill(order_id)
+
+    log(f"ENSの約定通知が{cfg.audit_grace_seconds:g}秒以内に届かないため、監査APIの照会を並行して開始します。")
+    audit_timeout = cfg.fill_timeout_seconds - cfg.audit_grace_seconds + cfg.audit_fallback_timeout_seconds
+    audit_task = asyncio.create_task(saxo_client.audit_poller.wait_for_fill(order_id, audit_timeout))
+    pending = {ens_task, audit_task}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                result = task.result()
+                if result:
+                    return result
+        return None
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            # 取り消した側の待機登録の解除を済ませてから戻る
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def confirm_flat(
+    client: SaxoClient,
+    uic: int,
+    timeout_seconds: int = 60,
+    since: Optional[float] = None,
+    position_id: Optional[str] = None,
+    first_poll_delay: float = 2.0,
+    max_poll_delay: float = 16.0,
+) -> bool:
+    # ENSの position_closed を待ち、届かない場合のみ指数バックオフでRESTを確認する
+    started = time.monotonic()
+    deadline = started + timeout_seconds
+    rest_calls = 0
+    confirmed_by = None
+    poll_delay = first_poll_delay
+    future = await client._register_ens_waiter(None, int(uic), ["position_closed"], since=since)
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(asyncio.shield(future), timeout=min(poll_delay, remaining))
+                confirmed_by = "ENS"
+                break
+            except asyncio.TimeoutError:
+                pass
+
+            pos = await asyncio.to_thread(client.get_position_details_by_uic, uic, 0)
+            rest_calls += 1
+            if not pos or pos.get("amount") == 0:
+                confirmed_by = "REST"
+                if position_id:
+                    closed = await asyncio.to_thread(client.closed_positions.find_by_opening_position_id, position_id)
+                    rest_calls += 1
+                    if closed:
+                        log(f"ClosedPositionsで決済済みを確認: UIC={uic} PositionId={position_id}")
+                break
+            poll_delay = min(poll_delay * 2, max_poll_delay)
+    finally:
+        await client._unregister_ens_waiter(future)
+
+    elapsed = time.monotonic() - started
+    # 従来方式(1秒間隔でポジション照会 + 決済確認時のClosedPositions照会)で要した回数との差
+    baseline_calls = int(elapsed) + 1 + (1 if confirmed_by else 0)
+    log(
+        f"フラット確認: UIC={uic}, 結果={'確認' if confirmed_by else '未確認'}, 経路={confirmed_by or '-'}, "
+        f"所要={elapsed * 1000:.1f}ms, REST呼び出し={rest_calls}回, 削減={max(baseline_calls - rest_calls, 0)}回"
+    )
+    return confirmed_by is not None
+
+
+RECONCILE_TRADE_STATUSES = frozenset(
+    {
+        TradeStatus.ENTRY_ORDERED,
+        TradeStatus.ENTERED,
+        TradeStatus.EXIT_ORDERED,
+        TradeStatus.ENTRY_FAILED_UNKNOWN,
+        TradeStatus.ENTRY_FAILED_UNCONFIRMED,
+        TradeStatus.EXIT_FAILED_UNCONFIRMED,
+    }
+)
+def _reconcile_trade(
+    trade: TradeRecord,
+    book: TradeBook,
+    positions_by_id: Dict[str, Dict],
+    portfolio: PortfolioSnapshot,
+    activities_by_order: Dict[str, Dict],
+    activities_by_reference: Dict[str, Dict],
+) -> Optional[str]:
+    # 1件の取引をスナップショットと突き合わせて状態を確定する。変更があれば変更内容を返す
+    def _find(order_id: Optional[str], reference: str) -> Tuple[Optional[str], Optional[Dict], Optional[Dict]]:
+        activity = activities_by_order.get(str(order_id)) if order_id else None
+        activity = activity or activities_by_reference.get(reference)
+        order = portfolio.orders_by_id.get(str(order_id)) if order_id else None
+        order = order or portfolio.orders_by_external_reference.get(reference)
+        found_id = order_id or (activity or {}).get("OrderId") or (order or {}).get("OrderId")
+        return (str(found_id) if found_id else None), activity, order
+
+    def _filled(activity: Optional[Dict]) -> bool:
+        return bool(activity) and activity.get("Status") in AUDIT_FILL_STATUSES and activity.get("AveragePrice") is not None
+
+    before = (trade.status, trade.entry_order_id, trade.exit_order_id, trade.position_id, trade.exit_fill_price)
+    entry_id, entry_activity, entry_order = _find(trade.entry_order_id, make_external_reference(trade.id, "entry"))
+    if entry_id is None:
+        return None
+    trade.entry_order_id = entry_id
+
+    position = portfolio.positions_by_source_order_id.get(entry_id)
+    if position is None and trade.position_id:
+        position = positions_by_id.get(str(trade.position_id))
+
+    if _filled(entry_activity) or position is not None:
+        if _filled(entry_activity):
+            fill = AuditActivityPoller.activity_to_fill(entry_id, entry_activity)
+            trade.entry_fill_price = trade.entry_fill_price or fill["execution_price"]
+            trade.entry_timestamp_actual = trade.entry_timestamp_actual or fill["execution_time"]
+            trade.position_id = trade.position_id or fill["position_id"]
+        if position is not None:
+            pos_base = position.get("PositionBase", {})
+            trade.position_id = str(position.get("PositionId") or trade.position_id)
+            if trade.entry_fill_price is None and pos_base.get("OpenPrice") is not None:
+                trade.entry_fill_price = Decimal(str(pos_base["OpenPrice"]))
+            if trade.entry_filled_amount is None and pos_base.get("Amount") is not None:
+                trade.entry_filled_amount = abs(float(pos_base["Amount"]))
+
+        exit_id, exit_activity, exit_order = _find(trade.exit_order_id, make_external_reference(trade.id, "exit"))
+        if _filled(exit_activity):
+            fill = AuditActivityPoller.activity_to_fill(exit_id, exit_activity)
+            trade.exit_order_id = exit_id
+            trade.exit_fill_price = fill["execution_price"]
+            trade.exit_timestamp_actual = fill["execution_time"]
+            if trade.entry_fill_price:
+                trade.pips_profit = calculate_pips_profit(
+                    trade.pair_api, Decimal(str(trade.entry_fill_price)), trade.exit_fill_price, trade.direction_api
+                )
+            status = TradeStatus.CLOSED
+        elif position is None:
+            # 約定済みのポジションが無く決済約定も無い: ストップロス等で決済済み
+            status = TradeStatus.CLOSED_BEFORE_EXIT
+        elif exit_order is not None and exit_order.get("Status") in WORKING_ORDER_STATUSES:
+            trade.exit_order_id = exit_id
+            status = TradeStatus.EXIT_ORDERED
+        else:
+            # 決済注文が無い(または失効した)ため、決済を改めて予定する
+            trade.exit_order_id = None
+            status = TradeStatus.ENTERED
+    elif entry_order is not None and entry_order.get("Status") in WORKING_ORDER_STATUSES:
+        status = TradeStatus.ENTRY_ORDERED
+    elif entry_activity and entry_activity.get("Status") in AUDIT_DEAD_STATUSES:
+        status = TradeStatus.ENTRY_FAILED
+    else:
+        status = trade.status
+
+    if status != trade.status:
+        book.set_status(trade, status)
+    after = (trade.status, trade.entry_order_id, trade.exit_order_id, trade.position_id, trade.exit_fill_price)
+    if after == before:
+        return None
+    return f"{trade.label}: {before[0].value} → {trade.status.value} (EntryOrderId={entry_id}, PositionId={trade.position_id})"
+
+
+async def reconcile_in_flight_trades(client: SaxoClient, book: TradeBook, timeout_seconds: float) -> List[str]:
+    # 起動時に未確定の取引を、ポジション・注文・当日の監査アクティビティの1回の照会結果とまとめて突き合わせる。
+    # 実行時刻を過ぎた Pending も、送信済みで記録前に落ちた注文がないか ExternalReference で確認する。
+    # 照会は timeout_seconds で打ち切り、その場合は保存済みの状態のまま通常処理へ進む。
+    now_seconds = _seconds_of_day(datetime.now(TIMEZONE_TOKYO).strftime("%H:%M:%S"))
+    targets = [
+        trade
+        for trade in book
+        if trade.status in RECONCILE_TRADE_STATUSES
+        or (trade.status == TradeStatus.PENDING and trade.entry_seconds <= now_seconds)
+    ]
+    if not targets:
+        return []
+
+    started = time.perf_counter()
+    midnight_utc = datetime.combine(datetime.now(TIMEZONE_TOKYO).date(), dt_time(0, 0), tzinfo=TIMEZONE_TOKYO).astimezone(
+        timezone.utc
+    )
+    audit_params = {
+        "AccountKey": client.account_key,
+        "ClientKey": client.client_key,
+        "EntryType": "Last",
+        "FromDateTime": midnight_utc.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "$top": 1000,
+    }
+    try:
+        portfolio_ok, activities = await asyncio.wait_for(
+            asyncio.gather(
+                asyncio.to_thread(client.portfolio.ensure_fresh, 0),
+                asyncio.to_thread(client._get_paged, "/cs/v1/audit/orderactivities", audit_params),
+            ),
+            timeout=timeout_seconds,
+        )
+    except asyncio.TimeoutError:
+        portfolio_ok, activities = False, None
+        log(f"起動時照合の照会が{timeout_seconds:g}秒以内に終わらないため打ち切ります。", level="WARNING")
+    fetch_ms = (time.perf_counter() - started) * 1000
+    if not portfolio_ok or activities is None:
+        # 照会結果が欠けたまま「ポジション無し」を決済済みと解釈しないよう、照合自体を見送る
+        log(f"起動時照合を見送りました: 対象={len(targets)}件 (照会失敗, {fetch_ms:.0f}ms)", level="WARNING")
+        send_discord(f"⚠️ 起動時照合に失敗しました。未確定の取引 {len(targets)}件は保存済みの状態で続行します。")
+        return []
+
+    portfolio = client.portfolio
+    positions_by_id = {
+        str(position["PositionId"]): position
+        for positions in portfolio.positions_by_uic.values()
+        for position in positions
+        if position.get("PositionId")
+    }
+    activities_by_order: Dict[str, Dict] = {}
+    activities_by_reference: Dict[str, Dict] = {}
+    for activity in activities:
+        if activity.get("OrderId"):
+            activities_by_order[str(activity["OrderId"])] = activity
+        if activity.get("ExternalReference"):
+            activities_by_reference[activity["ExternalReference"]] = activity
+
+    changes = []
+    for trade in targets:
+        change = _reconcile_trade(trade, book, positions_by_id, portfolio, activities_by_order, activities_by_reference)
+        if change:
+            changes.append(change)
+    total_ms = (time.perf_counter() - started) * 1000
+    log(
+        f"起動時照合: 対象={len(targets)}件, 更新={len(changes)}件, 監査={len(activities)}件, "
+        f"照会={fetch_ms:.0f}ms, 合計={total_ms:.0f}ms"
+    )
+    for change in changes:
+        log(f"起動時照合で更新: {change}")
+    if changes:
+        send_discord(
+            f"🔄 起動時照合: {len(changes)}/{len(targets)}件の状態を更新しました ({total_ms:.0f}ms)\n" + "\n".join(changes)
+        )
+    return changes
+
+
+async def main(daemon: bool = False):
     log("SAXO自動売買プログラム - 開始")
     send_discord("🚀 SAXO自動売買プログラム - 起動中")
 
@@ -2633,86 +6277,83 @@ async def main():
     if not client.authenticate():
         sys.exit("初期認証に失敗しました。")
 
-    trades_from_csv = load_trades_from_csv(CFG.trades_csv_path)
-    if not trades_from_csv:
-        sys.exit("取引データが見つかりません。")
-
-    all_pairs = list(set(t["pair_api"] for t in trades_from_csv))
-    uic_map = client.fetch_pair_uic_map(all_pairs)
-    for trade in trades_from_csv:
-        pair_details = uic_map.get(trade["pair_api"])
-        if pair_details:
-            trade.update(pair_details)
-
     STATUS_FILE = "trade_status.json"
 
-    def save_statuses(trades_data: List[Dict]):
+    trade_journal = TradeJournal(STATUS_FILE)
+    history: Optional[TradeHistoryStore] = None
+    if CFG.history_db_path:
         try:
-            state_to_save = {"date": get_jst_time_str().split(" ")[0], "trades": {str(t["id"]): t for t in trades_data}}
-            with open(STATUS_FILE, "w", encoding="utf-8") as f:
-                json.dump(state_to_save, f, indent=2, default=str)
-            log(f"取引ステータスを {STATUS_FILE} に保存しました。")
-        except Exception as e:
-            log(f"緊急: 状態ファイルの保存に失敗しました！: {e}")
+            history = TradeHistoryStore(CFG.history_db_path)
+        except sqlite3.Error as e:
+            log(f"取引履歴DBを開けませんでした。履歴の保存を無効化します: {e}", level="ERROR")
 
-    def load_and_reconcile_statuses(trades_data: List[Dict]):
-        today_str = get_jst_time_str().split(" ")[0]
-        if not os.path.exists(STATUS_FILE):
-            return
+    def save_statuses(trades_data: Iterable[TradeRecord]):
         try:
-            with open(STATUS_FILE, "r", encoding="utf-8") as f:
-                saved_state = json.load(f)
-        except Exception:
-            try:
-                os.remove(STATUS_FILE)
-            except OSError:
-                pass
-            return
-
-        if "date" not in saved_state or "trades" not in saved_state:
-            try:
-                os.remove(STATUS_FILE)
-            except OSError:
-                pass
+            changed = trade_journal.record(trades_data)
+        except Exception as e:
+            log(f"緊急: 状態ファイルの保存に失敗しました！: {e}")
             return
-
-        if saved_state.get("date") == today_str:
-            saved_trades = saved_state.get("trades", {})
-            for trade in trades_data:
-                trade_id_str = str(trade["id"])
-                if trade_id_str in saved_trades:
-                    saved_trade_data = saved_trades[trade_id_str]
-
-                    for price_key in ["entry_fill_price", "exit_fill_price"]:
-                        if saved_trade_data.get(price_key) is not None:
-                            try:
-                                saved_trade_data[price_key] = Decimal(str(saved_trade_data[price_key]))
-                            except Exception as e:
-                                log(
-                                    "状態ロード中に価格のDecimal変換に失敗: "
-                                    f"key={price_key}, value={saved_trade_data[price_key]}, error={e}"
-                                )
-                                saved_trade_data[price_key] = None
-
-                    if saved_trade_data.get("pips_profit") is not None:
-                        saved_trade_data["pips_profit"] = Decimal(str(saved_trade_data["pips_profit"]))
-
-                    trade.update(saved_trade_data)
-        else:
+        if history is not None and changed:
+            # 履歴DBは参照用のため、失敗しても取引処理は止めない
             try:
-                os.remove(STATUS_FILE)
-            except OSError:
-                pass
-
-    load_and_reconcile_statuses(trades_from_csv)
+                history.submit(changed)
+            except Exception as e:
+                log(f"取引履歴DBへの登録に失敗しました: {e}", level="ERROR")
+
+    def load_and_reconcile_statuses(trades_data: List[TradeRecord], day: date) -> None:
+        saved_trades = trade_journal.load(day.strftime("%Y-%m-%d"))
+        for trade in trades_data:
+            trade_id_str = str(trade.id)
+            if trade_id_str in saved_trades:
+                trade.apply_saved(saved_trades[trade_id_str])
+
+    def load_day_book(day: date) -> Optional[TradeBook]:
+        trades = load_trades_from_csv(CFG.trades_csv_path, day=day, exit_on_error=not daemon)
+        if not trades:
+            return None
+        # UIC は client 側でキャッシュされるため、常駐中は新しい通貨ペアだけを照会する
+        uic_map = client.fetch_pair_uic_map(list(set(t.pair_api for t in trades)))
+        for trade in trades:
+            pair_details = uic_map.get(trade.pair_api)
+            if pair_details:
+                trade.apply_instrument(pair_details)
+        load_and_reconcile_statuses(trades, day)
+        return TradeBook(trades)
+
+    book = load_day_book(datetime.now(TIMEZONE_TOKYO).date())
+    if book is None and not daemon:
+        sys.exit("取引データが見つかりません。")
 
     ens_client = None
     token_refresh_task: Optional[asyncio.Task] = None
+    price_uics: set = set()
 
     try:
-        ens_url = client.setup_ens_subscription()
+        journal = EnsMessageJournal.open_for_today() if CFG.ens_journal_enabled else None
+        resume = journal.resume_state(CFG.ens_journal_resume_seconds) if journal else None
+        if resume:
+            # 直前のプロセスのContextIdが生きていれば、最終MessageIdの続きから受信する。失敗時は通常の再接続で作り直す
+            client.streaming_context_id = resume["context_id"]
+            client.ens_subscription_id = resume.get("subscription_id")
+            client.ens_reference_id = resume.get("reference_id")
+            if client.ens_reference_id:
+                client.streaming.register_created(
+                    "ens", "/ens/v1/activities/subscriptions", client.ens_reference_id, client.ens_subscription_id
+                )
+            ens_url = client.rebuild_streaming_url(resume["last_message_id"])
+            log(f"ENSジャーナルから再開します: contextId={resume['context_id']}, messageid={resume['last_message_id']}")
+        else:
+            ens_url = client.setup_ens_subscription()
         if ens_url:
-            ens_client = SaxoENSClient(client, ens_url, client.access_token, notify_func=send_discord)
+            ens_client = SaxoENSClient(client, ens_url, client.access_token, notify_func=send_discord, journal=journal)
+            if resume:
+                ens_client.last_message_id = resume["last_message_id"]
+            if CFG.streaming_prices_enabled:
+                # 同じContextに価格と残高のサブスクリプションを追加し、1本のWebSocketで受信する
+                price_uics = {int(t.uic) for t in book or () if t.uic is not None}
+                if price_uics:
+                    await asyncio.to_thread(client.streaming.subscribe_prices, price_uics)
+                await asyncio.to_thread(client.streaming.subscribe_balance)
             asyncio.create_task(ens_client.connect())
             log("ENSクライアントを起動しました。")
         else:
@@ -2720,10 +6361,6 @@ async def main():
     except Exception as e:
         log(f"ENS初期化エラー: {e}. ポーリングモードで継続")
 
-    balance, currency = await asyncio.to_thread(client.get_account_balance_and_currency)
-    if balance is None:
-        log("警告: 起動時の口座残高取得に失敗しました。")
-
     async def periodic_token_refresh() -> None:
         await asyncio.sleep(CFG.token_refresh_interval_seconds)
         while True:
@@ -2739,331 +6376,409 @@ async def main():
 
     token_refresh_task = asyncio.create_task(periodic_token_refresh())
 
-    today_str = get_jst_time_str().split(" ")[0]
-    startup_msg = f"{today_str}のエントリー一覧:"
-
-    now_time_jst_obj = datetime.now(TIMEZONE_TOKYO).time()
-
-    for trade_def in trades_from_csv:
-        status_suffix = ""
-        current_status = trade_def.get("status", "Pending")
-        try:
-            entry_time_obj = _parse_hhmmss(trade_def["entry_time_str"])
-            if current_status == "Pending" and entry_time_obj < now_time_jst_obj:
-                log(f"取引ID {trade_def['id']} は起動時に時刻が経過していたため、ステータスを更新します。")
-                trade_def["status"] = "スキップ (時刻経過)"
-
-            final_status = trade_def.get("status")
-            if final_status not in ["Pending", None]:
-                status_suffix = f" (状態: {final_status})"
-        except RuntimeError:
-            status_suffix = " (時間形式エラー)"
-
-        startup_msg += (
-            f"\n{trade_def['pair_raw']} {trade_def['direction_raw']} ロット数: {trade_def['lot_size']} "
-            f"エントリー時間: {trade_def['entry_time_str']} 決済時間: {trade_def['exit_time_str']}{status_suffix}"
-        )
-
-    save_statuses(trades_from_csv)
-
-    if balance is not None and currency:
-        startup_msg += f"\nFX口座残高: {balance} {currency}"
-    startup_msg += f"\nストップロス: {CFG.stop_loss_pips} pips"
-    send_discord(startup_msg)
-
-    pending_confirmation_tasks: List[asyncio.Task] = []
-
-    async def confirm_entry_fill(trade: Dict, order_id: str, uic: int, current_bid: Decimal, current_ask: Decimal) -> None:
-        trade_label = f"取引ID {trade['id']} ({trade['pair_api']} {trade['direction_api']})"
-        fill_details = await _wait_for_ens_event(client, order_id, uic, ["order_fill"], CFG.fill_timeout_seconds)
-
-        if not fill_details:
-            log("ENSでの約定確認がタイムアウトしました。フォールバック機能（監査API）で確認します。")
-            fill_details = await asyncio.to_thread(client.check_order_status_via_audit_api, order_id)
-
-        if fill_details:
-            log(f"✅ エントリー成功: {trade_label}")
-            entry_fill_price = fill_details.get("execution_price")
-            execution_time_str = fill_details.get("execution_time")
-            position_id = fill_details.get("position_id")
-
-            if not position_id:
-                log("警告: 約定イベントにPositionIdが含まれていません。APIポーリングでポジションIDを取得します。")
-                polled_pos_details = await asyncio.to_thread(client.get_position_details_by_order_id, order_id, uic)
-                if polled_pos_details:
-                    position_id = polled_pos_details.get("position_id")
-                    if not entry_fill_price:
-                        entry_fill_price = polled_pos_details.get("open_price")
-                    if not execution_time_str:
-                        exec_time_utc = datetime.fromisoformat(polled_pos_details["execution_time"].replace("Z", "+00:00"))
-                        execution_time_str = exec_time_utc.astimezone(TIMEZONE_TOKYO).strftime("%Y-%m-%d %H:%M:%S")
-
-            trade.update(
-                {
-                    "status": "エントリー済み",
-                    "entry_fill_price": entry_fill_price,
-                    "position_id": position_id,
-                    "entry_timestamp_actual": execution_time_str,
-                    "entry_order_id": order_id,
-                    "entry_filled_amount": fill_details.get("filled_amount") if isinstance(fill_details, dict) else None,
-                }
+    async def run_trading_day(book: TradeBook) -> bool:
+        # 1日分の取引を実行してサマリーを送る。注文の成否不明で停止した場合は True を返す
+        today_str = get_jst_time_str().split(" ")[0]
+        uic_map = client.pair_uic_cache
+        # スケジューラ開始前に、未確定の取引をブローカー側の状態に合わせる
+        if await reconcile_in_flight_trades(client, book, CFG.reconcile_timeout_seconds):
+            save_statuses(book)
+        balance, currency = await asyncio.to_thread(client.get_account_balance_and_currency)
+        if balance is None:
+            log("警告: 口座残高の取得に失敗しました。")
+        startup_msg = f"{today_str}のエントリー一覧:"
+
+        now_time_jst_obj = datetime.now(TIMEZONE_TOKYO).time()
+
+        for trade_def in book:
+            status_suffix = ""
+            entry_time_obj = _parse_hhmmss(trade_def.entry_time_str)
+            if trade_def.status == TradeStatus.PENDING and entry_time_obj < now_time_jst_obj:
+                log(f"取引ID {trade_def.id} は起動時に時刻が経過していたため、ステータスを更新します。")
+                book.set_status(trade_def, TradeStatus.SKIPPED_TIME_PASSED)
+
+            if trade_def.status != TradeStatus.PENDING:
+                status_suffix = f" (状態: {trade_def.status.value})"
+
+            startup_msg += (
+                f"\n{trade_def.pair_raw} {trade_def.direction_raw} ロット数: {trade_def.lot_size} "
+                f"エントリー時間: {trade_def.entry_time_str} 決済時間: {trade_def.exit_time_str}{status_suffix}"
             )
 
-            spread_at_entry = calculate_spread_pips(trade["pair_api"], current_bid, current_ask)
-            entry_success_msg = (
-                "エントリーしました: 通貨ペア={}, 売買方向={}, ".format(trade["pair_raw"], trade["direction_api"].upper())
-                + "エントリー価格={:.{}f}, ".format(
-                    entry_fill_price, uic_map.get(trade["pair_api"], {}).get("decimals", 5)
+        save_statuses(book)
+
+        if balance is not None and currency:
+            startup_msg += f"\nFX口座残高: {balance} {currency}"
+        startup_msg += f"\nストップロス: {CFG.stop_loss_pips} pips"
+        send_discord(startup_msg)
+
+        pending_confirmation_tasks: List[asyncio.Task] = []
+
+        async def confirm_entry_fill(
+            trade: TradeRecord, order_id: str, uic: int, current_bid: Decimal, current_ask: Decimal
+        ) -> None:
+            set_log_context(trade_id=trade.id, order_id=order_id, uic=uic)
+            trade_label = trade.label
+            fill_details = await wait_for_fill_confirmation(client, order_id, uic)
+
+            clock = trade.entry_clock
+            if fill_details and fill_details.get("type") == "order_dead":
+                log(f"❌ エントリー注文が約定せずに終了しました ({fill_details['status']}): {trade_label}")
+                book.set_status(trade, TradeStatus.ENTRY_FAILED)
+                send_discord(
+                    f"❌ エントリー失敗: 注文が{fill_details['status']}になりました。\n"
+                    f"取引: {trade_label}\n"
+                    f"注文ID: {order_id}"
                 )
-                + "Bid={}, Ask={}, スプレッド={:.1f}pips, ".format(
-                    current_bid, current_ask, spread_at_entry if spread_at_entry is not None else 0
+            elif fill_details:
+                if clock:
+                    clock.mark("fill_event")
+                log(f"✅ エントリー成功: {trade_label}")
+                entry_fill_price = fill_details.get("execution_price")
+                execution_time_str = fill_details.get("execution_time")
+                position_id = fill_details.get("position_id")
+
+                if not position_id:
+                    log("警告: 約定イベントにPositionIdが含まれていません。APIポーリングでポジションIDを取得します。")
+                    polled_pos_details = await asyncio.to_thread(client.get_position_details_by_order_id, order_id, uic)
+                    if polled_pos_details:
+                        position_id = polled_pos_details.get("position_id")
+                        if not entry_fill_price:
+                            entry_fill_price = polled_pos_details.get("open_price")
+                        if not execution_time_str:
+                            exec_time_utc = datetime.fromisoformat(
+                                polled_pos_details["execution_time"].replace("Z", "+00:00")
+                            )
+                            execution_time_str = exec_time_utc.astimezone(TIMEZONE_TOKYO).strftime("%Y-%m-%d %H:%M:%S")
+
+                if clock:
+                    clock.mark("position_resolved")
+                    log(f"エントリーレイテンシ内訳 {trade_label}: {clock.describe()}")
+
+                trade.entry_fill_price = entry_fill_price
+                trade.position_id = position_id
+                trade.entry_timestamp_actual = execution_time_str
+                trade.entry_order_id = order_id
+                trade.entry_filled_amount = fill_details.get("filled_amount") if isinstance(fill_details, dict) else None
+                book.set_status(trade, TradeStatus.ENTERED)
+
+                spread_at_entry = calculate_spread_pips(trade.pair_api, current_bid, current_ask)
+                entry_success_msg = (
+                    "エントリーしました: 通貨ペア={}, 売買方向={}, ".format(trade.pair_raw, trade.direction_api.upper())
+                    + "エントリー価格={:.{}f}, ".format(
+                        entry_fill_price, uic_map.get(trade.pair_api, {}).get("decimals", 5)
+                    )
+                    + "Bid={}, Ask={}, スプレッド={:.1f}pips, ".format(
+                        current_bid, current_ask, spread_at_entry if spread_at_entry is not None else 0
+                    )
+                    + "エントリー時間={}, 決済予定時間={}".format(extract_hms_jst(execution_time_str), trade.exit_time_str)
+                )
+                send_discord(entry_success_msg)
+            else:
+                log(f"❌ エントリー失敗 (ENS/監査API双方で確認不可): {trade_label}")
+                book.set_status(trade, TradeStatus.ENTRY_FAILED_UNCONFIRMED)
+                send_discord(
+                    "🚨 エントリー失敗 (ENS/監査API双方で確認不可)\n"
+                    f"取引: {trade_label}\n"
+                    f"注文ID: {order_id}\n"
+                    "手動でのポジション確認が必要です。"
                 )
-                + "エントリー時間={}, 決済予定時間={}".format(extract_hms_jst(execution_time_str), trade["exit_time_str"])
-            )
-            send_discord(entry_success_msg)
-        else:
-            log(f"❌ エントリー失敗 (ENS/監査API双方で確認不可): {trade_label}")
-            trade["status"] = "エントリー失敗 (確認不可)"
-            send_discord(
-                "🚨 エントリー失敗 (ENS/監査API双方で確認不可)\n"
-                f"取引: {trade_label}\n"
-                f"注文ID: {order_id}\n"
-                "手動でのポジション確認が必要です。"
-            )
-
-        save_statuses(trades_from_csv)
 
-    async def confirm_exit_fill(trade: Dict, close_order_id: str) -> None:
-        trade_label = f"取引ID {trade['id']} ({trade['pair_api']} {trade['direction_api']})"
-        settlement_event = await _wait_for_ens_event(
-            client, close_order_id, trade["uic"], ["order_fill"], CFG.fill_timeout_seconds
-        )
+            save_statuses(book)
 
-        if not settlement_event:
-            log("ENSでの決済確認がタイムアウトしました。フォールバック機能（監査API）で確認します。")
-            settlement_event = await asyncio.to_thread(client.check_order_status_via_audit_api, close_order_id)
+        async def confirm_exit_fill(trade: TradeRecord, close_order_id: str, exit_sent_at: float) -> None:
+            set_log_context(trade_id=trade.id, order_id=close_order_id, uic=trade.uic)
+            trade_label = trade.label
+            settlement_event = await wait_for_fill_confirmation(client, close_order_id, trade.uic)
 
-        if settlement_event:
-            event_type = settlement_event.get("type")
-            log(f"イベント '{event_type}' により決済を確認しました。")
+            clock = trade.exit_clock
+            if settlement_event and settlement_event.get("type") == "order_dead":
+                log(f"決済注文が約定せずに終了しました ({settlement_event['status']}): {trade_label}", level="ERROR")
+                book.set_status(trade, TradeStatus.EXIT_FAILED_ORDER)
+                send_discord(
+                    f"🚨 {trade_label} の決済注文が{settlement_event['status']}になりました。"
+                    "ポジションが残っている可能性があります。手動確認が必要です。"
+                )
+            elif settlement_event:
+                if clock:
+                    clock.mark("fill_event")
+                event_type = settlement_event.get("type")
+                log(f"イベント '{event_type}' により決済を確認しました。")
+
+                final_exit_price = settlement_event.get("execution_price")
+                final_exit_time = settlement_event.get("execution_time", get_jst_time_str())
+
+                trade.exit_fill_price = final_exit_price
+                trade.exit_timestamp_actual = final_exit_time
+                trade.exit_order_id = close_order_id
+                book.set_status(trade, TradeStatus.CLOSED)
+
+                is_flat = await confirm_flat(client, trade.uic, since=exit_sent_at, position_id=trade.position_id)
+                if clock:
+                    clock.mark("flat_confirmed")
+                    log(f"決済レイテンシ内訳 {trade_label}: {clock.describe()}")
+                if not is_flat:
+                    log("警告: 決済後もポジションが残っています。手動確認が必要です。")
+                    send_discord(f"⚠️ {trade_label} の決済後にポジションが残っています。手動確認が必要です。")
+
+                entry_price = trade.entry_fill_price
+                if entry_price and final_exit_price:
+                    pips_profit = calculate_pips_profit(
+                        trade.pair_api, Decimal(str(entry_price)), final_exit_price, trade.direction_api
+                    )
+                    trade.pips_profit = pips_profit
+
+                    exit_time_only = extract_hms_jst(final_exit_time)
+                    exit_success_msg = (
+                        f"予定決済しました: 通貨ペア={trade.pair_raw}, "
+                        f"売買方向={trade.direction_api.upper()}, "
+                        f"エントリー価格={format_price_for_display(entry_price, trade.pair_api, uic_map)}, "
+                        f"決済価格={format_price_for_display(final_exit_price, trade.pair_api, uic_map)}, "
+                        f"損益pips={pips_profit:.1f} "
+                        f"(決済時間: {exit_time_only})"
+                    )
+                    send_discord(exit_success_msg)
+                else:
+                    book.set_status(trade, TradeStatus.CLOSED_PRICE_UNKNOWN)
+                    send_discord(f"🏁 {trade_label} は決済済みですが、価格情報が取得できませんでした。")
 
-            final_exit_price = settlement_event.get("execution_price")
-            final_exit_time = settlement_event.get("execution_time", get_jst_time_str())
+            else:
+                book.set_status(trade, TradeStatus.EXIT_FAILED_UNCONFIRMED)
+                send_discord(f"❌ {trade_label} の決済確認に失敗しました（タイムアウト）。手動確認が必要です。")
 
-            trade.update(
-                {
-                    "status": "決済済み",
-                    "exit_fill_price": final_exit_price,
-                    "exit_timestamp_actual": final_exit_time,
-                    "exit_order_id": close_order_id,
-                }
-            )
+            save_statuses(book)
 
-            is_flat = await confirm_flat(client, trade["uic"])
-            if not is_flat:
-                log("警告: 決済後もポジションが残っています。手動確認が必要です。")
-                send_discord(f"⚠️ {trade_label} の決済後にポジションが残っています。手動確認が必要です。")
+        scheduler = ActionScheduler(client.broker_clock)
+        halted = False
 
-            entry_price = trade.get("entry_fill_price")
-            if entry_price and final_exit_price:
-                pips_profit = calculate_pips_profit(
-                    trade["pair_api"], Decimal(str(entry_price)), final_exit_price, trade["direction_api"]
-                )
-                trade["pips_profit"] = pips_profit
-
-                exit_time_only = extract_hms_jst(final_exit_time)
-                exit_success_msg = (
-                    f"予定決済しました: 通貨ペア={trade['pair_raw']}, "
-                    f"売買方向={trade['direction_api'].upper()}, "
-                    f"エントリー価格={format_price_for_display(entry_price, trade['pair_api'], uic_map)}, "
-                    f"決済価格={format_price_for_display(final_exit_price, trade['pair_api'], uic_map)}, "
-                    f"損益pips={pips_profit:.1f} "
-                    f"(決済時間: {exit_time_only})"
-                )
-                send_discord(exit_success_msg)
+        async def preflight(label: str, action: str) -> None:
+            set_log_context()
+            log(f"接続の事前確認 ({action}) を行います... ({label})")
+            if await asyncio.to_thread(client.validate_token):
+                await asyncio.to_thread(client.sync_broker_clock)
+                log(f"事前確認 ({action}) 成功。ブローカー時計: {client.broker_clock.describe()}")
             else:
-                trade["status"] = "決済済み (価格不明)"
-                send_discord(f"🏁 {trade_label} は決済済みですが、価格情報が取得できませんでした。")
+                log(f"エラー: 接続の事前確認に失敗しました ({label})。実行時刻に改めて処理します。", level="ERROR")
+
+        async def arm(label: str) -> None:
+            # 実行直前の確認で使うポジション/注文を先に取得しておき、発火後のREST照会を省く
+            set_log_context()
+            await asyncio.to_thread(client.portfolio.ensure_fresh)
+            log(f"直前準備完了: {label}", level="DEBUG")
+
+        def schedule_with_stages(fire_at: datetime, kind: str, label: str, callback) -> None:
+            now = datetime.now(TIMEZONE_TOKYO)
+            for lead, action in ((60, "PING_60S"), (30, "PING_30S")):
+                if fire_at - timedelta(seconds=lead) > now:
+                    scheduler.schedule(
+                        fire_at - timedelta(seconds=lead), "preflight", label, lambda a=action: preflight(label, a)
+                    )
+            if fire_at - timedelta(seconds=CFG.arm_lead_seconds) > now:
+                scheduler.schedule(fire_at - timedelta(seconds=CFG.arm_lead_seconds), "arm", label, lambda: arm(label))
+            scheduler.schedule(fire_at, kind, label, callback)
+
+        def schedule_entry(trade: TradeRecord) -> None:
+            label = f"エントリー {trade.label}"
+            fire_at = plan_fire_time(trade.entry_time_str, label)
+            if fire_at is None:
+                log(f"{trade.label} のエントリー時刻は経過しました。スキップします。")
+                book.set_status(trade, TradeStatus.SKIPPED_TIME_PASSED)
+                save_statuses(book)
+                return
+            schedule_with_stages(fire_at, "entry", label, lambda: run_entry(trade, fire_at))
 
-        else:
-            trade["status"] = "決済失敗 (確認不可)"
-            send_discord(f"❌ {trade_label} の決済確認に失敗しました（タイムアウト）。手動確認が必要です。")
+        def schedule_exit(trade: TradeRecord) -> None:
+            label = f"決済 {trade.label}"
+            # 決済時刻を過ぎている場合(再起動時など)は即時に決済し、到達誤差は記録しない
+            planned = plan_fire_time(trade.exit_time_str, label)
+            fire_at = planned or datetime.now(TIMEZONE_TOKYO)
+            schedule_with_stages(fire_at, "exit", label, lambda: run_exit(trade, planned))
 
-        save_statuses(trades_from_csv)
+        async def run_exit(active_trade: TradeRecord, fire_at: Optional[datetime]) -> None:
+            if halted or active_trade.status not in OPEN_TRADE_STATUSES or active_trade.exit_order_id is not None:
+                return
+            set_log_context(trade_id=active_trade.id, uic=active_trade.uic)
+            trade_label = active_trade.label
+            log(f"決済 {trade_label} の実行時刻になりました。")
 
-    completed_all_trades = False
-    try:
-        while True:
-            active_trade = next(
-                (
-                    t
-                    for t in trades_from_csv
-                    if t.get("status") in ["エントリー済み", "エントリー発注済み"] and t.get("exit_order_id") is None
-                ),
-                None,
-            )
+            exit_clock = active_trade.start_exit_clock()
+            log(f"--- {trade_label} の決済処理開始 ---")
 
-            if active_trade:
-                trade_label = f"取引ID {active_trade['id']} ({active_trade['pair_api']} {active_trade['direction_api']})"
+            current_position = await asyncio.to_thread(client.get_position_details_by_uic, active_trade.uic)
+            exit_clock.mark("position_checked")
+            if not current_position:
+                log(f"ポジション {active_trade.position_id} が見つかりません。既に決済済みの可能性があります。")
+                book.set_status(active_trade, TradeStatus.CLOSED_BEFORE_EXIT)
+                save_statuses(book)
+                return
+
+            amount_to_close = active_trade.entry_filled_amount
+            if amount_to_close is None:
+                amount_to_close = current_position.get("amount")
+            if amount_to_close is None:
+                amount_to_close = lot_to_amount(active_trade.lot_size)
+
+            cancel_stats = await client.cancel_related_orders_for_uic(int(active_trade.uic))
+            active_trade.sl_cancel_ms = round(cancel_stats["total_ms"], 1)
+            exit_clock.mark("precheck_done")
+
+            close_order_id = None
+            exit_sent_at = time.monotonic()
+            for close_attempt in range(2):
+                close_order_id = await asyncio.to_thread(
+                    client.close_position_market,
+                    current_position["position_id"],
+                    active_trade.pair_api,
+                    active_trade.uic,
+                    active_trade.asset_type or "FxSpot",
+                    amount_to_close,
+                    active_trade.direction_api,
+                    make_external_reference(active_trade.id, "exit"),
+                    exit_clock,
+                )
+                if close_order_id:
+                    break
+                remaining_position = await asyncio.to_thread(client.get_position_details_by_uic, active_trade.uic)
+                if not remaining_position or remaining_position.get("amount") == 0:
+                    log(f"{trade_label} の決済失敗後、ポジションが存在しないため再試行しません。")
+                    break
+                if close_attempt == 0:
+                    log(f"{trade_label} の決済再試行を実行します（ポジション保持を確認）。")
+            if fire_at is not None:
+                active_trade.exit_arrival_error_ms = client.broker_clock.record_arrival(
+                    "exit", fire_at.timestamp(), exit_clock.wall_time("order_sent")
+                )
 
-                await wait_until_time_with_random_advance(client, active_trade["exit_time_str"], f"決済 {trade_label}")
+            if close_order_id:
+                log(f"決済注文が受付されました。OrderID: {close_order_id}")
+                active_trade.exit_order_id = close_order_id
+                book.set_status(active_trade, TradeStatus.EXIT_ORDERED)
+                save_statuses(book)
+                task = asyncio.create_task(confirm_exit_fill(active_trade, close_order_id, exit_sent_at))
+                pending_confirmation_tasks.append(task)
+            else:
+                book.set_status(active_trade, TradeStatus.EXIT_FAILED_ORDER)
+                save_statuses(book)
 
-                log(f"--- {trade_label} の決済処理開始 ---")
+        async def run_entry(next_trade: TradeRecord, fire_at: datetime) -> None:
+            nonlocal halted
+            if halted or next_trade.status != TradeStatus.PENDING:
+                return
+            set_log_context(trade_id=next_trade.id, uic=next_trade.uic)
+            trade_label = next_trade.label
+            log(f"エントリー {trade_label} の実行時刻になりました。")
 
-                current_position = await asyncio.to_thread(client.get_position_details_by_uic, active_trade["uic"])
-                if not current_position:
-                    log(f"ポジション {active_trade.get('position_id')} が見つかりません。既に決済済みの可能性があります。")
-                    active_trade["status"] = "決済済み（事前クローズ）"
-                    save_statuses(trades_from_csv)
-                    continue
+            entry_clock = next_trade.start_entry_clock()
+            log(f"--- {trade_label} のエントリー処理開始 ---")
 
-                amount_to_close = active_trade.get("entry_filled_amount")
-                if amount_to_close is None:
-                    amount_to_close = current_position.get("amount")
-                if amount_to_close is None:
-                    amount_to_close = lot_to_amount(active_trade["lot_size"])
-
-                await asyncio.to_thread(client.cancel_related_orders_for_uic, active_trade["uic"])
-
-                close_order_id = None
-                for close_attempt in range(2):
-                    close_order_id = await asyncio.to_thread(
-                        client.close_position_market,
-                        current_position["position_id"],
-                        active_trade["pair_api"],
-                        active_trade["uic"],
-                        active_trade.get("asset_type", "FxSpot"),
-                        amount_to_close,
-                        active_trade["direction_api"],
-                        make_external_reference(active_trade["id"], "exit"),
+            if next_trade.uic is None:
+                log(f"{next_trade.pair_api} のUIC情報がありません。スキップします。")
+                book.set_status(next_trade, TradeStatus.SKIPPED_NO_UIC)
+                save_statuses(book)
+                return
+
+            uic = int(next_trade.uic)
+            asset_type = next_trade.asset_type or "FxSpot"
+
+            price_infos_map = await asyncio.to_thread(client.fetch_price_infos, uic_list=[uic])
+            price_info = price_infos_map.get(uic)
+            entry_clock.mark("quote_received")
+
+            if price_info and "Quote" in price_info and price_info["Quote"].get("Bid") and price_info["Quote"].get("Ask"):
+                current_bid = Decimal(str(price_info["Quote"]["Bid"]))
+                current_ask = Decimal(str(price_info["Quote"]["Ask"]))
+                current_mid_price = (current_bid + current_ask) / Decimal("2")
+
+                if CFG.spread_pips_limit > 0:
+                    spread_pips = calculate_spread_pips(next_trade.pair_api, current_bid, current_ask)
+                    if spread_pips is None or spread_pips > Decimal(str(CFG.spread_pips_limit)):
+                        log(f"スプレッドが上限({CFG.spread_pips_limit}pips)を超えました({spread_pips}pips)。スキップします。")
+                        book.set_status(next_trade, TradeStatus.SKIPPED_SPREAD)
+                        send_discord(f"⚠️ {next_trade.pair_api}はスプレッドが広いためスキップしました: {spread_pips} pips")
+                        save_statuses(book)
+                        return
+
+                entry_dt = datetime.combine(
+                    datetime.now(TIMEZONE_TOKYO).date(),
+                    _parse_hhmmss(next_trade.entry_time_str),
+                    tzinfo=TIMEZONE_TOKYO,
+                )
+                retry_deadline = entry_dt + timedelta(seconds=3)
+                order_result = None
+                for attempt in range(2):
+                    if datetime.now(TIMEZONE_TOKYO) > retry_deadline:
+                        break
+                    order_result = await asyncio.to_thread(
+                        client.place_order,
+                        pair_name=next_trade.pair_api,
+                        uic=uic,
+                        asset_type=asset_type,
+                        side=next_trade.direction_api,
+                        amount=lot_to_amount(next_trade.lot_size),
+                        current_price_for_sl_tp=current_mid_price,
+                        external_reference=make_external_reference(next_trade.id, "entry"),
+                        clock=entry_clock,
                     )
-                    if close_order_id:
+                    if order_result and order_result.get("order_id"):
                         break
-                    remaining_position = await asyncio.to_thread(client.get_position_details_by_uic, active_trade["uic"])
-                    if not remaining_position or remaining_position.get("amount") == 0:
-                        log(f"{trade_label} の決済失敗後、ポジションが存在しないため再試行しません。")
+                    if order_result and order_result.get("status") == "unknown":
                         break
-                    if close_attempt == 0:
-                        log(f"{trade_label} の決済再試行を実行します（ポジション保持を確認）。")
-
-                if close_order_id:
-                    log(f"決済注文が受付されました。OrderID: {close_order_id}")
-                    active_trade["exit_order_id"] = close_order_id
-                    active_trade["status"] = "決済発注済み"
-                    save_statuses(trades_from_csv)
-                    task = asyncio.create_task(confirm_exit_fill(active_trade, close_order_id))
+                    if attempt == 0 and datetime.now(TIMEZONE_TOKYO) <= retry_deadline:
+                        log(f"{trade_label} のエントリー再試行を2秒後に実行します。")
+                        await asyncio.sleep(2)
+                next_trade.entry_arrival_error_ms = client.broker_clock.record_arrival(
+                    "entry", fire_at.timestamp(), entry_clock.wall_time("order_sent")
+                )
+                if order_result and order_result.get("order_id"):
+                    next_trade.entry_order_id = order_result["order_id"]
+                    book.set_status(next_trade, TradeStatus.ENTRY_ORDERED)
+                    save_statuses(book)
+                    task = asyncio.create_task(
+                        confirm_entry_fill(next_trade, order_result["order_id"], uic, current_bid, current_ask)
+                    )
                     pending_confirmation_tasks.append(task)
-                else:
-                    active_trade["status"] = "決済失敗 (注文エラー)"
-                    save_statuses(trades_from_csv)
-
-            else:
-                next_trade = next((t for t in trades_from_csv if t.get("status", "Pending") == "Pending"), None)
-                if next_trade:
-                    trade_label = f"取引ID {next_trade['id']} ({next_trade['pair_api']} {next_trade['direction_api']})"
-                    if not await wait_until_time_with_random_advance(client, next_trade["entry_time_str"], f"エントリー {trade_label}"):
-                        entry_dt = datetime.combine(
-                            datetime.now(TIMEZONE_TOKYO).date(), _parse_hhmmss(next_trade["entry_time_str"]), tzinfo=TIMEZONE_TOKYO
-                        )
-                        if entry_dt < datetime.now(TIMEZONE_TOKYO):
-                            log(f"{trade_label} のエントリー時刻は経過しました。スキップします。")
-                            next_trade["status"] = "スキップ (時刻経過)"
-                            save_statuses(trades_from_csv)
-                            continue
-
-                    log(f"--- {trade_label} のエントリー処理開始 ---")
+                    schedule_exit(next_trade)
+
+                elif order_result and order_result.get("status") == "unknown":
+                    log(f"❌ 注文の成否が不明なため停止: {trade_label}")
+                    book.set_status(next_trade, TradeStatus.ENTRY_FAILED_UNKNOWN)
+                    send_discord(
+                        "🚨 注文の成否が不明なため自動処理を停止します。\n"
+                        f"取引: {trade_label}\n"
+                        f"ExternalReference: {order_result.get('external_reference')}\n"
+                        "手動での注文/ポジション確認が必要です。"
+                    )
+                    save_statuses(book)
+                    halted = True
+                    scheduler.cancel_all()
+                    return
 
-                    if "uic" not in next_trade:
-                        log(f"{next_trade['pair_api']} のUIC情報がありません。スキップします。")
-                        next_trade["status"] = "スキップ (UICなし)"
-                        save_statuses(trades_from_csv)
-                        continue
+                else:
+                    if datetime.now(TIMEZONE_TOKYO) > retry_deadline:
+                        log(f"❌ エントリー失敗: {trade_label}（再発注猶予3秒を超過）")
+                        book.set_status(next_trade, TradeStatus.ENTRY_FAILED_TIMEOUT)
+                    else:
+                        log(f"❌ エントリー失敗: {trade_label}")
+                        book.set_status(next_trade, TradeStatus.ENTRY_FAILED)
 
-                    uic = int(next_trade["uic"])
-                    asset_type = next_trade.get("asset_type", "FxSpot")
-
-                    price_infos_map = await asyncio.to_thread(client.fetch_price_infos, uic_list=[uic])
-                    price_info = price_infos_map.get(uic)
-
-                    if price_info and "Quote" in price_info and price_info["Quote"].get("Bid") and price_info["Quote"].get("Ask"):
-                        current_bid = Decimal(str(price_info["Quote"]["Bid"]))
-                        current_ask = Decimal(str(price_info["Quote"]["Ask"]))
-                        current_mid_price = (current_bid + current_ask) / Decimal("2")
-
-                        if CFG.spread_pips_limit > 0:
-                            spread_pips = calculate_spread_pips(next_trade["pair_api"], current_bid, current_ask)
-                            if spread_pips is None or spread_pips > Decimal(str(CFG.spread_pips_limit)):
-                                log(f"スプレッドが上限({CFG.spread_pips_limit}pips)を超えました({spread_pips}pips)。スキップします。")
-                                next_trade["status"] = "スキップ (スプレッド上限)"
-                                send_discord(
-                                    f"⚠️ {next_trade['pair_api']}はスプレッドが広いためスキップしました: {spread_pips} pips"
-                                )
-                                save_statuses(trades_from_csv)
-                                continue
+            save_statuses(book)
 
-                        entry_dt = datetime.combine(
-                            datetime.now(TIMEZONE_TOKYO).date(),
-                            _parse_hhmmss(next_trade["entry_time_str"]),
-                            tzinfo=TIMEZONE_TOKYO,
-                        )
-                        retry_deadline = entry_dt + timedelta(seconds=3)
-                        order_result = None
-                        for attempt in range(2):
-                            if datetime.now(TIMEZONE_TOKYO) > retry_deadline:
-                                break
-                            order_result = await asyncio.to_thread(
-                                client.place_order,
-                                pair_name=next_trade["pair_api"],
-                                uic=uic,
-                                asset_type=asset_type,
-                                side=next_trade["direction_api"],
-                                amount=lot_to_amount(next_trade["lot_size"]),
-                                current_price_for_sl_tp=current_mid_price,
-                                external_reference=make_external_reference(next_trade["id"], "entry"),
-                            )
-                            if order_result and order_result.get("order_id"):
-                                break
-                            if order_result and order_result.get("status") == "unknown":
-                                break
-                            if attempt == 0 and datetime.now(TIMEZONE_TOKYO) <= retry_deadline:
-                                log(f"{trade_label} のエントリー再試行を2秒後に実行します。")
-                                await asyncio.sleep(2)
-                        if order_result and order_result.get("order_id"):
-                            next_trade["entry_order_id"] = order_result["order_id"]
-                            next_trade["status"] = "エントリー発注済み"
-                            save_statuses(trades_from_csv)
-                            task = asyncio.create_task(
-                                confirm_entry_fill(next_trade, order_result["order_id"], uic, current_bid, current_ask)
-                            )
-                            pending_confirmation_tasks.append(task)
-
-                        elif order_result and order_result.get("status") == "unknown":
-                            log(f"❌ 注文の成否が不明なため停止: {trade_label}")
-                            next_trade["status"] = "エントリー失敗 (不明状態)"
-                            send_discord(
-                                "🚨 注文の成否が不明なため自動処理を停止します。\n"
-                                f"取引: {trade_label}\n"
-                                f"ExternalReference: {order_result.get('external_reference')}\n"
-                                "手動での注文/ポジション確認が必要です。"
-                            )
-                            save_statuses(trades_from_csv)
-                            break
-
-                        else:
-                            if datetime.now(TIMEZONE_TOKYO) > retry_deadline:
-                                log(f"❌ エントリー失敗: {trade_label}（再発注猶予3秒を超過）")
-                                next_trade["status"] = "エントリー失敗 (時間超過)"
-                            else:
-                                log(f"❌ エントリー失敗: {trade_label}")
-                                next_trade["status"] = "エントリー失敗"
-
-                    save_statuses(trades_from_csv)
-                else:
-                    if not any(t.get("status") in ["エントリー済み", "エントリー発注済み", "決済発注済み"] for t in trades_from_csv):
-                        log("本日の全取引が終了しました。")
-                        break
+        for trade in book.with_status(*OPEN_TRADE_STATUSES):
+            if trade.exit_order_id is None:
+                schedule_exit(trade)
+        for trade in book.with_status(TradeStatus.EXIT_ORDERED):
+            # 再起動前に発注済みの決済注文は約定確認だけを引き継ぐ
+            if not trade.exit_order_id:
+                continue
+            task = asyncio.create_task(confirm_exit_fill(trade, trade.exit_order_id, time.monotonic()))
+            pending_confirmation_tasks.append(task)
+        for trade in book.with_status(TradeStatus.PENDING):
+            schedule_entry(trade)
 
-            await asyncio.sleep(1)
+        await scheduler.wait_idle()
+        set_log_context()
+        if not halted:
+            log("本日の全取引が終了しました。")
 
         if pending_confirmation_tasks:
             await asyncio.gather(*pending_confirmation_tasks, return_exceptions=True)
@@ -3074,39 +6789,146 @@ async def main():
         summary_msg += "|通貨ペア | 売買方向 | エントリー価格 | 決済価格 | 損益pips |\n"
         summary_msg += "|---|---|---|---|---|\n"
 
+        unpriced = [
+            t
+            for t in book.with_status(TradeStatus.CLOSED_PRICE_UNKNOWN, TradeStatus.CLOSED_BEFORE_EXIT)
+            if t.position_id and t.exit_fill_price is None
+        ]
+        if unpriced:
+            await asyncio.to_thread(client.closed_positions.refresh)
+            for trade_result in unpriced:
+                closed = client.closed_positions.find_by_opening_position_id(trade_result.position_id, refresh=False)
+                closing_price = (closed or {}).get("ClosedPosition", {}).get("ClosingPrice")
+                if closing_price is None:
+                    continue
+                trade_result.exit_fill_price = Decimal(str(closing_price))
+                if trade_result.entry_fill_price:
+                    trade_result.pips_profit = calculate_pips_profit(
+                        trade_result.pair_api,
+                        Decimal(str(trade_result.entry_fill_price)),
+                        trade_result.exit_fill_price,
+                        trade_result.direction_api,
+                    )
+                log(f"ClosedPositionsから決済価格を補完しました: {trade_result.label} 価格={closing_price}")
+
         total_pips_profit = Decimal("0")
-        for trade_result in trades_from_csv:
-            if trade_result.get("status") in ["決済済み", "決済済み (価格不明)"]:
-                pips = Decimal(str(trade_result.get("pips_profit", "0")))
+        for trade_result in book:
+            if trade_result.status in SETTLED_TRADE_STATUSES or (
+                trade_result.status == TradeStatus.CLOSED_BEFORE_EXIT and trade_result.exit_fill_price is not None
+            ):
+                pips = Decimal(str(trade_result.pips_profit or "0"))
                 total_pips_profit += pips
                 summary_msg += "| {} | {} | {} | {} | {:.1f} |\n".format(
-                    trade_result["pair_raw"],
-                    trade_result["direction_api"],
-                    format_price_for_display(trade_result.get("entry_fill_price"), trade_result["pair_api"], uic_map),
-                    format_price_for_display(trade_result.get("exit_fill_price"), trade_result["pair_api"], uic_map),
+                    trade_result.pair_raw,
+                    trade_result.direction_api,
+                    format_price_for_display(trade_result.entry_fill_price, trade_result.pair_api, uic_map),
+                    format_price_for_display(trade_result.exit_fill_price, trade_result.pair_api, uic_map),
                     pips,
                 )
         summary_msg += "\n合計損益pips: {:.1f}\n".format(total_pips_profit)
         if final_balance is not None and final_currency:
             summary_msg += f"FX口座残高: {final_balance} {final_currency}"
+
+        for title, attr, stages in (
+            ("エントリー", "entry_latency_ms", ENTRY_STAGES),
+            ("決済", "exit_latency_ms", EXIT_STAGES),
+        ):
+            latency_lines = summarize_stage_latencies((getattr(t, attr) for t in book), stages)
+            if latency_lines:
+                summary_msg += f"\n\nレイテンシ ({title}):\n" + "\n".join(latency_lines)
+        for title, attr in (("エントリー", "entry_arrival_error_ms"), ("決済", "exit_arrival_error_ms")):
+            arrival_errors = sorted(getattr(t, attr) for t in book if getattr(t, attr) is not None)
+            if arrival_errors:
+                summary_msg += (
+                    f"\n\n到達誤差 ({title}): p50={_percentile(arrival_errors, 50):+.1f} "
+                    f"p90={_percentile(arrival_errors, 90):+.1f} max={arrival_errors[-1]:+.1f} ms (n={len(arrival_errors)})"
+                )
+        summary_msg += f"\nブローカー時計: {client.broker_clock.describe()}"
+        fire_lines = scheduler.histogram_lines()
+        if fire_lines:
+            summary_msg += "\n\n発火誤差:\n" + "\n".join(fire_lines)
         send_discord(summary_msg)
 
-        if os.path.exists(STATUS_FILE):
-            os.remove(STATUS_FILE)
-            log(f"日次サマリー送信後、{STATUS_FILE} を削除しました。")
-        completed_all_trades = True
+        trade_journal.clear()
+        log(f"日次サマリー送信後、{STATUS_FILE} を削除しました。")
+        return halted
+
+    async def rotate_ens_journal() -> None:
+        # ENSジャーナルを新しい日付のファイルへ切り替える。古い日付のファイルの削除(keep_days)も open_for_today で行われる
+        old_journal = ens_client.journal
+        try:
+            new_journal = await asyncio.to_thread(EnsMessageJournal.open_for_today)
+        except Exception as e:
+            log(f"ENSジャーナルの切り替えに失敗しました。前日のファイルへの書き込みを続けます: {e}", level="ERROR")
+            return
+        if client.streaming_context_id:
+            new_journal.begin_context(client.streaming_context_id, client.ens_subscription_id, client.ens_reference_id)
+        # 受信ループは同じイベントループ上で動くため、ここでの差し替えと書き込みが混ざることはない
+        ens_client.journal = new_journal
+        await asyncio.to_thread(old_journal.close)
+        log(f"ENSジャーナルを切り替えました: {new_journal.path}")
+
+    async def next_trading_day() -> Optional[TradeBook]:
+        # JSTの日付が変わり SAXO_DAEMON_ROLLOVER_TIME を過ぎるまで待ってから取引ファイルを読み直す
+        now = datetime.now(TIMEZONE_TOKYO)
+        rollover = datetime.combine(
+            now.date() + timedelta(days=1), _parse_hhmmss(CFG.daemon_rollover_time), tzinfo=TIMEZONE_TOKYO
+        )
+        log(f"常駐モード: 次の取引日 {rollover.strftime('%Y-%m-%d %H:%M:%S')} まで待機します。")
+        while True:
+            remaining = (rollover - datetime.now(TIMEZONE_TOKYO)).total_seconds()
+            if remaining <= 0:
+                break
+            # 長い sleep はモノトニック時計で進むため、壁時計を見直しながら待つ
+            await asyncio.sleep(min(remaining, 60.0))
+        if ens_client is not None and ens_client.journal is not None:
+            await rotate_ens_journal()
+        next_book = await asyncio.to_thread(load_day_book, rollover.date())
+        if next_book is None:
+            log(f"{rollover.date()} は実行対象の取引がありません。")
+            return None
+        if CFG.streaming_prices_enabled and ens_client is not None:
+            next_uics = {int(t.uic) for t in next_book if t.uic is not None}
+            if next_uics and next_uics != price_uics:
+                await asyncio.to_thread(client.streaming.delete, "prices")
+                if await asyncio.to_thread(client.streaming.subscribe_prices, next_uics):
+                    price_uics.clear()
+                    price_uics.update(next_uics)
+        return next_book
+
+    completed_all_trades = False
+    try:
+        while True:
+            if book is not None:
+                completed_all_trades = False
+                halted = await run_trading_day(book)
+                completed_all_trades = True
+                if halted:
+                    if daemon:
+                        log("注文の成否が不明なため常駐モードを終了します。", level="ERROR")
+                    break
+            if not daemon:
+                break
+            book = await next_trading_day()
 
     except KeyboardInterrupt:
         log("プログラムが手動で中断されました。")
     finally:
         log("クリーンアップ処理を行います。")
 
-        if "trades_from_csv" in locals() and not completed_all_trades:
-            save_statuses(trades_from_csv)
+        if book is not None and not completed_all_trades:
+            save_statuses(book)
+        trade_journal.close()
+        if history is not None:
+            history.close()
         cleanup_edge_user_data_dir()
         if token_refresh_task:
             token_refresh_task.cancel()
         if client:
+            try:
+                await asyncio.to_thread(client.streaming.delete_all)
+            except Exception as e:
+                log(f"ストリーミングサブスクリプションの削除中にエラー: {e}")
             await asyncio.to_thread(client.delete_tokens_and_keys)
         if ens_client:
             await ens_client.disconnect()
@@ -3116,4 +6938,45 @@ async def main():
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if "--bench-frames" in sys.argv:
+        bench_args = sys.argv[sys.argv.index("--bench-frames") + 1 :]
+        for line in benchmark_frame_parser(journal_path=bench_args[0] if bench_args else None):
+            print(line)
+    elif "--bench-log" in sys.argv:
+        for line in benchmark_log_writer():
+            print(line)
+    elif "--bench-journal" in sys.argv:
+        for line in benchmark_trade_journal():
+            print(line)
+    elif "--bench-history" in sys.argv:
+        for line in benchmark_history_store():
+            print(line)
+    elif "--history" in sys.argv:
+        # 例: --history USD/JPY 09:00 exit 2026-01-01 (時刻・レッグ・開始日は省略可)
+        history_args = sys.argv[sys.argv.index("--history") + 1 :]
+        if not history_args:
+            sys.exit("通貨ペアを指定してください。例: --history USD/JPY 09:00")
+        query_rows = TradeHistoryStore(CFG.history_db_path).stage_latency(
+            history_args[0],
+            entry_time=history_args[1] if len(history_args) > 1 else None,
+            leg=history_args[2] if len(history_args) > 2 else "entry",
+            since=history_args[3] if len(history_args) > 3 else None,
+        )
+        for stage, avg, count in query_rows:
+            print(f"{stage}: 平均={avg:.1f}ms (n={count})")
+    elif "--loadtest-ens" in sys.argv:
+        # 例: --loadtest-ens 20000 chunk_size=512 disconnect_every=5000
+        loadtest_kwargs: Dict[str, Any] = {}
+        for arg in sys.argv[sys.argv.index("--loadtest-ens") + 1 :]:
+            key, _, value = arg.partition("=")
+            if not value:
+                loadtest_kwargs["messages"] = int(key)
+            else:
+                loadtest_kwargs[key] = float(value) if "." in value or key in ("rate", "heartbeat_interval") else int(value)
+        report = asyncio.run(run_ens_loadtest(**loadtest_kwargs))
+        for line in report:
+            print(line)
+        if any(line.startswith("検証: NG") for line in report):
+            sys.exit(1)
+    else:
+        asyncio.run(main(daemon=CFG.daemon_mode or "--daemon" in sys.argv))
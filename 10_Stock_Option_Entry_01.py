@@ -1,3 +1,6 @@
+import atexit
+import queue
+import threading
 import time
 import os
 import pandas as pd
@@ -43,18 +46,112 @@ CSV_FILE_PATH = "Stock_Trade_v2.csv"
 # ==========================================
 # Discord通知機能
 # ==========================================
+DISCORD_MESSAGE_LIMIT = 2000
+_discord_queue = queue.Queue(maxsize=100)
+_discord_thread = None
+
+
 def send_discord(message):
-    """Discordにメッセージを送信する"""
+    """Discordへの通知をキューに積む (送信はバックグラウンドスレッドで行い、注文処理を待たせない)"""
+    global _discord_thread
     if not DISCORD_WEBHOOK_URL:
         return
 
     print(f"[Discord送信]: {message}")
-    data = {"content": message}
+    if _discord_thread is None:
+        _discord_thread = threading.Thread(target=_discord_worker, daemon=True)
+        _discord_thread.start()
     try:
-        response = requests.post(DISCORD_WEBHOOK_URL, json=data)
-        response.raise_for_status()
-    except Exception as e:
-        print(f"Discord通知エラー: {e}")
+        _discord_queue.put_nowait(message)
+    except queue.Full:
+        print(f"Discord通知キューが満杯のため破棄しました: {message[:50]}")
+
+
+def flush_discord(timeout=10):
+    """未送信の通知を送り切るまで待つ (最大 timeout 秒)"""
+    global _discord_thread
+    if _discord_thread is None:
+        return
+    try:
+        _discord_queue.put(None, timeout=timeout)
+    except queue.Full:
+        return
+    _discord_thread.join(timeout=timeout)
+    _discord_thread = None
+
+
+def _coalesce_discord_messages(messages):
+    """2000文字を超える通知は改行位置を優先して分割し、残りは通知の区切りを保ったまま2000文字以内で1通にまとめる"""
+    pieces = []
+    for message in messages:
+        while len(message) > DISCORD_MESSAGE_LIMIT:
+            cut = message.rfind("\n", 0, DISCORD_MESSAGE_LIMIT)
+            if cut <= 0:
+                cut = DISCORD_MESSAGE_LIMIT
+            pieces.append(message[:cut])
+            message = message[cut:].lstrip("\n")
+        if message:
+            pieces.append(message)
+    batches = []
+    for piece in pieces:
+        if batches and len(batches[-1]) + 2 + len(piece) <= DISCORD_MESSAGE_LIMIT:
+            batches[-1] += "\n\n" + piece
+        else:
+            batches.append(piece)
+    return batches
+
+
+def _post_discord(session, content, max_retries=3):
+    """1通を送信する (429 は Retry-After だけ、5xx と通信エラーは最大10秒の指数バックオフで再送)"""
+    for attempt in range(max_retries + 1):
+        try:
+            response = session.post(DISCORD_WEBHOOK_URL, json={"content": content}, timeout=10)
+        except requests.exceptions.RequestException as e:
+            print(f"Discord通知エラー: {e}")
+            time.sleep(min(2**attempt, 10))
+            continue
+        if response.status_code == 429:
+            try:
+                retry_after = float(response.headers.get("Retry-After") or response.json().get("retry_after", 1))
+            except ValueError:
+                retry_after = 1.0
+            print(f"Discordのレート制限 (429)。{retry_after}秒待機後に再送します。")
+            time.sleep(retry_after)
+            continue
+        if response.status_code >= 500:
+            print(f"Discordサーバーエラー ({response.status_code})。再送します。")
+            time.sleep(min(2**attempt, 10))
+            continue
+        if response.status_code in [200, 204]:
+            return True
+        print(f"Discord通知エラー: ステータス {response.status_code} {response.text[:200]}")
+        return False
+    print(f"Discord通知の再送上限に達したため破棄しました: {content[:50]}")
+    return False
+
+
+def _discord_worker():
+    """キューの通知を keep-alive のセッションで送信する"""
+    session = requests.Session()
+    stop = False
+    while not stop:
+        pending = [_discord_queue.get()]
+        time.sleep(0.2)  # 同時に発生した通知をまとめる
+        while True:
+            try:
+                pending.append(_discord_queue.get_nowait())
+            except queue.Empty:
+                break
+        if None in pending:
+            stop = True
+            pending = [m for m in pending if m is not None]
+
+        for content in _coalesce_discord_messages(pending):
+            _post_discord(session, content)
+    session.close()
+
+
+atexit.register(flush_discord)
 
 # ==========================================
 # 認証処理 (Edgeブラウザ使用)